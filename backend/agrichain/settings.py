@@ -31,6 +31,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.QueryBudgetMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -66,6 +67,13 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Transactions take the write lock up front and wait for it, so
+        # concurrent workers (run_workers, dispatch_outbox --workers) queue
+        # instead of failing with "database is locked" on read-then-write
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
@@ -100,9 +108,83 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',  # NO AUTH for testing
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    # Keyset pagination: no COUNT(*)/OFFSET per page (?include_count=true opts in to counts)
+    'DEFAULT_PAGINATION_CLASS': 'core.pagination.KeysetPagination',
     'PAGE_SIZE': 20,
 }
 
+# Cache - local memory for development; point at Redis/Memcached in production
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'agrichain',
+    }
+}
+
+# Marketplace read cache (see marketplace.cache)
+MARKETPLACE_CACHE_ALIAS = 'default'
+MARKETPLACE_CACHE_TIMEOUT = 300
+
+# Longest delivery radius a listing may offer; bounds "deliverable to me" scans
+MARKETPLACE_MAX_DELIVERY_RADIUS_KM = 300
+
+# Stock holds (see marketplace.reservations); expired holds are released by
+# `python manage.py release_expired_holds`
+MARKETPLACE_CART_HOLD_MINUTES = 15
+MARKETPLACE_ORDER_HOLD_MINUTES = 30
+
+# Dispatched orders the buyer has not confirmed are released to the farmer
+# after this long (`python manage.py auto_release_orders`)
+MARKETPLACE_AUTO_RELEASE_DAYS = 7
+
+# Background jobs (see core.jobs), run by `python manage.py run_workers`.
+# Queues listed here run at most this many jobs at once across all workers.
+JOB_QUEUE_CONCURRENCY = {
+    'escrow': 1,
+    'assessment': 2,
+    'stellar': 1,
+}
+JOB_LEASE_SECONDS = 300
+JOB_RETRY_BACKOFF_SECONDS = 10
+JOB_RETRY_BACKOFF_MAX_SECONDS = 3600
+JOB_POLL_INTERVAL_SECONDS = 1.0
+
+# Stellar network (see core.stellar). Without a Horizon URL, operations are
+# submitted to an in-process fake; `python manage.py fake_horizon` serves one.
+STELLAR_HORIZON_URL = os.environ.get('STELLAR_HORIZON_URL', '')
+STELLAR_NETWORK_PASSPHRASE = 'Test SDF Network ; September 2015'
+STELLAR_PLATFORM_ACCOUNT = os.environ.get(
+    'STELLAR_PLATFORM_ACCOUNT', 'GAGRICHAINPLATFORMACCOUNTAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA')
+STELLAR_LOAN_POOL_ACCOUNT = os.environ.get(
+    'STELLAR_LOAN_POOL_ACCOUNT', 'GAGRICHAINLOANPOOLACCOUNTAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA')
+STELLAR_ASSET_CODE = 'KES'
+STELLAR_ASSET_ISSUER = STELLAR_PLATFORM_ACCOUNT
+# Stroops per operation, and the XLM new escrow accounts are created with
+STELLAR_BASE_FEE = 100
+STELLAR_STARTING_BALANCE = '2'
+STELLAR_TX_TIMEOUT_SECONDS = 300
+# Channel accounts (see core.channels); a lease must outlive a transaction timeout
+STELLAR_CHANNEL_LEASE_SECONDS = 900
+
+# Outbox of on-chain operations (see core.outbox), sent by
+# `python manage.py dispatch_outbox`
+OUTBOX_MAX_ATTEMPTS = 5
+
+# Escrow custody (see loans.escrow_pool): 'pooled' keeps orders and loans in
+# ESCROW_POOL_SIZE long-lived accounts, 'per_order' creates an account each
+ESCROW_MODE = 'pooled'
+ESCROW_POOL_SIZE = 8
+
+# Deposit watcher (see core.deposits), run by `python manage.py watch_deposits`
+DEPOSIT_ACCOUNTS = [STELLAR_PLATFORM_ACCOUNT]
+DEPOSIT_BATCH_SIZE = 1000
+DEPOSIT_POLL_INTERVAL_SECONDS = 1.0
+
+# Withdrawal payout runs (see core.payouts): queued withdrawals taken per run
+PAYOUT_BATCH_SIZE = 1000
+
+# Query instrumentation - requests kept per route in /api/debug/queries/
+QUERY_STATS_WINDOW = 200
+
 # CORS - Allow all for development
 CORS_ALLOW_ALL_ORIGINS = True
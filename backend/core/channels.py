@@ -0,0 +1,177 @@
+"""
+Channel accounts - parallel Stellar submission without sequence clashes.
+
+Every Stellar transaction consumes the next sequence number of its source
+account, and the network takes one transaction per source account per
+ledger. With the platform account as the only source, submission is
+serial and capped at one transaction per ledger close (~5 s).
+
+Instead, each submitting worker leases a ChannelAccount and uses it as the
+transaction source; the operations inside keep their real source
+accounts (the platform, escrow accounts, wallets), which also sign. N
+channels allow N transactions per ledger.
+
+- leasing is a compare-and-swap on the channel row (ChannelAccount
+  'lease' transition), with an expiry so a crashed worker's channel is
+  picked up again
+- the lease holder tracks the sequence number in memory and writes it
+  back with the usage counters on release; a channel taken over from an
+  expired lease, or one that gets tx_bad_seq, is re-synced from Horizon
+- pool_stats() reports utilization (also at /api/debug/channels/)
+
+Without registered channels the platform account is registered as the
+only one, which keeps submission serial.
+
+PRODUCTION NOTES:
+- Channels must be funded for fees before registering them
+  (`python manage.py channel_accounts add ADDRESS ...`)
+- Size the pool to the dispatcher worker count
+"""
+
+import os
+import socket
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Dict, Iterable, Optional
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+# Leases looked at per attempt; losing a race moves on to the next
+LEASE_CANDIDATES = 5
+
+
+def worker_name() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+class ChannelLease:
+    """A leased channel and its locally tracked sequence number."""
+
+    def __init__(self, channel, client, worker_id: str):
+        self.channel = channel
+        self.client = client
+        self.worker_id = worker_id
+        self.sequence = channel.sequence
+        self.transactions = 0
+        self.resyncs = 0
+        self.started = time.monotonic()
+
+    @property
+    def address(self) -> str:
+        return self.channel.address
+
+    def next_sequence(self) -> int:
+        """Sequence number for the next transaction (loaded from Horizon when unknown)."""
+        if self.sequence is None:
+            self.sequence = self.client.load_account(self.address)['sequence']
+        return self.sequence + 1
+
+    def consumed(self) -> None:
+        """A transaction made it into a ledger (successful or not) and used a sequence number."""
+        self.sequence = self.next_sequence()
+        self.transactions += 1
+
+    def resync(self) -> None:
+        """Reload the sequence number after tx_bad_seq."""
+        self.sequence = self.client.load_account(self.address)['sequence']
+        self.resyncs += 1
+
+    def expiring(self, margin: float = None) -> bool:
+        """Whether the lease ends within `margin` seconds (default: one transaction timeout)."""
+        margin = settings.STELLAR_TX_TIMEOUT_SECONDS if margin is None else margin
+        return timezone.now() + timedelta(seconds=margin) >= self.channel.lease_expires_at
+
+
+def add_channels(addresses: Iterable[str]) -> int:
+    """Register channel accounts; existing addresses are skipped. Returns how many were added."""
+    from .models import ChannelAccount
+
+    addresses = list(addresses)
+    existing = set(ChannelAccount.objects.filter(address__in=addresses).values_list('address', flat=True))
+    ChannelAccount.objects.bulk_create([
+        ChannelAccount(address=address) for address in dict.fromkeys(addresses) if address not in existing
+    ])
+    return len(set(addresses) - existing)
+
+
+def lease(client, worker_id: str, lease_seconds: int = None) -> Optional[ChannelLease]:
+    """Lease a free channel for `worker_id`; None when all are busy."""
+    from .models import ChannelAccount
+
+    if not ChannelAccount.objects.exists():
+        add_channels([settings.STELLAR_PLATFORM_ACCOUNT])
+
+    now = timezone.now()
+    free = Q(status='idle') | Q(status='leased', lease_expires_at__lt=now)
+    lease_seconds = lease_seconds or settings.STELLAR_CHANNEL_LEASE_SECONDS
+    # Least recently leased first spreads the work over the pool
+    candidates = ChannelAccount.objects.filter(free).order_by(F('leased_at').asc(nulls_first=True))
+    for pk, status in candidates.values_list('pk', 'status')[:LEASE_CANDIDATES]:
+        channel = ChannelAccount(pk=pk)
+        if ChannelAccount.states.advance(channel, 'lease', guard=free, leased_by=worker_id,
+                                         lease_expires_at=now + timedelta(seconds=lease_seconds)):
+            channel.refresh_from_db()
+            if status == 'leased':
+                # Taken over from a worker that died: its last sequence numbers were never saved
+                channel.sequence = None
+            return ChannelLease(channel, client, worker_id)
+    return None
+
+
+def release(channel_lease: ChannelLease) -> bool:
+    """Hand the channel back with its sequence number and usage; False if the lease was lost."""
+    from .models import ChannelAccount
+
+    return ChannelAccount.states.advance(
+        channel_lease.channel, 'release', guard=Q(leased_by=channel_lease.worker_id),
+        leased_by='',
+        lease_expires_at=None,
+        sequence=channel_lease.sequence,
+        transactions=F('transactions') + channel_lease.transactions,
+        resyncs=F('resyncs') + channel_lease.resyncs,
+        busy_seconds=F('busy_seconds') + (time.monotonic() - channel_lease.started),
+    )
+
+
+@contextmanager
+def leased(client, worker_id: str, lease_seconds: int = None):
+    """Context manager around lease()/release(); yields None when no channel is free."""
+    channel_lease = lease(client, worker_id, lease_seconds)
+    try:
+        yield channel_lease
+    finally:
+        if channel_lease is not None:
+            release(channel_lease)
+
+
+def pool_stats(now=None) -> Dict:
+    """Current and cumulative utilization of the channel pool."""
+    from .models import ChannelAccount
+
+    now = now or timezone.now()
+    channels = list(ChannelAccount.objects.order_by('created_at'))
+    busy = [channel for channel in channels
+            if channel.status == 'leased' and channel.lease_expires_at and channel.lease_expires_at >= now]
+    return {
+        'channels': len(channels),
+        'leased': len(busy),
+        'utilization': len(busy) / len(channels) if channels else 0.0,
+        'transactions': sum(channel.transactions for channel in channels),
+        'resyncs': sum(channel.resyncs for channel in channels),
+        'per_channel': [
+            {
+                'address': channel.address,
+                'leased': channel in busy,
+                'leased_by': channel.leased_by if channel in busy else '',
+                'sequence': channel.sequence,
+                'transactions': channel.transactions,
+                'resyncs': channel.resyncs,
+                'busy_seconds': round(channel.busy_seconds, 3),
+            }
+            for channel in channels
+        ],
+    }
@@ -0,0 +1,134 @@
+"""
+Conditional GET (ETag / Last-Modified) for ViewSets.
+
+Pollers re-fetch detail and list pages that rarely change. The mixin
+computes a strong ETag from the loaded rows - their `updated_at` where the
+model has one, otherwise a hash of the row's column values - before any
+serialization happens. A matching If-None-Match / If-Modified-Since gets a
+304 and the serializer never runs.
+"""
+
+import hashlib
+from calendar import timegm
+
+from django.core.exceptions import FieldDoesNotExist
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from rest_framework.response import Response
+
+
+def not_modified(request, etag=None, last_modified=None):
+    """Return a 304 response if the request's validators match, else None."""
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag=None, last_modified=None):
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def read_validators(response):
+    """Extract (etag, last_modified timestamp) from a response's headers."""
+    etag = response.get('ETag') if response.has_header('ETag') else None
+    last_modified = None
+    if response.has_header('Last-Modified'):
+        last_modified = parse_http_date_safe(response['Last-Modified'])
+    return etag, last_modified
+
+
+def _resolve(instance, path):
+    """
+    Follow a dotted attribute path without triggering lazy loads: relations
+    that were not joined (e.g. pruned by ?fields=) resolve to None, since
+    the serializer will not render them either.
+    """
+    value = instance
+    for attr in path.split('.'):
+        if value is None:
+            return None
+        try:
+            field = value._meta.get_field(attr)
+        except (AttributeError, FieldDoesNotExist):
+            field = None
+        if field is not None and field.is_relation and field.name == attr and not field.is_cached(value):
+            return None
+        value = getattr(value, attr)
+    return value
+
+
+class ConditionalGetMixin:
+    """
+    Adds ETag/Last-Modified handling to `retrieve` and `list`.
+
+    etag_fields: attribute paths hashed into the ETag. When None, every
+        concrete column of the model is hashed (content hash).
+    etag_related: extra attribute paths for related rows that the
+        serializer renders (e.g. 'farmer.updated_at'); these should be
+        covered by select_related so no query is issued.
+    last_modified_field: timestamp attribute for Last-Modified, if any.
+    """
+    etag_fields = None
+    etag_related = ()
+    last_modified_field = None
+
+    def _row_signature(self, instance):
+        if self.etag_fields is None:
+            values = [str(field.value_from_object(instance)) for field in instance._meta.concrete_fields]
+        else:
+            values = [str(_resolve(instance, path)) for path in self.etag_fields]
+        values += [str(_resolve(instance, path)) for path in self.etag_related]
+        return '|'.join(values)
+
+    def get_validators(self, request, instances, extra=''):
+        """Compute (etag, last_modified) for the rows about to be rendered."""
+        digest = hashlib.sha1()
+        # Representation varies with ?fields=/?omit=, cursors and format
+        renderer = getattr(request, 'accepted_renderer', None)
+        digest.update(f'{request.get_full_path()}|{getattr(renderer, "format", "")}|{extra}'.encode('utf-8'))
+        last_modified = None
+        for instance in instances:
+            digest.update(b'\x00' + self._row_signature(instance).encode('utf-8'))
+            if self.last_modified_field:
+                stamp = getattr(instance, self.last_modified_field)
+                if stamp and (last_modified is None or stamp > last_modified):
+                    last_modified = stamp
+        etag = quote_etag(digest.hexdigest())
+        if last_modified is not None:
+            last_modified = timegm(last_modified.utctimetuple())
+        return etag, last_modified
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag, last_modified = self.get_validators(request, [instance])
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+
+        serializer = self.get_serializer(instance)
+        return set_validators(Response(serializer.data), etag, last_modified)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        rows = page if page is not None else list(queryset)
+
+        # Lists only get an ETag: a row leaving the page would not move
+        # any remaining row's updated_at, so Last-Modified could lie.
+        count = getattr(self.paginator, 'count', None) if page is not None else None
+        etag, _ = self.get_validators(request, rows, extra=count)
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+
+        serializer = self.get_serializer(rows, many=True)
+        if page is not None:
+            response = self.get_paginated_response(serializer.data)
+        else:
+            response = Response(serializer.data)
+        return set_validators(response, etag)
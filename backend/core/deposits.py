@@ -0,0 +1,259 @@
+"""
+Deposit watcher - credits payments into the platform's Stellar accounts.
+
+`python manage.py watch_deposits` follows Horizon's payment history for
+each account in DEPOSIT_ACCOUNTS. Every incoming payment of the platform
+asset is credited to a user's wallet as a ledger 'deposit' journal:
+
+- the payer is found by the payment's memo (User.deposit_memo), else by
+  the paying account (User.wallet_address). Payments from an unknown
+  payer are kept as unmatched Deposits for support. Other assets, and
+  amounts below the ledger's smallest unit, are kept as ignored
+- it runs on asyncio: one fetcher per account pages through the history
+  (up to 200 records a request) while one poster credits what has been
+  fetched, so the next pages download while a batch is being written.
+  Horizon calls and database work run in threads, as both are blocking
+- a batch is one database transaction: the Deposit rows, every credit
+  (one balance UPDATE and one INSERT of legs, see core.ledger.post_many)
+  and the accounts' paging cursors. A restart resumes from the saved
+  cursor, so nothing is rescanned and nothing is credited twice
+- cursors advance by compare-and-swap from the value the batch was
+  fetched at, so a second watcher on the same account fails its batch
+  instead of crediting it again
+
+Horizon can also stream these records as server-sent events; polling
+pages from a cursor returns the same records and keeps resuming simple.
+Locally, `python manage.py fake_horizon --replay FILE` serves recorded
+payments.
+
+PRODUCTION NOTES:
+- Run a single watcher; alert on unmatched deposits
+- Payments between the platform's own accounts are skipped, so outbox
+  traffic is never mistaken for a deposit
+"""
+
+import asyncio
+import logging
+from decimal import ROUND_DOWN, Decimal
+from typing import Dict, Iterable, List, NamedTuple, Sequence
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import ledger
+from .stellar import MAX_PAGE_SIZE, HorizonUnavailable
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_TYPES = ('payment', 'path_payment_strict_receive', 'path_payment_strict_send')
+
+# Smallest amount the ledger holds (two decimal places)
+LEDGER_QUANTUM = Decimal('0.01')
+
+# Fetched pages waiting for the poster, per watcher; fetchers pause beyond this
+QUEUED_PAGES = 20
+
+
+class CursorConflict(Exception):
+    """Raised when another watcher moved a stream's cursor first."""
+
+
+class Page(NamedTuple):
+    """Payment records of `account` fetched after cursor `after`."""
+    account: str
+    after: str
+    records: List[Dict]
+
+    @property
+    def cursor(self) -> str:
+        return self.records[-1]['paging_token'] if self.records else self.after
+
+
+class IngestResult(NamedTuple):
+    credited: int = 0
+    unmatched: int = 0
+    ignored: int = 0
+
+    def __add__(self, other):
+        return IngestResult(*(mine + theirs for mine, theirs in zip(self, other)))
+
+
+def stream_name(account: str) -> str:
+    return f'payments:{account}'
+
+
+def load_cursor(account: str) -> str:
+    """Where the watcher of `account` resumes (start of history the first time)."""
+    from .models import IngestCursor
+
+    return IngestCursor.objects.get_or_create(name=stream_name(account))[0].cursor
+
+
+def _own_accounts() -> set:
+    return {settings.STELLAR_PLATFORM_ACCOUNT, settings.STELLAR_LOAN_POOL_ACCOUNT}
+
+
+def _is_deposit(account: str, record: Dict, own: set) -> bool:
+    return record.get('type') in PAYMENT_TYPES and record.get('to') == account and record.get('from') not in own
+
+
+def _memo(record: Dict) -> str:
+    return (record.get('transaction') or {}).get('memo') or ''
+
+
+def _match(records: Sequence[Dict]) -> Dict[str, object]:
+    """User id per memo and per wallet address among `records` (one query)."""
+    from .models import User
+
+    memos = {_memo(record) for record in records} - {''}
+    sources = {record['from'] for record in records}
+    users = {}
+    for pk, memo, address in User.objects.filter(
+            Q(deposit_memo__in=memos) | Q(wallet_address__in=sources)).values_list(
+            'pk', 'deposit_memo', 'wallet_address'):
+        users.setdefault(('memo', memo), pk)
+        users.setdefault(('wallet', address), pk)
+    return users
+
+
+def ingest(pages: Sequence[Page]) -> IngestResult:
+    """
+    Credit the deposits in `pages` and move each account's cursor past
+    them, in one transaction. Raises CursorConflict, crediting nothing,
+    if a cursor is no longer where the pages were fetched from.
+    """
+    from .models import Deposit, IngestCursor
+
+    own = _own_accounts()
+    moves: Dict[str, List[str]] = {}
+    records = []
+    for page in pages:
+        moves.setdefault(page.account, [page.after, page.after])[1] = page.cursor
+        records += [(page.account, record) for record in page.records if _is_deposit(page.account, record, own)]
+
+    users = _match([record for _, record in records])
+    deposits, journals = [], []
+    counts = {'credited': 0, 'unmatched': 0, 'ignored': 0}
+    for account, record in records:
+        amount = Decimal(record['amount'])
+        credit = amount.quantize(LEDGER_QUANTUM, rounding=ROUND_DOWN)
+        memo = _memo(record)
+        user_id = None
+        if (record.get('asset_code'), record.get('asset_issuer')) != (
+                settings.STELLAR_ASSET_CODE, settings.STELLAR_ASSET_ISSUER) or credit <= 0:
+            status = 'ignored'
+        else:
+            user_id = users.get(('memo', memo)) if memo else None
+            user_id = user_id or users.get(('wallet', record['from']))
+            status = 'credited' if user_id else 'unmatched'
+        counts[status] += 1
+        deposit = Deposit(
+            payment_id=record['id'], account=account, source=record['from'], amount=amount,
+            asset_code=record.get('asset_code', ''), memo=memo[:64], tx_hash=record['transaction_hash'],
+            user_id=user_id, status=status,
+        )
+        deposits.append(deposit)
+        if status == 'credited':
+            description = f'Deposit from {record["from"]}'
+            journals.append(ledger.Journal(
+                legs=[
+                    ledger.user_leg(user_id, ledger.WALLET, credit, 'deposit', description),
+                    ledger.system_leg(ledger.EXTERNAL, -credit, 'deposit', description),
+                ],
+                reference_type='deposit',
+                reference_id=deposit.id,
+                stellar_tx_hash=record['transaction_hash'],
+            ))
+
+    with transaction.atomic():
+        # Cursors first: a concurrent watcher blocks here rather than after crediting
+        for account, (after, cursor) in moves.items():
+            if cursor != after and not IngestCursor.objects.filter(name=stream_name(account), cursor=after).update(
+                    cursor=cursor, updated_at=timezone.now()):
+                raise CursorConflict(f'Cursor of {account} moved past {after} in another watcher')
+        Deposit.objects.bulk_create(deposits)
+        ledger.post_many(journals)
+    if counts['unmatched']:
+        logger.warning('%d deposits matched no user', counts['unmatched'])
+    return IngestResult(**counts)
+
+
+async def _pause(stop: asyncio.Event, seconds: float) -> None:
+    try:
+        await asyncio.wait_for(stop.wait(), seconds)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def _fetch(client, account: str, cursor: str, queue: asyncio.Queue, stop: asyncio.Event,
+                 page_size: int, poll_interval: float, once: bool) -> None:
+    """Queue `account`'s payment pages from `cursor` on; a None marks the end."""
+    try:
+        while not stop.is_set():
+            try:
+                records = await asyncio.to_thread(client.payments, account, cursor, page_size)
+            except HorizonUnavailable as exc:
+                logger.warning('Fetching payments of %s failed (%s); retrying', account, exc)
+                await _pause(stop, poll_interval)
+                continue
+            if records:
+                page = Page(account, cursor, records)
+                await queue.put(page)
+                cursor = page.cursor
+            if len(records) < page_size:
+                # Caught up with the ledger
+                if once:
+                    break
+                await _pause(stop, poll_interval)
+    except Exception:
+        await queue.put(None)
+        raise
+    await queue.put(None)
+
+
+async def watch(client, accounts: Iterable[str] = None, *, batch_size: int = None, page_size: int = MAX_PAGE_SIZE,
+                poll_interval: float = None, stop: asyncio.Event = None, once: bool = False) -> IngestResult:
+    """
+    Credit deposits to `accounts` (default DEPOSIT_ACCOUNTS) until `stop`
+    is set, or, with `once`, until every account is caught up. Batches
+    hold about `batch_size` payment records.
+    """
+    accounts = list(accounts or settings.DEPOSIT_ACCOUNTS)
+    batch_size = batch_size or settings.DEPOSIT_BATCH_SIZE
+    poll_interval = settings.DEPOSIT_POLL_INTERVAL_SECONDS if poll_interval is None else poll_interval
+    stop = stop or asyncio.Event()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUED_PAGES)
+    post = sync_to_async(ingest, thread_sensitive=True)
+
+    cursors = {account: await sync_to_async(load_cursor, thread_sensitive=True)(account) for account in accounts}
+    fetchers = [
+        asyncio.create_task(_fetch(client, account, cursors[account], queue, stop, page_size, poll_interval, once))
+        for account in accounts
+    ]
+    total = IngestResult()
+    try:
+        running = len(fetchers)
+        while running:
+            pages, size = [], 0
+            page = await queue.get()
+            while True:
+                if page is None:
+                    running -= 1
+                else:
+                    pages.append(page)
+                    size += len(page.records)
+                if size >= batch_size or queue.empty():
+                    break
+                page = queue.get_nowait()
+            if pages:
+                total += await post(pages)
+        # Surface a fetcher's failure
+        await asyncio.gather(*fetchers)
+    finally:
+        for fetcher in fetchers:
+            fetcher.cancel()
+        await sync_to_async(connections.close_all, thread_sensitive=True)()
+    return total
@@ -0,0 +1,105 @@
+"""
+Offline gazetteer of Kenyan counties and towns.
+
+Coordinates are (latitude, longitude) of each county headquarters or town
+centre, accurate to roughly a kilometre - plenty for delivery-radius
+matching. County names resolve to their headquarters. Keys are lowercase
+with punctuation removed (see core.geo.normalize_place).
+"""
+
+# County headquarters
+COUNTIES = {
+    'mombasa': (-4.0435, 39.6682),
+    'kwale': (-4.1737, 39.4521),
+    'kilifi': (-3.6305, 39.8499),
+    'tana river': (-1.5000, 40.0333),
+    'lamu': (-2.2717, 40.9020),
+    'taita taveta': (-3.4000, 38.3667),
+    'garissa': (-0.4532, 39.6461),
+    'wajir': (1.7471, 40.0573),
+    'mandera': (3.9366, 41.8670),
+    'marsabit': (2.3284, 37.9899),
+    'isiolo': (0.3546, 37.5822),
+    'meru': (0.0470, 37.6498),
+    'tharaka nithi': (-0.3333, 37.6500),
+    'embu': (-0.5310, 37.4500),
+    'kitui': (-1.3667, 38.0167),
+    'machakos': (-1.5177, 37.2634),
+    'makueni': (-1.7833, 37.6333),
+    'nyandarua': (-0.2706, 36.3800),
+    'nyeri': (-0.4201, 36.9476),
+    'kirinyaga': (-0.4989, 37.2803),
+    'muranga': (-0.7210, 37.1526),
+    'kiambu': (-1.1714, 36.8356),
+    'turkana': (3.1191, 35.5973),
+    'west pokot': (1.2389, 35.1119),
+    'samburu': (1.0968, 36.6980),
+    'trans nzoia': (1.0157, 35.0062),
+    'uasin gishu': (0.5143, 35.2698),
+    'elgeyo marakwet': (0.6703, 35.5081),
+    'nandi': (0.2039, 35.1050),
+    'baringo': (0.4919, 35.7430),
+    'laikipia': (0.2725, 36.5381),
+    'nakuru': (-0.3031, 36.0800),
+    'narok': (-1.0800, 35.8600),
+    'kajiado': (-1.8524, 36.7768),
+    'kericho': (-0.3689, 35.2863),
+    'bomet': (-0.7813, 35.3416),
+    'kakamega': (0.2827, 34.7519),
+    'vihiga': (0.0500, 34.7167),
+    'bungoma': (0.5635, 34.5606),
+    'busia': (0.4608, 34.1115),
+    'siaya': (0.0607, 34.2881),
+    'kisumu': (-0.0917, 34.7680),
+    'homa bay': (-0.5273, 34.4571),
+    'migori': (-1.0634, 34.4731),
+    'kisii': (-0.6817, 34.7667),
+    'nyamira': (-0.5633, 34.9358),
+    'nairobi': (-1.2864, 36.8172),
+}
+
+# Towns that are not (or not named after) a county headquarters
+TOWNS = {
+    'eldoret': (0.5143, 35.2698),
+    'thika': (-1.0333, 37.0693),
+    'kitale': (1.0157, 35.0062),
+    'malindi': (-3.2192, 40.1169),
+    'naivasha': (-0.7167, 36.4333),
+    'nanyuki': (0.0167, 37.0667),
+    'nyahururu': (0.0389, 36.3622),
+    'molo': (-0.2489, 35.7322),
+    'limuru': (-1.1136, 36.6422),
+    'ruiru': (-1.1466, 36.9609),
+    'kitengela': (-1.4762, 36.9589),
+    'athi river': (-1.4560, 36.9780),
+    'webuye': (0.6167, 34.7667),
+    'voi': (-3.3961, 38.5561),
+    'wote': (-1.7833, 37.6333),
+    'hola': (-1.5000, 40.0333),
+    'chuka': (-0.3333, 37.6500),
+    'kerugoya': (-0.4989, 37.2803),
+    'ol kalou': (-0.2706, 36.3800),
+    'kapenguria': (1.2389, 35.1119),
+    'iten': (0.6703, 35.5081),
+    'kapsabet': (0.2039, 35.1050),
+    'kabarnet': (0.4919, 35.7430),
+    'rumuruti': (0.2725, 36.5381),
+    'maralal': (1.0968, 36.6980),
+    'lodwar': (3.1191, 35.5973),
+    'mbale': (0.0500, 34.7167),
+    'mwatate': (-3.5050, 38.3780),
+    'awendo': (-0.9050, 34.5370),
+    'keroka': (-0.7760, 34.9460),
+    'mumias': (0.3360, 34.4880),
+    'bondo': (-0.0990, 34.2710),
+    'karatina': (-0.4830, 37.1270),
+    'mwea': (-0.6940, 37.3510),
+    'emali': (-2.0830, 37.4700),
+    'mtwapa': (-3.9400, 39.7470),
+    'ukunda': (-4.2870, 39.5660),
+    'kikuyu': (-1.2460, 36.6630),
+    'juja': (-1.1010, 37.0140),
+    'ngong': (-1.3620, 36.6560),
+}
+
+PLACES = {**COUNTIES, **TOWNS}
@@ -0,0 +1,185 @@
+"""
+Geocoding and spatial lookups for delivery-radius matching.
+
+- geocode() resolves free-text places ("Nakuru County, Kenya") against the
+  offline Kenyan gazetteer in core.gazetteer - no network calls.
+- Rows with coordinates also store a geohash. A radius query is answered
+  by covering the circle's bounding box with a handful of geohash cells
+  and turning each cell into an index range scan (geohash >= cell AND
+  geohash < cell + '~'), so only rows near the point are read. Exact
+  great-circle distance is then computed in SQL for those candidates only.
+- Nearest-k widens the radius geometrically until k rows are found; every
+  step is an exact radius query, so the result is the true k nearest.
+"""
+
+import math
+import re
+from typing import Iterable, List, Optional, Set, Tuple
+
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import ASin, Cos, Power, Radians, Sin, Sqrt
+
+from .gazetteer import PLACES
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Stored precision: 7 characters is a ~150 m cell
+GEOHASH_PRECISION = 7
+
+# Upper bound on cells per radius query; precision drops until the cover fits
+MAX_COVER_CELLS = 16
+
+# Radii tried by nearest(), in km. The last one spans Kenya.
+NEAREST_RADII_KM = (5, 15, 40, 100, 250, 600, 1500)
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_PLACE_RE = re.compile(r"[^a-z0-9 ]+")
+_LONGEST_PLACE = max(len(name.split()) for name in PLACES)
+
+Coordinates = Tuple[float, float]
+
+
+def normalize_place(text: str) -> str:
+    text = (text or '').lower().replace("'", '').replace('-', ' ')
+    return ' '.join(_PLACE_RE.sub(' ', text).split())
+
+
+def geocode(text: str) -> Optional[Coordinates]:
+    """
+    Resolve a free-text location to (lat, lon) using the gazetteer.
+
+    The longest known place name appearing in the text wins, so
+    "Molo, Nakuru County" resolves to Molo, not Nakuru. Returns None when
+    nothing matches.
+    """
+    words = normalize_place(text).split()
+    for size in range(min(_LONGEST_PLACE, len(words)), 0, -1):
+        for start in range(len(words) - size + 1):
+            coordinates = PLACES.get(' '.join(words[start:start + size]))
+            if coordinates is not None:
+                return coordinates
+    return None
+
+
+def geocode_first(*texts: str) -> Optional[Coordinates]:
+    """Geocode the first of `texts` that resolves."""
+    for text in texts:
+        coordinates = geocode(text)
+        if coordinates is not None:
+            return coordinates
+    return None
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+def encode_geohash(lat: float, lon: float, precision: int = GEOHASH_PRECISION) -> str:
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        interval, coordinate = (lon_range, lon) if even else (lat_range, lat)
+        mid = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= mid:
+            value |= 1
+            interval[0] = mid
+        else:
+            interval[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def point_fields(coordinates: Optional[Coordinates]) -> dict:
+    """latitude/longitude/geohash column values for a row located at `coordinates`."""
+    if coordinates is None:
+        return {'latitude': None, 'longitude': None, 'geohash': ''}
+    lat, lon = coordinates
+    return {'latitude': lat, 'longitude': lon, 'geohash': encode_geohash(lat, lon)}
+
+
+def cell_size(precision: int) -> Coordinates:
+    """(height, width) in degrees of a geohash cell at `precision`."""
+    total_bits = 5 * precision
+    lon_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def bounding_box(lat: float, lon: float, radius_km: float) -> Tuple[float, float, float, float]:
+    """(south, west, north, east) of a circle, clamped to valid coordinates."""
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    dlon = math.degrees(radius_km / (EARTH_RADIUS_KM * max(math.cos(math.radians(lat)), 1e-6)))
+    return max(lat - dlat, -90.0), max(lon - dlon, -180.0), min(lat + dlat, 90.0), min(lon + dlon, 180.0)
+
+
+def _steps(start: float, stop: float, step: float) -> Iterable[float]:
+    value = start
+    while value < stop:
+        yield value
+        value += step
+    yield stop
+
+
+def cover(lat: float, lon: float, radius_km: float) -> Set[str]:
+    """
+    Geohash cells covering the circle around (lat, lon), at the finest
+    precision that needs at most MAX_COVER_CELLS cells.
+    """
+    south, west, north, east = bounding_box(lat, lon, radius_km)
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows = math.floor(north / height) - math.floor(south / height) + 1
+        columns = math.floor(east / width) - math.floor(west / width) + 1
+        if rows * columns <= MAX_COVER_CELLS or precision == 1:
+            return {
+                encode_geohash(cell_lat, cell_lon, precision)
+                for cell_lat in _steps(south, north, height)
+                for cell_lon in _steps(west, east, width)
+            }
+    return set()
+
+
+def geohash_filter(cells: Iterable[str], field: str = 'geohash') -> Q:
+    """OR of index range scans, one per cell prefix."""
+    condition = Q(pk__in=[])
+    for cell in sorted(cells):
+        condition |= Q(**{f'{field}__gte': cell, f'{field}__lt': cell + '~'})
+    return condition
+
+
+def distance_expression(lat: float, lon: float, lat_field: str = 'latitude', lon_field: str = 'longitude'):
+    """Great-circle distance in km from (lat, lon) to each row, computed in SQL."""
+    dlat = Radians(F(lat_field) - lat) / 2
+    dlon = Radians(F(lon_field) - lon) / 2
+    a = Power(Sin(dlat), 2) + math.cos(math.radians(lat)) * Cos(Radians(F(lat_field))) * Power(Sin(dlon), 2)
+    return 2 * EARTH_RADIUS_KM * ASin(Sqrt(a), output_field=FloatField())
+
+
+def within_radius(queryset, lat: float, lon: float, radius_km: float):
+    """
+    Rows of `queryset` within `radius_km` of (lat, lon), nearest first,
+    annotated with `distance_km`.
+    """
+    return queryset.filter(geohash_filter(cover(lat, lon, radius_km))).annotate(
+        distance_km=distance_expression(lat, lon)
+    ).filter(distance_km__lte=radius_km).order_by('distance_km')
+
+
+def nearest(queryset, lat: float, lon: float, k: int, max_radius_km: Optional[float] = None) -> List:
+    """The `k` rows of `queryset` nearest to (lat, lon), optionally capped at `max_radius_km`."""
+    radii = [radius for radius in NEAREST_RADII_KM if max_radius_km is None or radius < max_radius_km]
+    if max_radius_km is not None:
+        radii.append(max_radius_km)
+    rows = []
+    for radius in radii:
+        rows = list(within_radius(queryset, lat, lon, radius)[:k])
+        if len(rows) >= k:
+            break
+    return rows
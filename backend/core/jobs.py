@@ -0,0 +1,270 @@
+"""
+Database-backed background jobs - no broker, just the Job table.
+
+Register a function as a task and enqueue it from request code:
+
+    @task(queue='assessment', max_attempts=3)
+    def assess_images(farmer_id, image_ids):
+        ...
+
+    enqueue(assess_images, {'farmer_id': str(user.pk), 'image_ids': ids})
+
+Enqueueing is an INSERT in the caller's transaction, so a job exists only
+if the request that created it commits. Workers (`python manage.py
+run_workers`) then run it outside the request path:
+
+- claim with lease: picking a job is a compare-and-swap on its status
+  (the Job 'claim' transition, see core.state_machine) that stamps the
+  worker id and a lease expiry. If the worker dies mid-job, any worker
+  may claim the job again once the lease lapses.
+- retries: a failing job is re-queued with exponential backoff
+  (JOB_RETRY_BACKOFF_SECONDS doubling, capped at
+  JOB_RETRY_BACKOFF_MAX_SECONDS) until max_attempts, then marked failed.
+- priorities: higher `priority` is claimed first within a queue; queues
+  are polled in the order the worker lists them.
+- per-queue concurrency: JOB_QUEUE_CONCURRENCY caps the running jobs of
+  a queue across all workers. The cap is checked inside the claim UPDATE.
+
+Delivery is at-least-once: a job whose worker lost its lease may run
+twice, so tasks must be idempotent. Completion is recorded only by the
+worker still holding the lease.
+
+PRODUCTION NOTES:
+- On PostgreSQL, claims from concurrent workers can briefly exceed a
+  queue's cap by the number of simultaneous claims (READ COMMITTED);
+  SQLite serialises writers, so there the cap is exact
+- Prune succeeded jobs periodically
+"""
+
+import logging
+import os
+import signal
+import socket
+import threading
+import traceback
+import uuid
+from datetime import timedelta
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import LessThan
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE = 'default'
+
+# Runnable jobs looked at per claim attempt; losing a race moves on to the next
+CLAIM_CANDIDATES = 5
+
+
+class Task(NamedTuple):
+    name: str
+    func: Callable
+    queue: str
+    priority: int
+    max_attempts: int
+    lease_seconds: Optional[int]
+
+
+TASKS: Dict[str, Task] = {}
+_discovered = False
+
+
+def task(name: str = None, queue: str = DEFAULT_QUEUE, priority: int = 0, max_attempts: int = 5,
+         lease_seconds: int = None):
+    """Register the decorated function as a job task, by default under its dotted path."""
+    def register(func):
+        task_name = name or f'{func.__module__}.{func.__name__}'
+        TASKS[task_name] = Task(task_name, func, queue, priority, max_attempts, lease_seconds)
+        func.task_name = task_name
+        return func
+    return register
+
+
+def get_task(name: str) -> Optional[Task]:
+    """Look up a task, importing every installed app's `tasks` module on first use."""
+    global _discovered
+    if name not in TASKS and not _discovered:
+        autodiscover_modules('tasks')
+        _discovered = True
+    return TASKS.get(name)
+
+
+def enqueue(func_or_name, kwargs: dict = None, *, queue: str = None, priority: int = None,
+            delay: timedelta = None, max_attempts: int = None):
+    """
+    Queue a run of a task with JSON-serialisable `kwargs`. Options default
+    to the task's registration. Returns the Job.
+    """
+    from .models import Job
+
+    name = getattr(func_or_name, 'task_name', func_or_name)
+    registered = get_task(name)
+    if registered is None:
+        raise LookupError(f'Unknown task: {name}')
+    return Job.objects.create(
+        task=name,
+        kwargs=kwargs or {},
+        queue=queue or registered.queue,
+        priority=registered.priority if priority is None else priority,
+        max_attempts=max_attempts or registered.max_attempts,
+        run_at=timezone.now() + (delay or timedelta()),
+    )
+
+
+def backoff(attempts: int) -> timedelta:
+    """Delay before retry number `attempts` + 1."""
+    seconds = settings.JOB_RETRY_BACKOFF_SECONDS * 2 ** max(attempts - 1, 0)
+    return timedelta(seconds=min(seconds, settings.JOB_RETRY_BACKOFF_MAX_SECONDS))
+
+
+def _runnable(now) -> Q:
+    return Q(status='queued', run_at__lte=now) | Q(status='running', lease_expires_at__lt=now)
+
+
+def _below_limit(queue: str, now):
+    """Claim guard: fewer than the queue's cap of jobs hold a live lease."""
+    from .models import Job
+
+    limit = settings.JOB_QUEUE_CONCURRENCY.get(queue)
+    if limit is None:
+        return None
+    running = (
+        Job.objects.filter(queue=OuterRef('queue'), status='running', lease_expires_at__gte=now)
+        .order_by().values('queue').annotate(count=Count('pk')).values('count')
+    )
+    return LessThan(Coalesce(Subquery(running, output_field=IntegerField()), Value(0)), limit)
+
+
+def claim(queues: Iterable[str], worker_id: str):
+    """
+    Lease the next runnable job from `queues` (polled in order) for
+    `worker_id`. Returns the Job, or None when nothing is runnable.
+    """
+    from .models import Job
+
+    for queue in queues:
+        now = timezone.now()
+        limit = _below_limit(queue, now)
+        candidates = (
+            Job.objects.filter(_runnable(now), queue=queue)
+            .order_by('-priority', 'run_at', 'created_at')
+            .values_list('pk', 'task')[:CLAIM_CANDIDATES]
+        )
+        for pk, name in candidates:
+            registered = get_task(name)
+            lease = (registered and registered.lease_seconds) or settings.JOB_LEASE_SECONDS
+            guard = _runnable(now)
+            if limit is not None:
+                guard &= Q(limit)
+            job = Job(pk=pk)
+            if Job.states.advance(job, 'claim', guard=guard, locked_by=worker_id,
+                                  lease_expires_at=now + timedelta(seconds=lease),
+                                  attempts=F('attempts') + 1):
+                job.refresh_from_db()
+                return job
+            if limit is not None and job.status == 'queued':
+                # Lost to the concurrency cap rather than to another worker
+                break
+    return None
+
+
+def run_job(job, worker_id: str) -> bool:
+    """
+    Run a claimed job and record the outcome, unless this worker's lease
+    was taken over meanwhile. Returns True on success.
+    """
+    from .models import Job
+
+    held = Q(locked_by=worker_id)
+    registered = get_task(job.task)
+    try:
+        if registered is None:
+            raise LookupError(f'Unknown task: {job.task}')
+        registered.func(**job.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning('Job %s (%s) attempt %d failed', job.pk, job.task, job.attempts, exc_info=True)
+        if job.attempts >= job.max_attempts:
+            Job.states.advance(job, 'fail', guard=held, last_error=error, lease_expires_at=None)
+        else:
+            Job.states.advance(job, 'retry', guard=held, last_error=error, locked_by='',
+                               lease_expires_at=None, run_at=timezone.now() + backoff(job.attempts))
+        return False
+
+    Job.states.advance(job, 'succeed', guard=held, last_error='', lease_expires_at=None)
+    return True
+
+
+class Worker:
+    """Claims and runs jobs from `queues` until stopped."""
+
+    def __init__(self, queues: List[str], poll_interval: float = None):
+        self.queues = queues
+        self.poll_interval = settings.JOB_POLL_INTERVAL_SECONDS if poll_interval is None else poll_interval
+        self.id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+    def run_once(self) -> bool:
+        """Run one job if any is runnable. Returns whether a job was run."""
+        close_old_connections()
+        job = claim(self.queues, self.id)
+        if job is None:
+            return False
+        run_job(job, self.id)
+        return True
+
+    def run(self, stop: threading.Event, drain: bool = False) -> None:
+        """Loop until `stop` is set, or until the queues are empty when `drain` is set."""
+        try:
+            while not stop.is_set():
+                if not self.run_once():
+                    if drain:
+                        return
+                    stop.wait(self.poll_interval)
+        finally:
+            connections.close_all()
+
+
+def run_pool(queues: List[str], concurrency: int, mode: str = 'thread', drain: bool = False,
+             poll_interval: float = None) -> None:
+    """
+    Run `concurrency` workers as threads or forked processes until
+    SIGINT/SIGTERM (or until the queues drain, with `drain`).
+    """
+    if mode == 'process':
+        import multiprocessing
+        context = multiprocessing.get_context('fork')
+        stop = context.Event()
+        # Children must not share the parent's database connections
+        connections.close_all()
+        runners = [context.Process(target=_process_main, args=(queues, stop, drain, poll_interval))
+                   for _ in range(concurrency)]
+    else:
+        stop = threading.Event()
+        runners = [threading.Thread(target=Worker(queues, poll_interval).run, args=(stop, drain))
+                   for _ in range(concurrency)]
+
+    def shutdown(signum, frame):
+        logger.info('Stopping workers after their current job')
+        stop.set()
+
+    previous = {signum: signal.signal(signum, shutdown) for signum in (signal.SIGINT, signal.SIGTERM)}
+    try:
+        for runner in runners:
+            runner.start()
+        for runner in runners:
+            runner.join()
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+
+
+def _process_main(queues, stop, drain, poll_interval):
+    # The parent handles signals and sets `stop`
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    Worker(queues, poll_interval).run(stop, drain)
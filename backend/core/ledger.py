@@ -0,0 +1,213 @@
+"""
+Ledger Engine - Double-entry postings for wallet and escrow balances.
+
+Every balance movement is a journal of legs that sum to zero. User legs
+touch `User.wallet_balance` / `User.escrow_balance`; system legs stand for
+money outside a user's account (the lending pool, on-chain/external funds).
+Each leg is recorded as one append-only `Transaction` row, so summing a
+user's transactions per account always reproduces the stored balance.
+
+Balances are changed with a single conditional UPDATE per posting batch
+(`F()` arithmetic + guard clauses) instead of load/modify/`user.save()`,
+so concurrent payments cannot lose updates and never rewrite the full
+User row.
+
+PRODUCTION NOTES:
+- Each journal maps to one Stellar transaction; its legs become operations
+- The journal's stellar_tx_hash would be the submitted transaction hash
+"""
+
+import secrets
+import uuid
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Q, Value, When
+
+# User accounts (stored on the User row)
+WALLET = 'wallet'
+ESCROW = 'escrow'
+
+# System accounts (no balance column; tracked only through their legs)
+LOAN_POOL = 'loan_pool'
+EXTERNAL = 'external'
+
+USER_ACCOUNTS = (WALLET, ESCROW)
+SYSTEM_ACCOUNTS = (LOAN_POOL, EXTERNAL)
+
+BALANCE_FIELDS = {
+    WALLET: 'wallet_balance',
+    ESCROW: 'escrow_balance',
+}
+
+
+class LedgerError(Exception):
+    """Base error for rejected postings."""
+
+
+class UnbalancedJournal(LedgerError):
+    """Raised when the legs of a journal do not sum to zero."""
+
+
+class InsufficientFunds(LedgerError):
+    """Raised when a guarded debit would exceed the available balance."""
+
+    def __init__(self, message='Insufficient funds'):
+        super().__init__(message)
+
+
+class Leg(NamedTuple):
+    """
+    One side of a journal.
+
+    `user_id` is None for system accounts. A negative amount is a debit.
+    `guard=True` makes a wallet debit conditional on the user's available
+    balance (wallet minus escrow) covering it.
+    """
+    account: str
+    amount: Decimal
+    transaction_type: str
+    user_id: Optional[uuid.UUID] = None
+    description: str = ''
+    guard: bool = False
+
+
+class Journal(NamedTuple):
+    """A balanced set of legs posted as one unit."""
+    legs: Sequence[Leg]
+    reference_type: str = ''
+    reference_id: Optional[uuid.UUID] = None
+    stellar_tx_hash: str = ''
+
+
+def user_leg(user, account: str, amount, transaction_type: str,
+             description: str = '', guard: bool = False) -> Leg:
+    """Build a leg against a user's wallet or escrow account."""
+    if account not in USER_ACCOUNTS:
+        raise LedgerError(f'Unknown user account: {account}')
+    user_id = getattr(user, 'pk', user)
+    return Leg(account, Decimal(amount), transaction_type, user_id, description, guard)
+
+
+def system_leg(account: str, amount, transaction_type: str, description: str = '') -> Leg:
+    """Build a leg against a system account."""
+    if account not in SYSTEM_ACCOUNTS:
+        raise LedgerError(f'Unknown system account: {account}')
+    return Leg(account, Decimal(amount), transaction_type, None, description)
+
+
+def _validate(journal: Journal):
+    if not journal.legs:
+        raise UnbalancedJournal('Journal has no legs')
+    total = sum((leg.amount for leg in journal.legs), Decimal('0'))
+    if total != 0:
+        raise UnbalancedJournal(f'Journal legs sum to {total}, expected 0')
+    for leg in journal.legs:
+        if leg.account in USER_ACCOUNTS and leg.user_id is None:
+            raise LedgerError(f'{leg.account} leg requires a user')
+        if leg.account in SYSTEM_ACCOUNTS and leg.user_id is not None:
+            raise LedgerError(f'{leg.account} leg cannot reference a user')
+
+
+def _apply_balance_deltas(journals: Sequence[Journal]):
+    """
+    Apply every user leg of `journals` with one UPDATE statement.
+
+    Deltas are aggregated per user and account, and guarded users get a
+    `wallet_balance >= escrow_balance + debit` clause. If any guard fails
+    the UPDATE matches fewer rows than expected and the batch is rejected.
+    """
+    from core.models import User
+
+    deltas: Dict[str, Dict[uuid.UUID, Decimal]] = {
+        account: defaultdict(Decimal) for account in USER_ACCOUNTS
+    }
+    guarded_debits: Dict[uuid.UUID, Decimal] = defaultdict(Decimal)
+
+    for journal in journals:
+        for leg in journal.legs:
+            if leg.user_id is None:
+                continue
+            deltas[leg.account][leg.user_id] += leg.amount
+            if leg.guard and leg.amount < 0:
+                guarded_debits[leg.user_id] -= leg.amount
+
+    user_ids = set(deltas[WALLET]) | set(deltas[ESCROW])
+    if not user_ids:
+        return
+
+    updates = {}
+    for account, per_user in deltas.items():
+        per_user = {pk: delta for pk, delta in per_user.items() if delta}
+        if not per_user:
+            continue
+        field = BALANCE_FIELDS[account]
+        updates[field] = F(field) + Case(
+            *[When(pk=pk, then=Value(delta)) for pk, delta in per_user.items()],
+            default=Value(Decimal('0')),
+            output_field=DecimalField(max_digits=15, decimal_places=2),
+        )
+    if not updates:
+        return
+
+    # Unguarded users go in one IN list: a long OR chain of them outgrows
+    # SQLite's expression depth limit (1000) on large batches
+    guarded = {pk for pk in user_ids if guarded_debits.get(pk)}
+    condition = Q(pk__in=user_ids - guarded)
+    for pk in guarded:
+        condition |= Q(pk=pk, wallet_balance__gte=F('escrow_balance') + guarded_debits[pk])
+
+    updated = User.objects.filter(condition).update(**updates)
+    if updated != len(user_ids):
+        raise InsufficientFunds()
+
+
+def post_many(journals: Iterable[Journal]) -> List[str]:
+    """
+    Post several journals in one round trip.
+
+    All balances move in a single UPDATE and all legs are inserted with a
+    single bulk INSERT, inside one database transaction. Either every
+    journal is posted or none is.
+
+    Returns the stellar_tx_hash of each journal, in order.
+    """
+    from core.models import Transaction
+
+    journals = list(journals)
+    for journal in journals:
+        _validate(journal)
+
+    rows = []
+    hashes = []
+    for journal in journals:
+        tx_hash = journal.stellar_tx_hash or secrets.token_hex(32)
+        journal_id = uuid.uuid4()
+        hashes.append(tx_hash)
+        for leg in journal.legs:
+            rows.append(Transaction(
+                journal_id=journal_id,
+                user_id=leg.user_id,
+                account=leg.account,
+                transaction_type=leg.transaction_type,
+                amount=leg.amount,
+                reference_type=journal.reference_type,
+                reference_id=journal.reference_id,
+                stellar_tx_hash=tx_hash,
+                description=leg.description,
+            ))
+
+    with transaction.atomic():
+        _apply_balance_deltas(journals)
+        Transaction.objects.bulk_create(rows)
+
+    return hashes
+
+
+def post(legs: Sequence[Leg], reference_type: str = '', reference_id=None,
+         stellar_tx_hash: str = '') -> str:
+    """Post a single balanced journal. Returns its transaction hash."""
+    journal = Journal(legs, reference_type, reference_id, stellar_tx_hash)
+    return post_many([journal])[0]
@@ -0,0 +1,31 @@
+"""
+Release escrow for dispatched orders past the buyer confirmation window.
+Run with: python manage.py auto_release_orders [--batch-size 500] [--limit N] [--dry-run]
+
+Schedule hourly. The window is MARKETPLACE_AUTO_RELEASE_DAYS. Safe to
+re-run or run after a crash: each batch commits on its own and settled
+orders are never released twice (see marketplace.auto_release).
+"""
+
+from django.core.management.base import BaseCommand
+
+from marketplace.auto_release import release_cutoff, release_due_orders
+from marketplace.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Auto-releases escrow for orders the buyer did not confirm in time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Orders settled per transaction')
+        parser.add_argument('--limit', type=int, help='Stop after releasing this many orders')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the orders that are due')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            due = Order.objects.filter(status='dispatched', dispatched_at__lte=release_cutoff()).count()
+            self.stdout.write(f'{due} orders due for auto-release')
+            return
+
+        released = release_due_orders(batch_size=options['batch_size'], limit=options['limit'])
+        self.stdout.write(self.style.SUCCESS(f'Auto-released {released} orders'))
@@ -0,0 +1,88 @@
+"""
+Measure outbox submission throughput against the channel-account pool size.
+Run with: python manage.py benchmark_channels [--operations 4000] [--channels 1,2,4,8] [--ledger-close-ms 100]
+
+For each pool size, queues independent payments and drains them with one
+dispatcher thread per channel against a fake Horizon served over HTTP,
+whose ledgers take one transaction per source account (see
+core.stellar.FakeHorizon). Reports transactions/s, operations/s and pool
+utilization.
+
+Worker threads use their own database connections, so the data is
+committed and deleted afterwards; run it against a scratch database with
+no channels or pending operations of its own.
+"""
+
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core import outbox
+from core.channels import add_channels, pool_stats
+from core.models import ChannelAccount, OutboxBatch, OutboxOperation
+from core.stellar import FakeHorizon, HorizonClient, serve
+
+
+class Command(BaseCommand):
+    help = 'Times outbox dispatch through 1..N channel accounts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--operations', type=int, default=4000)
+        parser.add_argument('--channels', default='1,2,4,8', help='Comma-separated pool sizes')
+        parser.add_argument('--ledger-close-ms', type=float, default=100, help='Fake ledger close interval')
+        parser.add_argument('--latency-ms', type=float, default=5, help='Fake Horizon round-trip delay')
+
+    def handle(self, *args, **options):
+        if ChannelAccount.objects.exists() or OutboxOperation.objects.exclude(status='confirmed').exists():
+            raise CommandError('Database already has channels or unsent operations; use a scratch copy')
+
+        self.stdout.write(f"{'channels':>8} {'seconds':>8} {'tx/s':>7} {'ops/s':>8} {'utilization':>12} "
+                          f"{'resyncs':>8}")
+        try:
+            for size in (int(value) for value in options['channels'].split(',')):
+                seconds, result, stats = self._run(size, options)
+                busy = sum(channel['busy_seconds'] for channel in stats['per_channel'])
+                self.stdout.write(f'{size:>8} {seconds:>8.2f} {result.batches / seconds:>7.1f} '
+                                  f'{result.operations / seconds:>8.0f} {busy / (size * seconds):>12.0%} '
+                                  f"{stats['resyncs']:>8}")
+        finally:
+            self._clean()
+
+    def _run(self, size, options):
+        self._clean()
+        add_channels(f'GCHANNEL{size:04d}{i:043d}' for i in range(size))
+        outbox.record(outbox.payment(f'GSOURCE{i:048d}', f'GDEST{i:050d}', 1)
+                      for i in range(options['operations']))
+
+        horizon = FakeHorizon(latency=options['latency_ms'] / 1000, ledger_close=options['ledger_close_ms'] / 1000)
+        server = serve(horizon)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        client = HorizonClient(f'http://{server.server_address[0]}:{server.server_address[1]}')
+        results = []
+
+        def work():
+            try:
+                results.append(outbox.dispatch(client))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work) for _ in range(size)]
+        start = time.perf_counter()
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            seconds = time.perf_counter() - start
+            server.shutdown()
+            server.server_close()
+        total = outbox.DispatchResult(*(sum(values) for values in zip(outbox.DispatchResult(), *results)))
+        return seconds, total, pool_stats()
+
+    def _clean(self):
+        OutboxOperation.objects.all().delete()
+        OutboxBatch.objects.all().delete()
+        ChannelAccount.objects.all().delete()
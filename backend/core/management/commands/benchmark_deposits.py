@@ -0,0 +1,94 @@
+"""
+Measure deposit watcher throughput.
+Run with: python manage.py benchmark_deposits [--deposits 20000] [--users 2000] [--batch-sizes 200,1000] [--latency-ms 20]
+
+Replays incoming payments (matched by memo, by paying wallet, and a few
+unmatched) from a fake Horizon served over HTTP into a watch of a
+dedicated benchmark account, once per batch size, and reports
+deposits/s and deposits/minute.
+
+The watcher writes from its own thread and connection, so the users are
+committed and everything the benchmark created is deleted afterwards.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.deposits import stream_name, watch
+from core.models import Deposit, IngestCursor, Transaction, User, new_deposit_memo
+from core.stellar import FakeHorizon, HorizonClient, serve
+
+ACCOUNT = 'GBENCHDEPOSITS' + 'A' * 42
+
+
+class Command(BaseCommand):
+    help = 'Times the deposit watcher against a replayed payment history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--deposits', type=int, default=20000)
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--batch-sizes', default='200,1000', help='Comma-separated batch sizes')
+        parser.add_argument('--latency-ms', type=float, default=20, help='Fake Horizon round-trip delay')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        # The planted unmatched deposits would log a warning per batch
+        logging.getLogger('core.deposits').setLevel(logging.ERROR)
+        rng = random.Random(options['seed'])
+        tag = rng.getrandbits(32)
+        users = User.objects.bulk_create([
+            User(email=f'bench-depositor-{tag}-{i}@example.com', full_name=f'Depositor {i}',
+                 wallet_address=f'GDEPOSITOR{tag:08X}{i:038d}', deposit_memo=new_deposit_memo())
+            for i in range(options['users'])
+        ], batch_size=1000)
+        records = []
+        for i in range(options['deposits']):
+            user = rng.choice(users)
+            by_memo = rng.random() < 0.8
+            records.append({
+                'type': 'payment', 'from': f'GEXCHANGE{i % 7}' if by_memo else user.wallet_address,
+                'to': ACCOUNT, 'asset_type': 'credit_alphanum4', 'asset_code': settings.STELLAR_ASSET_CODE,
+                'asset_issuer': settings.STELLAR_ASSET_ISSUER, 'amount': f'{rng.randint(1, 5000)}.0000000',
+                'transaction_hash': f'{tag:08x}{i:056x}',
+                # One in a hundred carries a memo nobody has
+                'transaction': {'memo_type': 'text',
+                                'memo': (user.deposit_memo if i % 100 else 'UNKNOWN') if by_memo else ''},
+            })
+
+        self.stdout.write(f"{'batch':>6} {'seconds':>8} {'deposits/s':>11} {'per minute':>11} "
+                          f"{'credited':>9} {'unmatched':>10}")
+        try:
+            for batch_size in (int(value) for value in options['batch_sizes'].split(',')):
+                self._clean(users)
+                horizon = FakeHorizon(latency=options['latency_ms'] / 1000)
+                horizon.replay(records)
+                server = serve(horizon)
+                threading.Thread(target=server.serve_forever, daemon=True).start()
+                client = HorizonClient(f'http://{server.server_address[0]}:{server.server_address[1]}')
+                try:
+                    start = time.perf_counter()
+                    result = asyncio.run(watch(client, [ACCOUNT], batch_size=batch_size, once=True))
+                    seconds = time.perf_counter() - start
+                finally:
+                    server.shutdown()
+                    server.server_close()
+                rate = len(records) / seconds
+                self.stdout.write(f'{batch_size:>6} {seconds:>8.2f} {rate:>11.0f} {rate * 60:>11.0f} '
+                                  f'{result.credited:>9} {result.unmatched:>10}')
+        finally:
+            self._clean(users)
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+    def _clean(self, users):
+        Transaction.objects.filter(reference_type='deposit', user__in=users).delete()
+        Transaction.objects.filter(reference_type='deposit', user__isnull=True,
+                                   reference_id__in=Deposit.objects.filter(account=ACCOUNT).values('pk')).delete()
+        Deposit.objects.filter(account=ACCOUNT).delete()
+        IngestCursor.objects.filter(name=stream_name(ACCOUNT)).delete()
+        User.objects.filter(pk__in=[user.pk for user in users]).update(wallet_balance=0)
@@ -0,0 +1,162 @@
+"""
+Show query plans and timings for the hot filter paths with and without
+the composite/partial indexes.
+Run with: python manage.py benchmark_indexes [--listings 50000] [--plans]
+
+A synthetic dataset is seeded inside a transaction that is rolled back at
+the end, so the database is left untouched. Each query is timed with the
+indexes in place ("after"), then the indexes are dropped - still inside
+the transaction - and timed again ("before").
+"""
+
+import random
+import time
+from datetime import date
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from core.models import User
+from loans.models import Loan, LoanRepayment
+from marketplace.models import Crop, Listing, Order
+
+# (model, index name) pairs added for the hot paths
+HOT_PATH_INDEXES = [
+    (Listing, 'mkt_listing_active_idx'),
+    (Listing, 'mkt_listing_featured_idx'),
+    (Order, 'mkt_order_buyer_status_idx'),
+    (Order, 'mkt_order_listing_status_idx'),
+    (Loan, 'loans_loan_borrower_status_idx'),
+    (Loan, 'loans_loan_released_idx'),
+    (LoanRepayment, 'loans_repay_loan_status_idx'),
+]
+
+CROPS = ['maize', 'beans', 'potatoes', 'tomatoes', 'sorghum', 'kale', 'avocado', 'tea']
+LISTING_STATUSES = ['active'] * 3 + ['sold', 'expired', 'cancelled', 'draft']
+ORDER_STATUSES = ['escrow_held', 'dispatched', 'completed', 'completed', 'refunded', 'pending_payment']
+LOAN_STATUSES = ['requested', 'approved', 'released', 'repaid', 'rejected']
+
+
+class Command(BaseCommand):
+    help = 'Prints EXPLAIN plans and timings for hot queries before/after the hot-path indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=50000, help='Listings (and orders) to seed')
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per timing')
+        parser.add_argument('--plans', action='store_true', help='Print full EXPLAIN output')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            self.stdout.write('Seeding...')
+            users = self._seed(options['listings'], options['users'], rng)
+            queries = self._queries(users)
+            if connection.vendor in ('sqlite', 'postgresql'):
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE')
+
+            after = self._measure(queries, options, 'after')
+            # Plain DROP INDEX: transactional on SQLite and PostgreSQL, undone by the rollback
+            with connection.cursor() as cursor:
+                for _, name in HOT_PATH_INDEXES:
+                    cursor.execute(f'DROP INDEX IF EXISTS {connection.ops.quote_name(name)}')
+            before = self._measure(queries, options, 'before')
+
+            self.stdout.write(f"\n{'query':<22} {'before ms':>10} {'after ms':>10}  plan (before -> after)")
+            for name in queries:
+                self.stdout.write(
+                    f'{name:<22} {before[name][0]:>10.3f} {after[name][0]:>10.3f}  '
+                    f'{self._summary(before[name][1])} -> {self._summary(after[name][1])}'
+                )
+                if options['plans']:
+                    self.stdout.write(f'  before:\n{self._indent(before[name][1])}')
+                    self.stdout.write(f'  after:\n{self._indent(after[name][1])}')
+
+            transaction.set_rollback(True)
+
+    def _seed(self, listing_count, user_count, rng):
+        tag = rng.getrandbits(32)
+        users = User.objects.bulk_create([
+            User(email=f'bench-{tag}-{i}@example.com', full_name=f'Bench {i}',
+                 is_farmer=i % 2 == 0, is_buyer=i % 2 == 1)
+            for i in range(user_count)
+        ])
+        farmers, buyers = users[0::2], users[1::2]
+
+        # bulk_create skips Listing.save(), so the catalog/search index are not maintained;
+        # the rollback discards everything anyway
+        Crop.objects.bulk_create([Crop(slug=crop, name=crop.title()) for crop in CROPS], ignore_conflicts=True)
+        listings = Listing.objects.bulk_create([
+            Listing(
+                farmer=rng.choice(farmers), title='Bench lot', description='', crop_type=crop.title(),
+                crop_id=crop, quantity_kg=100, quantity_available=100,
+                price_per_kg=Decimal(rng.randint(10, 300)), status=rng.choice(LISTING_STATUSES),
+                featured=rng.random() < 0.02, expected_harvest_date=date(2030, 1, 1),
+            )
+            for crop in (rng.choice(CROPS) for _ in range(listing_count))
+        ], batch_size=1000)
+
+        Order.objects.bulk_create([
+            Order(listing=rng.choice(listings), buyer=rng.choice(buyers), quantity_kg=1,
+                  price_per_kg=50, total_price=50, status=rng.choice(ORDER_STATUSES))
+            for _ in range(listing_count)
+        ], batch_size=1000)
+        loans = Loan.objects.bulk_create([
+            Loan(borrower=rng.choice(farmers), amount_requested=1000, amount_approved=1000,
+                 status=rng.choice(LOAN_STATUSES))
+            for _ in range(max(listing_count // 10, 1))
+        ], batch_size=1000)
+        LoanRepayment.objects.bulk_create([
+            LoanRepayment(loan=rng.choice(loans), amount=100,
+                          status=rng.choice(['on_time', 'late', 'auto_deducted']))
+            for _ in range(max(listing_count // 5, 1))
+        ], batch_size=1000)
+        return {'farmer': rng.choice(farmers), 'buyer': rng.choice(buyers),
+                'loan': rng.choice(loans)}
+
+    def _queries(self, users):
+        return {
+            'listing_browse': Listing.objects.filter(status='active').order_by('-created_at', '-id')[:20],
+            'listing_crop_price': Listing.objects.filter(
+                status='active', crop_id='maize', price_per_kg__gte=40, price_per_kg__lte=60)[:20],
+            'listing_featured': Listing.objects.filter(status='active', featured=True).order_by('-created_at')[:10],
+            'buyer_orders': Order.objects.filter(buyer=users['buyer'], status='escrow_held')[:20],
+            'farmer_sales': Order.objects.filter(listing__farmer=users['farmer'], status='completed')[:20],
+            'active_loan': Loan.objects.filter(borrower=users['farmer'], status='released')[:1],
+            'loan_repayments': LoanRepayment.objects.filter(loan=users['loan'], status='on_time'),
+        }
+
+    def _explain(self, queryset, phase):
+        """
+        EXPLAIN via a raw cursor. The phase comment makes the SQL text
+        unique: sqlite3 caches prepared statements by text, and a cached
+        EXPLAIN keeps reporting the plan from before the indexes changed.
+        """
+        sql, params = queryset.query.sql_with_params()
+        prefix = 'EXPLAIN QUERY PLAN' if connection.vendor == 'sqlite' else 'EXPLAIN'
+        with connection.cursor() as cursor:
+            cursor.execute(f'{prefix} {sql} /* {phase} */', params)
+            return '\n'.join(str(row[-1]) for row in cursor.fetchall())
+
+    def _measure(self, queries, options, phase):
+        results = {}
+        for name, queryset in queries.items():
+            plan = self._explain(queryset, phase)
+            start = time.perf_counter()
+            for _ in range(options['repeat']):
+                list(queryset.all())
+            results[name] = ((time.perf_counter() - start) / options['repeat'] * 1000, plan)
+        return results
+
+    def _summary(self, plan):
+        """First access-path line of a plan, trimmed for the table."""
+        for line in plan.splitlines():
+            if 'SCAN' in line or 'SEARCH' in line or 'Scan' in line:
+                return line.strip()[:60]
+        return plan.splitlines()[0][:60] if plan else ''
+
+    def _indent(self, plan):
+        return '\n'.join(f'    {line}' for line in plan.splitlines())
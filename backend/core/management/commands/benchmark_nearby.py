@@ -0,0 +1,85 @@
+"""
+Benchmark geohash-indexed radius / nearest-k listing queries.
+Run with: python manage.py benchmark_nearby [--sizes 1000,10000,100000]
+
+For each size, synthetic listings are scattered over Kenya's bounding box
+inside a transaction that is rolled back afterwards, so the database is
+left untouched. Reports average query time for the indexed radius and
+nearest-k lookups next to a brute-force scan that computes the distance to
+every listing. Indexed times should stay roughly flat as size grows while
+the scan grows linearly.
+"""
+
+import random
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core import geo
+from core.gazetteer import PLACES
+from core.models import User
+from marketplace.models import Listing
+
+# Kenya's bounding box (south, west, north, east)
+KENYA_BOUNDS = (-4.7, 33.9, 5.0, 41.9)
+
+
+class Command(BaseCommand):
+    help = 'Times radius and nearest-k listing queries at increasing table sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000',
+                            help='Comma-separated listing counts to benchmark')
+        parser.add_argument('--queries', type=int, default=20, help='Queries per measurement')
+        parser.add_argument('--radius-km', type=float, default=25)
+        parser.add_argument('--k', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        rng = random.Random(options['seed'])
+        origins = [rng.choice(list(PLACES.values())) for _ in range(options['queries'])]
+
+        self.stdout.write(f"{'listings':>10} {'radius ms':>10} {'nearest ms':>11} {'scan ms':>9}")
+        with transaction.atomic():
+            farmer = User.objects.create_user(
+                f'benchmark-{rng.random()}@example.com', full_name='Benchmark Farmer', is_farmer=True
+            )
+            created = 0
+            for size in sizes:
+                self._add_listings(farmer, size - created, rng)
+                created = size
+
+                queryset = Listing.objects.filter(status='active')
+                radius = self._time(origins, lambda lat, lon: list(
+                    geo.within_radius(queryset, lat, lon, options['radius_km'])[:100]))
+                nearest = self._time(origins, lambda lat, lon: geo.nearest(
+                    queryset, lat, lon, options['k']))
+                scan = self._time(origins, lambda lat, lon: list(
+                    queryset.annotate(distance_km=geo.distance_expression(lat, lon))
+                    .filter(distance_km__lte=options['radius_km']).order_by('distance_km')[:100]))
+                self.stdout.write(f'{size:>10} {radius:>10.2f} {nearest:>11.2f} {scan:>9.2f}')
+
+            transaction.set_rollback(True)
+
+    def _add_listings(self, farmer, count, rng):
+        south, west, north, east = KENYA_BOUNDS
+        batch = []
+        for _ in range(count):
+            listing = Listing(
+                farmer=farmer, title='Benchmark', description='', crop_type='Maize',
+                quantity_kg=100, quantity_available=100, price_per_kg=40,
+                expected_harvest_date=date(2030, 1, 1),
+            )
+            listing.set_coordinates((rng.uniform(south, north), rng.uniform(west, east)))
+            batch.append(listing)
+        # bulk_create skips Listing.save(); the rollback discards these rows anyway
+        Listing.objects.bulk_create(batch, batch_size=1000)
+
+    def _time(self, origins, query):
+        start = time.perf_counter()
+        for lat, lon in origins:
+            query(lat, lon)
+        return (time.perf_counter() - start) / len(origins) * 1000
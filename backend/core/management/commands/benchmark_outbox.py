@@ -0,0 +1,106 @@
+"""
+Compare one Stellar transaction per ledger movement with batched outbox
+dispatch.
+Run with: python manage.py benchmark_outbox [--orders 500] [--farmers 50] [--latency-ms 10]
+
+Seeds received orders (half the farmers with an active loan) and settles
+them, which queues their on-chain payments, inside a transaction that is
+rolled back. The queue is then sent twice to a fresh fake Horizon served
+over HTTP: once as single-operation transactions, once packed 100 to a
+transaction with merging. Reports time, operations/s, transactions and
+fees per settled order for each.
+"""
+
+import random
+import threading
+import time
+from datetime import date
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import OutboxOperation, User
+from core.outbox import dispatch
+from core.stellar import FakeHorizon, HorizonClient, serve
+from loans.escrow_service import settle_orders
+from loans.models import Loan
+from marketplace.models import Crop, Listing, Order
+
+
+class Command(BaseCommand):
+    help = 'Times per-movement Stellar submission against batched outbox dispatch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=500, help='Orders settled')
+        parser.add_argument('--farmers', type=int, default=50)
+        parser.add_argument('--latency-ms', type=float, default=10, help='Fake Horizon round-trip delay')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        count = options['orders']
+        with transaction.atomic():
+            orders = self._seed(count, options['farmers'], rng)
+            OutboxOperation.objects.all().delete()
+            for start in range(0, count, 500):
+                settle_orders([order.pk for order in orders[start:start + 500]])
+            queued = OutboxOperation.objects.count()
+            self.stdout.write(f'{count} orders settled, {queued} operations queued')
+
+            runs = {
+                'per-movement': self._run(options['latency_ms'], batch_size=1, merge=False),
+                'batched': self._run(options['latency_ms'], batch_size=100, merge=True),
+            }
+            self.stdout.write(f"{'path':<14} {'seconds':>8} {'ops/s':>8} {'transactions':>13} "
+                              f"{'ops on chain':>13} {'stroops/order':>14}")
+            for name, (seconds, result, on_chain) in runs.items():
+                self.stdout.write(f'{name:<14} {seconds:>8.2f} {result.operations / seconds:>8.0f} '
+                                  f'{result.batches:>13} {on_chain:>13} {result.fee_charged / count:>14.1f}')
+            transaction.set_rollback(True)
+
+    def _run(self, latency_ms, **dispatch_options):
+        """Dispatch the queue against a fresh fake Horizon, then undo the dispatch."""
+        horizon = FakeHorizon(latency=latency_ms / 1000)
+        server = serve(horizon)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        client = HorizonClient(f'http://{server.server_address[0]}:{server.server_address[1]}')
+        try:
+            with transaction.atomic():
+                start = time.perf_counter()
+                result = dispatch(client, **dispatch_options)
+                seconds = time.perf_counter() - start
+                transaction.set_rollback(True)
+        finally:
+            server.shutdown()
+            server.server_close()
+        on_chain = sum(tx['operation_count'] for tx in horizon.transactions.values())
+        return seconds, result, on_chain
+
+    def _seed(self, order_count, farmer_count, rng):
+        tag = rng.getrandbits(32)
+        buyer = User.objects.create_user(f'bench-buyer-{tag}@example.com', full_name='Bench Buyer',
+                                         is_buyer=True, wallet_balance=Decimal('1e9'),
+                                         escrow_balance=Decimal('1e8'))
+        farmers = User.objects.bulk_create([
+            User(email=f'bench-{tag}-{i}@example.com', full_name=f'Bench {i}', is_farmer=True,
+                 wallet_address=f'GFARMER{tag:08X}{i:041d}')
+            for i in range(farmer_count)
+        ])
+        Loan.objects.bulk_create([
+            Loan(borrower=farmer, amount_requested=5000, amount_approved=5000, status='released')
+            for farmer in farmers[::2]
+        ])
+        # bulk_create skips Listing.save(); the rollback discards these rows anyway
+        Crop.objects.bulk_create([Crop(slug='maize', name='Maize')], ignore_conflicts=True)
+        listings = Listing.objects.bulk_create([
+            Listing(farmer=farmer, title='Bench lot', description='', crop_type='Maize', crop_id='maize',
+                    quantity_kg=1000, quantity_available=1000, price_per_kg=40,
+                    expected_harvest_date=date(2030, 1, 1))
+            for farmer in farmers
+        ])
+        return Order.objects.bulk_create([
+            Order(listing=listing, buyer=buyer, quantity_kg=10, price_per_kg=40, total_price=400,
+                  status='received', escrow_wallet_address=f'GESCROW{tag:08X}{i:041d}')
+            for i, listing in enumerate(rng.choice(listings) for _ in range(order_count))
+        ], batch_size=1000)
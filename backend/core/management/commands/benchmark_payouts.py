@@ -0,0 +1,99 @@
+"""
+Compare netted payout runs with one Stellar submission per withdrawal.
+Run with: python manage.py benchmark_payouts [--withdrawals 1000] [--destinations 50] [--ledger-close-ms 20]
+
+Queues the same withdrawals twice and pays them out against a fake
+Horizon whose ledgers take one transaction per source account (see
+core.stellar.FakeHorizon):
+
+- per-withdrawal: one payment and one transaction per withdrawal
+- netted: run_payouts() nets them per destination and the outbox packs
+  up to 100 payments per transaction; the runs are then reconciled
+
+Reports transactions, fee and time per payout. Everything is committed
+and deleted afterwards; run it against a scratch database with no
+channels or pending operations of its own.
+"""
+
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core import outbox
+from core.models import ChannelAccount, OutboxBatch, OutboxOperation, PayoutRun, Transaction, User, Withdrawal
+from core.payouts import reconcile_pending, request_withdrawal, run_payouts
+from core.stellar import FakeHorizon
+
+
+class Command(BaseCommand):
+    help = 'Times netted payout runs against one submission per withdrawal'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--withdrawals', type=int, default=1000)
+        parser.add_argument('--destinations', type=int, default=50)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--ledger-close-ms', type=float, default=20, help='Fake ledger close interval')
+        parser.add_argument('--latency-ms', type=float, default=5, help='Fake Horizon round-trip delay')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if ChannelAccount.objects.exists() or OutboxOperation.objects.exclude(status='confirmed').exists():
+            raise CommandError('Database already has channels or unsent operations; use a scratch copy')
+
+        rng = random.Random(options['seed'])
+        tag = rng.getrandbits(32)
+        users = User.objects.bulk_create([
+            User(email=f'bench-payout-{tag}-{i}@example.com', full_name=f'Payee {i}', wallet_balance=10 ** 6)
+            for i in range(options['users'])
+        ])
+        destinations = [f'GPAYOUT{tag:08X}{i:041d}' for i in range(options['destinations'])]
+        requests = [(rng.choice(users), rng.randint(1, 500), rng.choice(destinations))
+                    for _ in range(options['withdrawals'])]
+
+        self.stdout.write(f"{'mode':>14} {'seconds':>8} {'transactions':>13} {'ops':>6} "
+                          f"{'stroops/payout':>15} {'ms/payout':>10}")
+        try:
+            for mode in ('per-withdrawal', 'netted'):
+                self._clean(users)
+                for user, amount, destination in requests:
+                    request_withdrawal(user, amount, destination)
+                horizon = FakeHorizon(latency=options['latency_ms'] / 1000,
+                                      ledger_close=options['ledger_close_ms'] / 1000)
+                start = time.perf_counter()
+                result = self._per_withdrawal(horizon) if mode == 'per-withdrawal' else self._netted(horizon)
+                seconds = time.perf_counter() - start
+                count = len(requests)
+                self.stdout.write(f'{mode:>14} {seconds:>8.2f} {result.batches:>13} {result.operations:>6} '
+                                  f'{result.fee_charged / count:>15.1f} {seconds * 1000 / count:>10.2f}')
+        finally:
+            self._clean(users)
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+    def _per_withdrawal(self, horizon):
+        outbox.record(
+            outbox.payment(settings.STELLAR_PLATFORM_ACCOUNT, destination, amount,
+                           reference_type='withdrawal', reference_id=pk)
+            for pk, destination, amount in Withdrawal.objects.values_list('pk', 'destination', 'amount')
+        )
+        return outbox.dispatch(horizon, batch_size=1, merge=False)
+
+    def _netted(self, horizon):
+        while run_payouts():
+            pass
+        result = outbox.dispatch(horizon)
+        reconcile_pending()
+        return result
+
+    def _clean(self, users):
+        Transaction.objects.filter(user__in=users).delete()
+        Transaction.objects.filter(reference_type='withdrawal', user__isnull=True,
+                                   reference_id__in=Withdrawal.objects.filter(user__in=users).values('pk')).delete()
+        runs = list(Withdrawal.objects.filter(user__in=users, run__isnull=False).values_list('run', flat=True))
+        Withdrawal.objects.filter(user__in=users).delete()
+        PayoutRun.objects.filter(pk__in=runs).delete()
+        OutboxOperation.objects.all().delete()
+        OutboxBatch.objects.all().delete()
+        ChannelAccount.objects.all().delete()
+        User.objects.filter(pk__in=[user.pk for user in users]).update(wallet_balance=10 ** 6)
@@ -0,0 +1,84 @@
+"""
+Compare per-order escrow release with batch settlement.
+Run with: python manage.py benchmark_settlement [--orders 500] [--farmers 50]
+
+Seeds received orders (half the farmers with an active loan) inside a
+transaction that is rolled back, so the database is left untouched. The
+same number of orders is settled one at a time with release_order_payment
+and then in one settle_orders call; reports time, orders/s and queries
+per order for each.
+"""
+
+import random
+import time
+from datetime import date
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from core.models import User
+from loans.escrow_service import release_order_payment, settle_orders
+from loans.models import Loan
+from marketplace.models import Crop, Listing, Order
+
+
+class Command(BaseCommand):
+    help = 'Times per-order escrow release against batch settlement'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=500, help='Orders settled by each path')
+        parser.add_argument('--farmers', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        count = options['orders']
+        with transaction.atomic():
+            orders = self._seed(2 * count, options['farmers'], rng)
+            single, batch = orders[:count], orders[count:]
+
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                for order in single:
+                    release_order_payment(order)
+                per_order = (time.perf_counter() - start, len(queries))
+
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                settle_orders([order.pk for order in batch])
+                batched = (time.perf_counter() - start, len(queries))
+
+            self.stdout.write(f"{'path':<12} {'seconds':>8} {'orders/s':>10} {'queries/order':>14}")
+            for name, (seconds, query_count) in (('per-order', per_order), ('batch', batched)):
+                self.stdout.write(f'{name:<12} {seconds:>8.3f} {count / seconds:>10.0f} '
+                                  f'{query_count / count:>14.2f}')
+            transaction.set_rollback(True)
+
+    def _seed(self, order_count, farmer_count, rng):
+        tag = rng.getrandbits(32)
+        buyer = User.objects.create_user(f'bench-buyer-{tag}@example.com', full_name='Bench Buyer',
+                                         is_buyer=True, wallet_balance=Decimal('1e9'),
+                                         escrow_balance=Decimal('1e8'))
+        farmers = User.objects.bulk_create([
+            User(email=f'bench-{tag}-{i}@example.com', full_name=f'Bench {i}', is_farmer=True)
+            for i in range(farmer_count)
+        ])
+        Loan.objects.bulk_create([
+            Loan(borrower=farmer, amount_requested=5000, amount_approved=5000, status='released')
+            for farmer in farmers[::2]
+        ])
+        # bulk_create skips Listing.save(); the rollback discards these rows anyway
+        Crop.objects.bulk_create([Crop(slug='maize', name='Maize')], ignore_conflicts=True)
+        listings = Listing.objects.bulk_create([
+            Listing(farmer=farmer, title='Bench lot', description='', crop_type='Maize', crop_id='maize',
+                    quantity_kg=1000, quantity_available=1000, price_per_kg=40,
+                    expected_harvest_date=date(2030, 1, 1))
+            for farmer in farmers
+        ])
+        return Order.objects.bulk_create([
+            Order(listing=listing, buyer=buyer, quantity_kg=10, price_per_kg=40, total_price=400,
+                  status='received')
+            for listing in (rng.choice(listings) for _ in range(order_count))
+        ], batch_size=1000)
@@ -0,0 +1,37 @@
+"""
+Roll balance snapshots forward to a cutoff.
+Run with: python manage.py build_balance_snapshots [--as-of ISO_DATETIME]
+
+Schedule periodically (e.g. nightly or at month end). Only users with new
+Transaction rows since their last snapshot get a new checkpoint.
+"""
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.snapshots import build_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Builds incremental per-user balance snapshots from the transaction ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--as-of', help='Snapshot cutoff (ISO 8601). Defaults to now minus --lag-minutes.')
+        parser.add_argument('--lag-minutes', type=int, default=5,
+                            help='Stay this far behind now so in-flight transactions are not missed')
+
+    def handle(self, *args, **options):
+        if options['as_of']:
+            as_of = parse_datetime(options['as_of'])
+            if as_of is None:
+                raise CommandError(f"Invalid --as-of value: {options['as_of']}")
+            if timezone.is_naive(as_of):
+                as_of = timezone.make_aware(as_of)
+        else:
+            as_of = timezone.now() - timedelta(minutes=options['lag_minutes'])
+
+        created = build_snapshots(as_of)
+        self.stdout.write(self.style.SUCCESS(f'Created {created} balance snapshots as of {as_of.isoformat()}'))
@@ -0,0 +1,47 @@
+"""
+Manage the Stellar channel-account pool (see core.channels).
+Run with: python manage.py channel_accounts [status | add ADDRESS ... | add --generate N]
+
+`status` prints pool utilization. `add` registers funded channel accounts;
+--generate makes simulated addresses for development against the fake
+Horizon.
+"""
+
+import json
+import secrets
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.channels import add_channels, pool_stats
+
+
+class Command(BaseCommand):
+    help = 'Registers channel accounts and reports pool utilization'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', nargs='?', choices=['status', 'add'], default='status')
+        parser.add_argument('addresses', nargs='*', help='Channel account addresses to register')
+        parser.add_argument('--generate', type=int, default=0, help='Register this many simulated addresses')
+        parser.add_argument('--json', action='store_true', help='Print status as JSON')
+
+    def handle(self, *args, **options):
+        if options['action'] == 'add':
+            addresses = list(options['addresses'])
+            addresses += [f"G{secrets.token_hex(27).upper()}" for _ in range(options['generate'])]
+            if not addresses:
+                raise CommandError('Give channel addresses or --generate N')
+            added = add_channels(addresses)
+            self.stdout.write(self.style.SUCCESS(f'Registered {added} channel accounts'))
+            return
+
+        stats = pool_stats()
+        if options['json']:
+            self.stdout.write(json.dumps(stats, indent=2))
+            return
+        self.stdout.write(f"{stats['channels']} channels, {stats['leased']} leased "
+                          f"({stats['utilization']:.0%}); {stats['transactions']} transactions, "
+                          f"{stats['resyncs']} sequence re-syncs")
+        for channel in stats['per_channel']:
+            state = f"leased by {channel['leased_by']}" if channel['leased'] else 'idle'
+            self.stdout.write(f"  {channel['address']}  {state:<40} tx={channel['transactions']} "
+                              f"resyncs={channel['resyncs']} busy={channel['busy_seconds']}s")
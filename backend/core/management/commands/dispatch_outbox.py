@@ -0,0 +1,60 @@
+"""
+Submit queued on-chain operations to Stellar in batched transactions.
+Run with: python manage.py dispatch_outbox [--workers 4] [--loop] [--interval 1.0] [--max-batches N]
+
+Without --loop, sends everything pending and exits (schedule every
+minute). Each worker submits through its own leased channel account, so
+--workers above the number of channels only adds idle threads (see
+core.channels and core.outbox).
+"""
+
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core.outbox import DispatchResult, dispatch
+
+
+class Command(BaseCommand):
+    help = 'Packs pending outbox operations into Stellar transactions and submits them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1, help='Parallel submitters (one channel each)')
+        parser.add_argument('--loop', action='store_true', help='Keep dispatching until interrupted')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds between passes with --loop')
+        parser.add_argument('--max-batches', type=int, help='Transactions to submit per worker and pass')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+        while True:
+            result = self._pass(options['workers'], options['max_batches'])
+            if result.batches or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Submitted {result.batches} transactions confirming {result.operations} operations '
+                    f'({result.fee_charged} stroops in fees)'
+                ))
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
+
+    def _pass(self, workers, max_batches):
+        if workers == 1:
+            return dispatch(max_batches=max_batches)
+
+        results = []
+
+        def work():
+            try:
+                results.append(dispatch(max_batches=max_batches))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return DispatchResult(*(sum(values) for values in zip(DispatchResult(), *results)))
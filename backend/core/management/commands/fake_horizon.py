@@ -0,0 +1,41 @@
+"""
+Serve a local fake Horizon for development and benchmarks.
+Run with: python manage.py fake_horizon [--port 8001] [--latency-ms 0] [--replay payments.jsonl]
+
+Point the app at it with STELLAR_HORIZON_URL=http://127.0.0.1:8001.
+State is in memory and lost on exit (see core.stellar.FakeHorizon).
+--replay loads Horizon payment records, one JSON object per line, into
+the payment history, for replaying deposits to `watch_deposits`.
+"""
+
+import json
+
+from django.core.management.base import BaseCommand
+
+from core.stellar import FakeHorizon, serve
+
+
+class Command(BaseCommand):
+    help = 'Runs an in-memory fake Horizon server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--latency-ms', type=float, default=0, help='Delay added to every request')
+        parser.add_argument('--replay', help='JSON-lines file of payment records to serve')
+
+    def handle(self, *args, **options):
+        horizon = FakeHorizon(latency=options['latency_ms'] / 1000)
+        if options['replay']:
+            with open(options['replay']) as records:
+                count = horizon.replay(json.loads(line) for line in records if line.strip())
+            self.stdout.write(f'Replaying {count} payment records')
+        server = serve(horizon, options['host'], options['port'])
+        host, port = server.server_address[:2]
+        self.stdout.write(f'Fake Horizon listening on http://{host}:{port}/')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
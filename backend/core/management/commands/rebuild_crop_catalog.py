@@ -0,0 +1,22 @@
+"""
+Recompute the marketplace crop catalog from the listings table.
+Run with: python manage.py rebuild_crop_catalog
+
+Listing saves keep the catalog current incrementally; run this after bulk
+imports or queryset.update() calls that bypassed Listing.save(), or
+periodically as a consistency check.
+"""
+
+from django.core.management.base import BaseCommand
+
+from marketplace.cache import bump_version
+from marketplace.catalog import rebuild_catalog
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds crop catalog counts, available kg and price ranges from listings'
+
+    def handle(self, *args, **options):
+        crops = rebuild_catalog()
+        bump_version('listing')
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt crop catalog ({crops} crops)'))
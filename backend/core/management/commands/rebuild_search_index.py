@@ -0,0 +1,22 @@
+"""
+Rebuild the marketplace full-text search index.
+Run with: python manage.py rebuild_search_index
+
+Listing saves keep the index current; run this after bulk imports or
+queryset.update() calls that changed listing text. A no-op on PostgreSQL,
+where search uses an expression index.
+"""
+
+from django.core.management.base import BaseCommand
+
+from marketplace.cache import bump_version
+from marketplace.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the listing full-text search index from the listings table'
+
+    def handle(self, *args, **options):
+        indexed = rebuild_index()
+        bump_version('listing')
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} listings'))
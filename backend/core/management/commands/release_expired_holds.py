@@ -0,0 +1,28 @@
+"""
+Give back stock held by expired cart and order reservations.
+Run with: python manage.py release_expired_holds [--batch-size 1000]
+
+Schedule every minute. Pending orders whose hold expired are cancelled.
+Holds are released in batches, each in its own short transaction, until
+none are left.
+"""
+
+from django.core.management.base import BaseCommand
+
+from marketplace.reservations import release_expired
+
+
+class Command(BaseCommand):
+    help = 'Releases expired stock holds and cancels their unpaid orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Holds released per transaction')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            released = release_expired(limit=options['batch_size'])
+            if not released:
+                break
+            total += released
+        self.stdout.write(self.style.SUCCESS(f'Released {total} expired holds'))
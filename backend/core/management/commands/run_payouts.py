@@ -0,0 +1,42 @@
+"""
+Pay queued withdrawals out in netted runs and reconcile them.
+Run with: python manage.py run_payouts [--batch-size 1000] [--no-dispatch]
+
+Schedule every few minutes. Starts runs until the withdrawal queue is
+empty, submits the outbox (unless --no-dispatch, when dispatch_outbox runs
+separately), then reconciles every open run and prints its report (see
+core.payouts).
+"""
+
+from django.core.management.base import BaseCommand
+
+from core.models import PayoutRun
+from core.outbox import dispatch
+from core.payouts import reconcile, run_payouts
+
+
+class Command(BaseCommand):
+    help = 'Runs scheduled withdrawal payouts and reconciles them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Withdrawals per run (default PAYOUT_BATCH_SIZE)')
+        parser.add_argument('--no-dispatch', action='store_true', help='Leave submission to dispatch_outbox')
+
+    def handle(self, *args, **options):
+        started = 0
+        while run_payouts(options['batch_size']):
+            started += 1
+        if not options['no_dispatch']:
+            result = dispatch()
+            self.stdout.write(f'Submitted {result.operations} payments in {result.batches} transactions')
+
+        for run in PayoutRun.objects.filter(status='pending').order_by('created_at'):
+            report = reconcile(run)
+            self.stdout.write(
+                f"Run {run.id} [{run.status}]: {report['withdrawals']} withdrawals to {report['destinations']} "
+                f"destinations, paid {report['paid']}, failed {report['failed']}, in flight {report['in_flight']}, "
+                f"{len(report['transactions'])} transactions, {report['fee_charged']} stroops"
+            )
+            if report['mismatches']:
+                self.stderr.write(f"  Payments do not match withdrawals for: {', '.join(report['mismatches'])}")
+        self.stdout.write(self.style.SUCCESS(f'Started {started} payout runs'))
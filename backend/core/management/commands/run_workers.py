@@ -0,0 +1,40 @@
+"""
+Run background job workers (see core.jobs).
+Run with: python manage.py run_workers [--concurrency 4] [--mode thread|process] [--queues default,escrow] [--once]
+
+Workers poll the Job table, so no broker is needed. Stop with SIGINT or
+SIGTERM: each worker finishes its current job and exits. A worker killed
+harder leaves its job to be re-claimed when the lease expires.
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.jobs import DEFAULT_QUEUE, run_pool
+
+
+class Command(BaseCommand):
+    help = 'Runs a pool of workers for the database-backed job queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help='Workers in the pool')
+        parser.add_argument('--mode', choices=['thread', 'process'], default='thread',
+                            help='Run workers as threads or forked processes')
+        parser.add_argument('--queues',
+                            help='Comma-separated queues, polled in this order. '
+                                 'Defaults to default plus every queue in JOB_QUEUE_CONCURRENCY.')
+        parser.add_argument('--poll-interval', type=float, help='Seconds to sleep when no job is runnable')
+        parser.add_argument('--once', action='store_true', help='Exit once no job is runnable')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency must be at least 1')
+        if options['queues']:
+            queues = [queue.strip() for queue in options['queues'].split(',') if queue.strip()]
+        else:
+            queues = [DEFAULT_QUEUE] + [queue for queue in settings.JOB_QUEUE_CONCURRENCY if queue != DEFAULT_QUEUE]
+
+        self.stdout.write(f"Starting {options['concurrency']} {options['mode']} workers on {', '.join(queues)}")
+        run_pool(queues, options['concurrency'], mode=options['mode'], drain=options['once'],
+                 poll_interval=options['poll_interval'])
+        self.stdout.write(self.style.SUCCESS('Workers stopped'))
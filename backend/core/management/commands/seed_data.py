@@ -10,6 +10,7 @@ from decimal import Decimal
 import random
 
 from django.contrib.auth import get_user_model
+from core import ledger
 from core.models import Transaction, User
 from crops.models import CropImage, CropAssessment
 from loans.models import Loan, LoanRepayment
@@ -19,6 +20,21 @@ from marketplace.models import Listing, Order
 class Command(BaseCommand):
     help = 'Seeds the database with demo data for AgriChain'
 
+    def _get_or_create_funded(self, data):
+        """Create a demo user, posting their starting balance as a ledger deposit."""
+        data = dict(data)
+        opening = data.pop('wallet_balance', Decimal('0'))
+        user, created = User.objects.get_or_create(
+            email=data['email'],
+            defaults=data
+        )
+        if created and opening:
+            ledger.post([
+                ledger.user_leg(user, ledger.WALLET, opening, 'deposit', 'Demo wallet funding'),
+                ledger.system_leg(ledger.EXTERNAL, -opening, 'deposit', 'Demo wallet funding'),
+            ])
+        return user
+
     def handle(self, *args, **options):
         self.stdout.write('🌱 Seeding AgriChain database (Hackathon MVP)...\n')
         
@@ -61,10 +77,7 @@ class Command(BaseCommand):
         
         farmers = []
         for data in farmers_data:
-            user, created = User.objects.get_or_create(
-                email=data['email'],
-                defaults=data
-            )
+            user = self._get_or_create_funded(data)
             farmers.append(user)
             self.stdout.write(f'✅ Farmer: {user.full_name} ({user.farm_name})')
         
@@ -88,10 +101,7 @@ class Command(BaseCommand):
         
         buyers = []
         for data in buyers_data:
-            user, created = User.objects.get_or_create(
-                email=data['email'],
-                defaults=data
-            )
+            user = self._get_or_create_funded(data)
             buyers.append(user)
             self.stdout.write(f'✅ Buyer: {user.full_name}')
         
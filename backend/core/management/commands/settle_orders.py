@@ -0,0 +1,38 @@
+"""
+Release escrow for delivered orders in batches.
+Run with: python manage.py settle_orders [--ids ID,ID,...] [--farmer ID] [--batch-size 500]
+
+Without --ids, settles every order in `received` status (optionally only
+one farmer's). Each batch is one transaction (see
+loans.escrow_service.settle_orders); a failed batch leaves earlier batches
+settled.
+"""
+
+from django.core.management.base import BaseCommand
+
+from loans.escrow_service import settle_orders
+from marketplace.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Settles delivered orders in batched escrow releases'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ids', help='Comma-separated order ids (dispatched or received)')
+        parser.add_argument('--farmer', help='Only settle received orders for this farmer id')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if options['ids']:
+            order_ids = [order_id.strip() for order_id in options['ids'].split(',') if order_id.strip()]
+        else:
+            orders = Order.objects.filter(status='received')
+            if options['farmer']:
+                orders = orders.filter(listing__farmer_id=options['farmer'])
+            order_ids = list(orders.order_by('created_at').values_list('pk', flat=True))
+
+        size = options['batch_size']
+        settled = 0
+        for start in range(0, len(order_ids), size):
+            settled += len(settle_orders(order_ids[start:start + size]))
+        self.stdout.write(self.style.SUCCESS(f'Settled {settled} of {len(order_ids)} orders'))
@@ -0,0 +1,31 @@
+"""
+Move paid orders' funds into their pooled escrow accounts.
+Run with: python manage.py sweep_escrow_deposits [--batch-size 1000]
+
+Schedule every few minutes. Each batch is one transaction that queues one
+outbox payment per buyer and pool account (see loans.escrow_pool);
+batches run until no pending entries are left.
+"""
+
+from django.core.management.base import BaseCommand
+
+from loans.escrow_pool import pool_balances, sweep_deposits
+
+
+class Command(BaseCommand):
+    help = 'Sweeps pending pooled escrow deposits into the pool accounts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Entries swept per transaction')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            swept = sweep_deposits(limit=options['batch_size'])
+            if not swept:
+                break
+            total += swept
+        for address, balance in pool_balances().items():
+            self.stdout.write(f"{address}  held {balance['held']}  pending {balance['pending']}  "
+                              f"entries {balance['entries']}")
+        self.stdout.write(self.style.SUCCESS(f'Swept {total} escrow entries'))
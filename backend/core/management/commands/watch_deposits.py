@@ -0,0 +1,41 @@
+"""
+Credit payments into the platform's Stellar accounts to user wallets.
+Run with: python manage.py watch_deposits [--accounts G...,G...] [--batch-size 1000] [--once]
+
+Follows each account's payment history on STELLAR_HORIZON_URL from its
+saved cursor (see core.deposits) until SIGINT/SIGTERM, or with --once
+until it is caught up.
+"""
+
+import asyncio
+import signal
+
+from django.core.management.base import BaseCommand
+
+from core.deposits import watch
+from core.stellar import get_client
+
+
+class Command(BaseCommand):
+    help = 'Streams deposits from Horizon and credits them to user wallets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--accounts', help='Comma-separated accounts to watch (default DEPOSIT_ACCOUNTS)')
+        parser.add_argument('--batch-size', type=int, help='Payments credited per transaction')
+        parser.add_argument('--poll-interval', type=float, help='Seconds between polls once caught up')
+        parser.add_argument('--once', action='store_true', help='Stop once every account is caught up')
+
+    def handle(self, *args, **options):
+        accounts = [account.strip() for account in (options['accounts'] or '').split(',') if account.strip()]
+        result = asyncio.run(self._watch(accounts, options))
+        self.stdout.write(self.style.SUCCESS(
+            f'Credited {result.credited} deposits ({result.unmatched} unmatched, {result.ignored} ignored)'
+        ))
+
+    async def _watch(self, accounts, options):
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        return await watch(get_client(), accounts or None, batch_size=options['batch_size'],
+                           poll_interval=options['poll_interval'], stop=stop, once=options['once'])
@@ -0,0 +1,195 @@
+"""
+Query budget instrumentation.
+
+QueryBudgetMiddleware counts and times every SQL statement a request runs
+(via connection.execute_wrapper, so it works with DEBUG off) and reports:
+- Response headers: X-DB-Query-Count, X-DB-Query-Time-Ms,
+  X-DB-Slowest-Query-Ms and, when the view declares one, X-DB-Query-Budget
+- A rolling per-route summary served at /api/debug/queries/
+
+Views declare budgets per action:
+
+    class ListingViewSet(viewsets.ModelViewSet):
+        query_budgets = {'list': 4, 'retrieve': 3}
+
+Requests over budget are logged; core.testing.QueryBudgetTestMixin turns
+them into test failures.
+
+Streaming responses send their headers before the body runs its queries,
+so they carry only X-DB-Query-Budget. Their queries are counted until the
+stream is exhausted or closed, then logged and recorded per route like any
+other request. Async streams are not counted.
+"""
+
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+QUERY_COUNT_HEADER = 'X-DB-Query-Count'
+QUERY_TIME_HEADER = 'X-DB-Query-Time-Ms'
+SLOWEST_QUERY_HEADER = 'X-DB-Slowest-Query-Ms'
+QUERY_BUDGET_HEADER = 'X-DB-Query-Budget'
+
+
+class QueryRecorder:
+    """execute_wrapper that tallies count, total time and the slowest statement."""
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_sql = ''
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.total_time += elapsed
+            if elapsed > self.slowest_time:
+                self.slowest_time = elapsed
+                self.slowest_sql = sql
+
+
+class RouteStats:
+    """Thread-safe rolling window of per-route query samples."""
+
+    def __init__(self, window=None):
+        self.window = window or getattr(settings, 'QUERY_STATS_WINDOW', 200)
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=self.window))
+        self._slowest = {}
+
+    def record(self, route, recorder, budget=None):
+        with self._lock:
+            self._samples[route].append((recorder.count, recorder.total_time, budget))
+            slowest = self._slowest.get(route)
+            if recorder.slowest_sql and (slowest is None or recorder.slowest_time > slowest[0]):
+                self._slowest[route] = (recorder.slowest_time, recorder.slowest_sql)
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._slowest.clear()
+
+    def summary(self):
+        with self._lock:
+            routes = {}
+            for route, samples in self._samples.items():
+                counts = sorted(sample[0] for sample in samples)
+                times = [sample[1] for sample in samples]
+                budget = samples[-1][2]
+                slowest = self._slowest.get(route, (0.0, ''))
+                routes[route] = {
+                    'requests': len(samples),
+                    'queries_avg': round(sum(counts) / len(counts), 2),
+                    'queries_p95': counts[min(len(counts) - 1, int(len(counts) * 0.95))],
+                    'queries_max': counts[-1],
+                    'sql_time_avg_ms': round(sum(times) / len(times) * 1000, 3),
+                    'sql_time_max_ms': round(max(times) * 1000, 3),
+                    'budget': budget,
+                    'over_budget': sum(1 for sample in samples if sample[2] is not None and sample[0] > sample[2]),
+                    'slowest_query_ms': round(slowest[0] * 1000, 3),
+                    'slowest_query': slowest[1],
+                }
+            return routes
+
+
+route_stats = RouteStats()
+
+
+def get_query_budget(view_func, method):
+    """Look up the budget a ViewSet declares for the action serving `method`."""
+    view_class = getattr(view_func, 'cls', None)
+    budgets = getattr(view_class, 'query_budgets', None)
+    if not budgets:
+        return None
+    if isinstance(budgets, int):
+        return budgets
+    actions = getattr(view_func, 'actions', None) or {}
+    return budgets.get(actions.get(method.lower()))
+
+
+def recording(recorder):
+    """Context that feeds every connection's queries on this thread to `recorder`."""
+    stack = ExitStack()
+    for alias in connections:
+        stack.enter_context(connections[alias].execute_wrapper(recorder))
+    return stack
+
+
+class CountedStream:
+    """
+    Streaming body that keeps feeding its queries to `recorder`; `on_close`
+    runs once when the server closes the response.
+    """
+
+    def __init__(self, content, recorder, on_close):
+        self._chunks = iter(content)
+        self._recorder = recorder
+        self._on_close = on_close
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with recording(self._recorder):
+            return next(self._chunks)
+
+    def close(self):
+        on_close, self._on_close = self._on_close, None
+        if on_close is not None:
+            on_close()
+
+
+class QueryBudgetMiddleware:
+    """Record query count/time per request and report it."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        request._query_budget = None
+
+        with recording(recorder):
+            response = self.get_response(request)
+
+        budget = request._query_budget
+        if budget is not None:
+            response[QUERY_BUDGET_HEADER] = str(budget)
+        if response.streaming and not response.is_async:
+            # The body runs its own queries after the headers are sent, so
+            # the totals are only logged and recorded once the stream closes
+            response.streaming_content = CountedStream(response.streaming_content, recorder,
+                                                       lambda: self._report(request, recorder))
+            return response
+
+        response[QUERY_COUNT_HEADER] = str(recorder.count)
+        response[QUERY_TIME_HEADER] = f'{recorder.total_time * 1000:.3f}'
+        response[SLOWEST_QUERY_HEADER] = f'{recorder.slowest_time * 1000:.3f}'
+        self._report(request, recorder)
+        return response
+
+    def _report(self, request, recorder):
+        budget = request._query_budget
+        if budget is not None and recorder.count > budget:
+            logger.warning('%s %s ran %d queries (budget %d)',
+                           request.method, request.path, recorder.count, budget)
+
+        match = getattr(request, 'resolver_match', None)
+        if match is not None:
+            route_stats.record(f'{request.method} {match.view_name or match.route}', recorder, budget)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._query_budget = get_query_budget(view_func, request.method)
+        return None
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:14
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+def give_each_row_a_journal(apps, schema_editor):
+    """Rows written before the ledger are single legs: one journal each."""
+    Transaction = apps.get_model('core', 'Transaction')
+    rows = list(Transaction.objects.filter(journal_id__isnull=True).only('pk'))
+    for row in rows:
+        row.journal_id = uuid.uuid4()
+    Transaction.objects.bulk_update(rows, ['journal_id'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='account',
+            field=models.CharField(choices=[('wallet', 'Wallet'), ('escrow', 'Escrow'), ('loan_pool', 'Lending Pool'), ('external', 'External')], default='wallet', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='journal_id',
+            field=models.UUIDField(null=True),
+        ),
+        migrations.RunPython(give_each_row_a_journal, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='transaction',
+            name='journal_id',
+            field=models.UUIDField(db_index=True, default=uuid.uuid4),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
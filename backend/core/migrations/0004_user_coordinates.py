@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:35
+
+from django.db import migrations, models
+
+from core.geo import geocode_first
+
+
+def geocode_users(apps, schema_editor):
+    User = apps.get_model('core', 'User')
+    for user in User.objects.only('pk', 'farm_location', 'location').iterator():
+        coordinates = geocode_first(user.farm_location, user.location)
+        if coordinates is not None:
+            User.objects.filter(pk=user.pk).update(latitude=coordinates[0], longitude=coordinates[1])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_balance_snapshots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='latitude',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='longitude',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(geocode_users, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:19
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_job_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxBatch',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('source_account', models.CharField(max_length=56)),
+                ('sequence', models.BigIntegerField()),
+                ('tx_hash', models.CharField(max_length=64, unique=True)),
+                ('envelope', models.JSONField()),
+                ('operation_count', models.IntegerField()),
+                ('status', models.CharField(choices=[('submitted', 'Submitted'), ('confirmed', 'Confirmed'), ('failed', 'Failed')], default='submitted', max_length=20)),
+                ('fee_charged', models.BigIntegerField(blank=True, null=True)),
+                ('ledger', models.BigIntegerField(blank=True, null=True)),
+                ('result_codes', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(condition=models.Q(('status', 'submitted')), fields=['created_at'], name='core_outbox_batch_open_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='OutboxOperation',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('create_account', 'Create Account'), ('payment', 'Payment')], max_length=20)),
+                ('source', models.CharField(blank=True, max_length=56)),
+                ('destination', models.CharField(max_length=56)),
+                ('amount', models.DecimalField(decimal_places=7, max_digits=20)),
+                ('reference_type', models.CharField(blank=True, max_length=50)),
+                ('reference_id', models.UUIDField(blank=True, null=True)),
+                ('ledger_tx_hash', models.CharField(blank=True, max_length=64)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('submitted', 'Submitted'), ('confirmed', 'Confirmed'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('position', models.IntegerField(blank=True, null=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('last_error', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('batch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='operations', to='core.outboxbatch')),
+            ],
+            options={
+                'ordering': ['created_at'],
+                'indexes': [models.Index(condition=models.Q(('status', 'pending')), fields=['created_at', 'id'], name='core_outbox_pending_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_stellar_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChannelAccount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('address', models.CharField(max_length=56, unique=True)),
+                ('status', models.CharField(choices=[('idle', 'Idle'), ('leased', 'Leased')], default='idle', max_length=20)),
+                ('leased_by', models.CharField(blank=True, max_length=100)),
+                ('leased_at', models.DateTimeField(blank=True, null=True)),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('sequence', models.BigIntegerField(blank=True, null=True)),
+                ('transactions', models.BigIntegerField(default=0)),
+                ('resyncs', models.IntegerField(default=0)),
+                ('busy_seconds', models.FloatField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['created_at'],
+            },
+        ),
+    ]
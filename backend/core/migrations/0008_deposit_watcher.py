@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:37
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+from core.models import new_deposit_memo
+
+
+def assign_deposit_memos(apps, schema_editor):
+    User = apps.get_model('core', 'User')
+    for pk in User.objects.filter(deposit_memo__isnull=True).values_list('pk', flat=True).iterator():
+        User.objects.filter(pk=pk).update(deposit_memo=new_deposit_memo())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_channel_accounts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('cursor', models.CharField(blank=True, max_length=64)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='deposit_memo',
+            field=models.CharField(blank=True, editable=False, max_length=28, null=True, unique=True),
+        ),
+        migrations.RunPython(assign_deposit_memos, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='user',
+            name='wallet_address',
+            field=models.CharField(blank=True, db_index=True, help_text='Stellar Public Key', max_length=56),
+        ),
+        migrations.CreateModel(
+            name='Deposit',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('payment_id', models.CharField(max_length=64, unique=True)),
+                ('account', models.CharField(max_length=56)),
+                ('source', models.CharField(max_length=56)),
+                ('amount', models.DecimalField(decimal_places=7, max_digits=22)),
+                ('asset_code', models.CharField(blank=True, max_length=12)),
+                ('memo', models.CharField(blank=True, max_length=64)),
+                ('tx_hash', models.CharField(max_length=64)),
+                ('status', models.CharField(choices=[('credited', 'Credited'), ('unmatched', 'Unmatched'), ('ignored', 'Ignored')], max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='deposits', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(condition=models.Q(('status', 'unmatched')), fields=['created_at'], name='core_deposit_unmatched_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations
+from django.db.models import Count
+from django.utils import timezone
+
+
+def write_opening_snapshots(apps, schema_editor):
+    """
+    Checkpoint every user's stored balances. Balances set before the ledger
+    existed have no Transaction legs to sum, so history has to start here.
+    """
+    User = apps.get_model('core', 'User')
+    BalanceSnapshot = apps.get_model('core', 'BalanceSnapshot')
+    as_of = timezone.now()
+    users = (
+        User.objects.filter(balance_snapshots__isnull=True)
+        .annotate(rows=Count('transactions'))
+        .values_list('pk', 'wallet_balance', 'escrow_balance', 'rows')
+    )
+    BalanceSnapshot.objects.bulk_create([
+        BalanceSnapshot(user_id=pk, as_of=as_of, wallet_balance=wallet, escrow_balance=escrow,
+                        transaction_count=rows)
+        for pk, wallet, escrow, rows in users.iterator()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_payout_runs'),
+    ]
+
+    operations = [
+        migrations.RunPython(write_opening_snapshots, migrations.RunPython.noop),
+    ]
@@ -12,6 +12,8 @@ from django.db import models
 import uuid
 import secrets
 
+from .state_machine import StateMachine, Transition
+
 
 class UserManager(BaseUserManager):
     def create_user(self, email, password=None, **extra_fields):
@@ -31,6 +33,10 @@ class UserManager(BaseUserManager):
         return self.create_user(email, password, **extra_fields)
 
 
+def new_deposit_memo() -> str:
+    return secrets.token_hex(6).upper()
+
+
 class User(AbstractBaseUser, PermissionsMixin):
     """
     Custom User model with role flags for Farmer, Buyer, and Admin.
@@ -53,13 +59,19 @@ class User(AbstractBaseUser, PermissionsMixin):
     main_crops = models.CharField(max_length=200, blank=True, help_text="Comma-separated list of main crops")
     
     # Wallet Fields (Merged from Wallet model)
-    wallet_address = models.CharField(max_length=56, blank=True, help_text="Stellar Public Key")
+    wallet_address = models.CharField(max_length=56, blank=True, db_index=True, help_text="Stellar Public Key")
+    # Memo that routes a payment to the platform account into this wallet (see core.deposits)
+    deposit_memo = models.CharField(max_length=28, unique=True, null=True, blank=True, editable=False)
     wallet_balance = models.DecimalField(max_digits=15, decimal_places=2, default=0)
     escrow_balance = models.DecimalField(max_digits=15, decimal_places=2, default=0)
     
     # Generic Location
     location = models.CharField(max_length=200, blank=True, null=True, default='')
     
+    # Geocoded from farm_location / location (see core.geo)
+    latitude = models.FloatField(null=True, blank=True, editable=False)
+    longitude = models.FloatField(null=True, blank=True, editable=False)
+    
     # Django auth fields
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
@@ -71,10 +83,33 @@ class User(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['full_name']
     
+    # Left out of save() on existing rows; see core.ledger
+    BALANCE_FIELDS = ('wallet_balance', 'escrow_balance')
+    
     def save(self, *args, **kwargs):
         if not self.wallet_address:
             # PRODUCTION: Use stellar_sdk.Keypair.random().public_key
             self.wallet_address = f"G{secrets.token_hex(27).upper()}"
+        if not self.deposit_memo:
+            self.deposit_memo = new_deposit_memo()
+        
+        # Offline gazetteer lookup; listings copy the farm's coordinates
+        from .geo import geocode_first
+        coordinates = geocode_first(self.farm_location, self.location) or (None, None)
+        self._coordinates_changed = coordinates != (self.latitude, self.longitude)
+        self.latitude, self.longitude = coordinates
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and not self._state.adding:
+            # Balances move only through core.ledger's F() UPDATEs; writing the
+            # loaded values back would undo a posting made since this row was read
+            deferred = self.get_deferred_fields()
+            update_fields = kwargs['update_fields'] = {
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in deferred
+                and field.attname not in self.BALANCE_FIELDS
+            }
+        if self._coordinates_changed and update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'latitude', 'longitude'}
         super().save(*args, **kwargs)
     
     def __str__(self):
@@ -83,6 +118,12 @@ class User(AbstractBaseUser, PermissionsMixin):
         elif self.is_buyer: role = "Buyer"
         return f"{self.full_name} ({role}) - {self.email}"
     
+    @property
+    def coordinates(self):
+        if self.latitude is None or self.longitude is None:
+            return None
+        return self.latitude, self.longitude
+    
     @property
     def available_balance(self):
         """Balance minus escrowed funds."""
@@ -92,6 +133,11 @@ class User(AbstractBaseUser, PermissionsMixin):
 class Transaction(models.Model):
     """
     Transaction history for user wallet operations.
+
+    Each row is one leg of a balanced ledger journal (see core.ledger).
+    Rows are append-only: the sum of a user's amounts per account equals
+    the matching balance column. System legs (loan pool, external funds)
+    have no user.
     """
     TRANSACTION_TYPES = [
         ('deposit', 'Deposit'),
@@ -103,8 +149,19 @@ class Transaction(models.Model):
         ('sale_payment', 'Sale Payment'),
     ]
     
+    ACCOUNT_CHOICES = [
+        ('wallet', 'Wallet'),
+        ('escrow', 'Escrow'),
+        ('loan_pool', 'Lending Pool'),
+        ('external', 'External'),
+    ]
+    
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='transactions')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='transactions', null=True, blank=True)
+    
+    # Ledger journal this leg belongs to (legs of a journal sum to zero)
+    journal_id = models.UUIDField(default=uuid.uuid4, db_index=True)
+    account = models.CharField(max_length=20, choices=ACCOUNT_CHOICES, default='wallet')
     
     transaction_type = models.CharField(max_length=20, choices=TRANSACTION_TYPES)
     amount = models.DecimalField(max_digits=15, decimal_places=2)
@@ -120,12 +177,368 @@ class Transaction(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     
     def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Transactions are append-only')
         if not self.stellar_tx_hash:
             self.stellar_tx_hash = secrets.token_hex(32)
         super().save(*args, **kwargs)
     
     def __str__(self):
-        return f"{self.transaction_type}: {self.amount} ({self.user.full_name})"
+        owner = self.user.full_name if self.user_id else self.account
+        return f"{self.transaction_type}: {self.amount} ({owner})"
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='core_tx_user_created_idx'),
+        ]
+
+
+class BalanceSnapshot(models.Model):
+    """
+    Checkpoint of a user's balances as of a point in time.
+    
+    Built incrementally by `manage.py build_balance_snapshots`: each snapshot
+    is the previous one plus the Transaction legs posted since, so
+    balance-as-of queries only read rows newer than the nearest snapshot.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='balance_snapshots')
+    
+    as_of = models.DateTimeField()
+    wallet_balance = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    escrow_balance = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    
+    # Number of transactions folded in since the previous snapshot
+    transaction_count = models.IntegerField(default=0)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Snapshot {self.user_id} @ {self.as_of}: {self.wallet_balance}/{self.escrow_balance}"
+    
+    class Meta:
+        ordering = ['-as_of']
+        unique_together = ['user', 'as_of']
+
+
+class Job(models.Model):
+    """
+    Background job in the database-backed queue (see core.jobs).
+    
+    Workers claim a queued job by leasing it: status becomes `running`
+    with a lease expiry. A worker that dies leaves the lease to expire,
+    after which another worker may claim the job again. Failures are
+    retried with exponential backoff until `max_attempts`.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+    
+    # Every status change goes through these (see core.state_machine).
+    # Claiming a `running` job is only allowed once its lease has expired.
+    states = StateMachine({
+        'claim': Transition(['queued', 'running'], 'running', timestamp='started_at'),
+        'succeed': Transition(['running'], 'succeeded', timestamp='finished_at'),
+        'retry': Transition(['running'], 'queued'),
+        'fail': Transition(['running'], 'failed', timestamp='finished_at'),
+    })
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    queue = models.CharField(max_length=50, default='default')
+    task = models.CharField(max_length=200)
+    kwargs = models.JSONField(default=dict)
+    
+    # Higher runs first; ties go to the job that became runnable first
+    priority = models.IntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    run_at = models.DateTimeField()
+    
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    locked_by = models.CharField(max_length=100, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"{self.task} [{self.queue}] {self.status}"
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # Claim: next runnable job per queue
+            models.Index(fields=['queue', '-priority', 'run_at'], condition=models.Q(status='queued'),
+                         name='core_job_runnable_idx'),
+            # Reclaim of expired leases and per-queue running counts
+            models.Index(fields=['queue', 'lease_expires_at'], condition=models.Q(status='running'),
+                         name='core_job_running_idx'),
+        ]
+
+
+class OutboxBatch(models.Model):
+    """
+    One Stellar transaction packed from pending outbox operations
+    (see core.outbox). The hash is known before submission, so a batch
+    whose submission outcome is unknown can be looked up on Horizon.
+    """
+    STATUS_CHOICES = [
+        ('submitted', 'Submitted'),
+        ('confirmed', 'Confirmed'),
+        ('failed', 'Failed'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    source_account = models.CharField(max_length=56)
+    sequence = models.BigIntegerField()
+    tx_hash = models.CharField(max_length=64, unique=True)
+    envelope = models.JSONField()
+    operation_count = models.IntegerField()
+    
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='submitted')
+    # Stroops actually charged by the network (failed transactions pay too)
+    fee_charged = models.BigIntegerField(null=True, blank=True)
+    ledger = models.BigIntegerField(null=True, blank=True)
+    result_codes = models.JSONField(default=dict, blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"Batch {self.tx_hash[:12]} ({self.operation_count} ops) {self.status}"
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at'], condition=models.Q(status='submitted'),
+                         name='core_outbox_batch_open_idx'),
+        ]
+
+
+class OutboxOperation(models.Model):
+    """
+    A Stellar operation owed for a ledger change, written in the same
+    database transaction as the change (transactional outbox). The
+    dispatcher packs pending rows into OutboxBatch transactions.
+    """
+    KIND_CHOICES = [
+        ('create_account', 'Create Account'),
+        ('payment', 'Payment'),
+    ]
+    
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('submitted', 'Submitted'),
+        ('confirmed', 'Confirmed'),
+        ('failed', 'Failed'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    # Operation source; blank means the transaction's source (the platform account)
+    source = models.CharField(max_length=56, blank=True)
+    destination = models.CharField(max_length=56)
+    amount = models.DecimalField(max_digits=20, decimal_places=7)
+    
+    # Ledger change this operation settles on-chain
+    reference_type = models.CharField(max_length=50, blank=True)
+    reference_id = models.UUIDField(null=True, blank=True)
+    ledger_tx_hash = models.CharField(max_length=64, blank=True)
+    
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    batch = models.ForeignKey(OutboxBatch, on_delete=models.SET_NULL, null=True, blank=True,
+                              related_name='operations')
+    # Index of the (possibly merged) operation in the batch's transaction
+    position = models.IntegerField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    last_error = models.CharField(max_length=100, blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.kind} {self.amount} -> {self.destination[:8]} {self.status}"
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            # Dispatcher: oldest pending operations first
+            models.Index(fields=['created_at', 'id'], condition=models.Q(status='pending'),
+                         name='core_outbox_pending_idx'),
+            # Payout reconciliation looks up a run's operations
+            models.Index(fields=['reference_type', 'reference_id'], name='core_outbox_reference_idx'),
+        ]
+
+
+class ChannelAccount(models.Model):
+    """
+    Pre-funded Stellar account used only as a transaction source (see
+    core.channels). Each submitting worker leases one, so parallel
+    submissions draw on separate sequence numbers; the operations inside
+    still name their real source accounts.
+    """
+    STATUS_CHOICES = [
+        ('idle', 'Idle'),
+        ('leased', 'Leased'),
+    ]
+    
+    # A `leased` channel can only be leased again once its lease has expired
+    states = StateMachine({
+        'lease': Transition(['idle', 'leased'], 'leased', timestamp='leased_at'),
+        'release': Transition(['leased'], 'idle'),
+    })
+    
+    address = models.CharField(max_length=56, unique=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='idle')
+    leased_by = models.CharField(max_length=100, blank=True)
+    leased_at = models.DateTimeField(null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    
+    # Last sequence number used; null until loaded from Horizon
+    sequence = models.BigIntegerField(null=True, blank=True)
+    
+    # Utilization counters, updated when a lease is released
+    transactions = models.BigIntegerField(default=0)
+    resyncs = models.IntegerField(default=0)
+    busy_seconds = models.FloatField(default=0)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Channel {self.address[:8]} {self.status}"
+    
+    class Meta:
+        ordering = ['created_at']
+
+
+class Deposit(models.Model):
+    """
+    A payment into a platform account, as ingested from Horizon by
+    core.deposits. Credited deposits have a matching ledger journal;
+    unmatched ones wait for support to assign or return them.
+    """
+    STATUS_CHOICES = [
+        ('credited', 'Credited'),
+        ('unmatched', 'Unmatched'),
+        ('ignored', 'Ignored'),  # another asset, or less than the ledger's smallest unit
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # Horizon operation id; a payment is ingested once
+    payment_id = models.CharField(max_length=64, unique=True)
+    account = models.CharField(max_length=56)
+    source = models.CharField(max_length=56)
+    amount = models.DecimalField(max_digits=22, decimal_places=7)
+    asset_code = models.CharField(max_length=12, blank=True)
+    memo = models.CharField(max_length=64, blank=True)
+    tx_hash = models.CharField(max_length=64)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='deposits')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Deposit {self.payment_id} {self.amount} ({self.status})"
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at'], condition=models.Q(status='unmatched'),
+                         name='core_deposit_unmatched_idx'),
+        ]
+
+
+class IngestCursor(models.Model):
+    """Paging cursor an ingestion stream has processed up to (see core.deposits)."""
+    name = models.CharField(max_length=100, unique=True)
+    cursor = models.CharField(max_length=64, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name} @ {self.cursor or 'start'}"
+
+
+class PayoutRun(models.Model):
+    """
+    One scheduled payout batch (see core.payouts): the queued withdrawals
+    it took, netted to one outbox payment per destination, and its
+    reconciliation report once every payment has settled.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('completed', 'Completed'),
+    ]
+    
+    states = StateMachine({
+        'complete': Transition(['pending'], 'completed', timestamp='completed_at'),
+    })
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    withdrawal_count = models.IntegerField()
+    destination_count = models.IntegerField()
+    total_amount = models.DecimalField(max_digits=15, decimal_places=2)
+    report = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"Payout run {self.id} ({self.withdrawal_count} withdrawals) {self.status}"
+    
+    class Meta:
+        ordering = ['-created_at']
+
+
+class Withdrawal(models.Model):
+    """
+    A user's request to pay wallet funds out to a Stellar address. The
+    wallet is debited when the request is queued and credited back if
+    the payout fails.
+    
+    State Machine:
+    QUEUED -> BATCHED (taken by a PayoutRun) -> PAID / FAILED
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('batched', 'Batched'),
+        ('paid', 'Paid'),
+        ('failed', 'Failed'),
+    ]
+    
+    states = StateMachine({
+        'batch': Transition(['queued'], 'batched'),
+        'pay': Transition(['batched'], 'paid', timestamp='paid_at'),
+        'fail': Transition(['batched'], 'failed'),
+    })
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.PROTECT, related_name='withdrawals')
+    amount = models.DecimalField(max_digits=15, decimal_places=2)
+    destination = models.CharField(max_length=56)
+    # Client-chosen key: repeating a request with the same key returns the first one
+    idempotency_key = models.CharField(max_length=64, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    run = models.ForeignKey(PayoutRun, on_delete=models.SET_NULL, null=True, blank=True,
+                            related_name='withdrawals')
+    last_error = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    paid_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"Withdrawal {self.amount} -> {self.destination[:8]} ({self.status})"
     
     class Meta:
         ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'idempotency_key'], condition=~models.Q(idempotency_key=''),
+                                    name='core_withdrawal_idempotency_uniq'),
+        ]
+        indexes = [
+            # Payout runs take the oldest queued requests
+            models.Index(fields=['created_at'], condition=models.Q(status='queued'),
+                         name='core_withdrawal_queued_idx'),
+        ]
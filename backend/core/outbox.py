@@ -0,0 +1,304 @@
+"""
+Transactional outbox for on-chain escrow operations.
+
+Services record the Stellar operations a ledger change owes in the same
+database transaction as the change:
+
+    with transaction.atomic():
+        tx_hash = ledger.post(legs, ...)
+        outbox.record([outbox.payment(buyer_wallet, escrow_address, amount, ledger_tx_hash=tx_hash)])
+
+so an operation is queued if and only if the ledger change commits, and
+no request waits on the network. dispatch() (`python manage.py
+dispatch_outbox`) packs pending operations, oldest first, into Stellar
+transactions of up to 100 operations and submits them:
+
+- one network round trip and one sequence number per 100 operations
+  instead of per ledger movement
+- payments between the same two accounts are merged into one operation
+  when no intervening operation funds the payer, so the per-operation
+  fee is paid once for all of them
+- every batch's hash is stored before submission; a batch whose outcome
+  is unknown (timeout) is looked up on the next run and confirmed, or
+  released once its time bounds have passed
+- a transaction that fails on an operation marks that operation failed
+  and returns the rest to pending
+
+Several dispatchers can run at once, each submitting through its own
+leased channel account (core.channels). Operations on one account still
+go on-chain in the order they were recorded: an operation is held back
+while an earlier operation touching the same account is in flight in
+another batch. The platform and loan pool accounts are exempt, as they
+are funded far beyond any batch.
+
+PRODUCTION NOTES:
+- Alert on failed operations - the ledger moved but the chain did not
+- Operations with a user's wallet as source need that wallet's signature;
+  the custodial platform signs with keys held in its HSM
+"""
+
+import logging
+import uuid
+from decimal import Decimal
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from . import channels
+from .stellar import (
+    MAX_OPERATIONS, HorizonError, HorizonUnavailable, build_envelope, format_amount,
+    get_client, transaction_hash,
+)
+
+logger = logging.getLogger(__name__)
+
+# Pending rows read per batch, so merging can fill 100 operations
+PACK_WINDOW = 5
+
+
+class OutboxConflict(Exception):
+    """Raised when another dispatcher claimed operations being packed."""
+
+
+class Operation(NamedTuple):
+    """A Stellar operation to record; build with create_account() or payment()."""
+    kind: str
+    destination: str
+    amount: Decimal
+    source: str = ''
+    reference_type: str = ''
+    reference_id: Optional[uuid.UUID] = None
+    ledger_tx_hash: str = ''
+
+
+class DispatchResult(NamedTuple):
+    batches: int = 0
+    operations: int = 0
+    fee_charged: int = 0
+
+
+def create_account(destination: str, starting_balance=None, **reference) -> Operation:
+    """Create and fund `destination` from the platform account."""
+    amount = Decimal(starting_balance or settings.STELLAR_STARTING_BALANCE)
+    return Operation('create_account', destination, amount, **reference)
+
+
+def payment(source: str, destination: str, amount, **reference) -> Operation:
+    """Pay `amount` of the platform asset from `source` to `destination`."""
+    return Operation('payment', destination, Decimal(amount), source, **reference)
+
+
+def record(operations: Iterable[Operation]) -> None:
+    """Queue `operations` with one INSERT, in the caller's transaction."""
+    from .models import OutboxOperation
+
+    rows = [OutboxOperation(**operation._asdict()) for operation in operations if operation.amount > 0]
+    if rows:
+        OutboxOperation.objects.bulk_create(rows)
+
+
+def _envelope_operation(kind, source, destination, amount, tx_source: str) -> Dict:
+    if kind == 'create_account':
+        operation = {'type': kind, 'destination': destination, 'starting_balance': format_amount(amount)}
+    else:
+        operation = {
+            'type': kind,
+            'destination': destination,
+            'asset': {'code': settings.STELLAR_ASSET_CODE, 'issuer': settings.STELLAR_ASSET_ISSUER},
+            'amount': format_amount(amount),
+        }
+    # Operations default to the transaction's source, which may be a channel account
+    source = source or settings.STELLAR_PLATFORM_ACCOUNT
+    if source != tx_source:
+        operation['source'] = source
+    return operation
+
+
+def _treasury() -> set:
+    return {settings.STELLAR_PLATFORM_ACCOUNT, settings.STELLAR_LOAN_POOL_ACCOUNT}
+
+
+def _merge(rows, batch_size: int, merge: bool, busy: set = frozenset()) -> List[List]:
+    """
+    Group pending `rows` (pk, kind, source, destination, amount), in order,
+    into at most `batch_size` operations. A payment joins an earlier one
+    with the same source and destination only if its source received
+    nothing in between, so moving it earlier cannot leave the source short.
+    Rows touching a `busy` account (in flight elsewhere) are held back,
+    along with every later row touching the same accounts.
+    Returns [kind, source, destination, amount, pks] groups.
+    """
+    platform, treasury = settings.STELLAR_PLATFORM_ACCOUNT, _treasury()
+    busy = set(busy)
+    groups: List[List] = []
+    first_row: List[int] = []
+    open_groups: Dict = {}
+    last_inflow: Dict[str, int] = {}
+    for index, (pk, kind, source, destination, amount) in enumerate(rows):
+        key = (source or platform, destination)
+        if busy.intersection(key):
+            busy.update(set(key) - treasury)
+            continue
+        group = open_groups.get(key) if merge and kind == 'payment' else None
+        if group is not None and last_inflow.get(key[0], -1) < first_row[group]:
+            groups[group][3] += amount
+            groups[group][4].append(pk)
+        elif len(groups) == batch_size:
+            break
+        else:
+            groups.append([kind, source, destination, amount, [pk]])
+            first_row.append(index)
+            if kind == 'payment':
+                open_groups[key] = len(groups) - 1
+        last_inflow[destination] = index
+    return groups
+
+
+def _pack(source_account: str, sequence: int, batch_size: int, merge: bool):
+    """Claim the oldest pending operations into a new batch; None when there are none."""
+    from .models import OutboxBatch, OutboxOperation
+
+    with transaction.atomic():
+        # Lock first, then read what is in flight: on PostgreSQL a concurrent
+        # packer's claim is then already committed and visible
+        rows = list(
+            OutboxOperation.objects.select_for_update().filter(status='pending').order_by('created_at', 'pk')
+            .values_list('pk', 'kind', 'source', 'destination', 'amount')[:batch_size * PACK_WINDOW]
+        )
+        if not rows:
+            return None
+        busy = set()
+        for source, destination in OutboxOperation.objects.filter(status='submitted').values_list(
+                'source', 'destination'):
+            busy.update({source or settings.STELLAR_PLATFORM_ACCOUNT, destination})
+        groups = _merge(rows, batch_size, merge, busy - _treasury())
+        if not groups:
+            return None
+        # The batch id as memo keeps hashes unique when a released batch is re-sent as is
+        batch_id = uuid.uuid4()
+        envelope = build_envelope(source_account, sequence, [
+            _envelope_operation(kind, source, destination, amount, source_account)
+            for kind, source, destination, amount, _ in groups
+        ], memo=batch_id.hex[:28])
+        batch = OutboxBatch.objects.create(
+            id=batch_id, source_account=source_account, sequence=sequence, tx_hash=transaction_hash(envelope),
+            envelope=envelope, operation_count=len(groups),
+        )
+        pks = [pk for group in groups for pk in group[4]]
+        claimed = OutboxOperation.objects.filter(pk__in=pks, status='pending').update(
+            status='submitted',
+            batch=batch,
+            attempts=F('attempts') + 1,
+            position=Case(*[When(pk__in=group[4], then=Value(position)) for position, group in enumerate(groups)],
+                          output_field=IntegerField()),
+        )
+        if claimed != len(pks):
+            raise OutboxConflict('Operations were claimed by another dispatcher')
+    return batch
+
+
+def _confirm(batch, result: Dict) -> int:
+    """Mark `batch` and its operations confirmed; returns the operation count."""
+    from .models import OutboxOperation
+
+    with transaction.atomic():
+        type(batch).objects.filter(pk=batch.pk).update(
+            status='confirmed', fee_charged=result['fee_charged'], ledger=result['ledger'],
+            finished_at=timezone.now(),
+        )
+        return OutboxOperation.objects.filter(batch=batch, status='submitted').update(status='confirmed')
+
+
+def _reject(batch, result_codes: Dict, fee_charged: int = None) -> None:
+    """
+    Record a failed `batch`. Operations Horizon blamed, and operations out
+    of attempts, fail; the rest go back to pending.
+    """
+    from .models import OutboxOperation
+
+    code = result_codes.get('transaction', 'tx_failed')
+    blamed = {position: op_code for position, op_code in enumerate(result_codes.get('operations', []))
+              if op_code != 'op_success'}
+    operations = OutboxOperation.objects.filter(batch=batch, status='submitted')
+    with transaction.atomic():
+        type(batch).objects.filter(pk=batch.pk).update(
+            status='failed', result_codes=result_codes, fee_charged=fee_charged, finished_at=timezone.now(),
+        )
+        for position, op_code in blamed.items():
+            operations.filter(position=position).update(status='failed', last_error=op_code)
+        operations.filter(attempts__gte=settings.OUTBOX_MAX_ATTEMPTS).update(status='failed', last_error=code)
+        operations.update(status='pending', last_error=code)
+    if blamed:
+        logger.error('Outbox batch %s failed on operations %s', batch.tx_hash, blamed)
+
+
+def recover(client, source_account: str) -> bool:
+    """
+    Settle batches `source_account` left `submitted` in an interrupted run.
+    Returns False while one may still land, as its sequence number is
+    still live.
+    """
+    from .models import OutboxBatch
+
+    for batch in OutboxBatch.objects.filter(status='submitted', source_account=source_account).order_by('created_at'):
+        try:
+            result = client.find_transaction(batch.tx_hash)
+        except HorizonUnavailable:
+            return False
+        if result is None:
+            if batch.envelope['time_bounds']['max_time'] >= timezone.now().timestamp():
+                return False
+            _reject(batch, {'transaction': 'tx_too_late'})
+        elif result.get('successful', True):
+            _confirm(batch, result)
+        else:
+            _reject(batch, result.get('result_codes', {}), result.get('fee_charged'))
+    return True
+
+
+def dispatch(client=None, max_batches: int = None, batch_size: int = MAX_OPERATIONS,
+             merge: bool = True, worker_id: str = None) -> DispatchResult:
+    """
+    Lease a channel account and submit pending operations through it
+    until none are left (or `max_batches` were sent, or the lease nears
+    its end). Stops early when no channel is free, Horizon is unreachable
+    or it rejects a transaction for a reason retrying will not fix.
+    """
+    client = client or get_client()
+    batches = operations = fees = 0
+    with channels.leased(client, worker_id or channels.worker_name()) as channel:
+        if channel is None or not recover(client, channel.address):
+            return DispatchResult()
+
+        while (max_batches is None or batches < max_batches) and not channel.expiring():
+            try:
+                batch = _pack(channel.address, channel.next_sequence(), batch_size, merge)
+            except OutboxConflict:
+                continue
+            if batch is None:
+                break
+            batches += 1
+            try:
+                result = client.submit(batch.envelope)
+            except HorizonUnavailable:
+                logger.warning('Outcome of outbox batch %s unknown; will check on next run', batch.tx_hash)
+                break
+            except HorizonError as exc:
+                fee = exc.result_codes.get('fee_charged')
+                _reject(batch, {key: value for key, value in exc.result_codes.items() if key != 'fee_charged'}, fee)
+                fees += fee or 0
+                if exc.transaction_code == 'tx_failed':
+                    channel.consumed()
+                elif exc.transaction_code == 'tx_bad_seq':
+                    channel.resync()
+                else:
+                    logger.error('Outbox batch %s rejected: %s', batch.tx_hash, exc.result_codes)
+                    break
+            else:
+                operations += _confirm(batch, result)
+                fees += result['fee_charged']
+                channel.consumed()
+    return DispatchResult(batches, operations, fees)
@@ -0,0 +1,234 @@
+"""
+Withdrawal payouts - queued requests paid out in scheduled, netted runs.
+
+A withdrawal debits the user's wallet as soon as it is requested (a
+ledger 'withdrawal' journal, rejected if the available balance is short)
+and waits in the queue. `python manage.py run_payouts`, scheduled every
+few minutes, then pays the queue out in runs:
+
+- a run takes up to PAYOUT_BATCH_SIZE queued withdrawals (the Withdrawal
+  'batch' transition, so two runs never take the same request) and nets
+  them per destination: ten withdrawals to one exchange address become
+  one payment from the platform account
+- the payments are recorded in the outbox, which packs up to 100 of them
+  into each Stellar transaction (see core.outbox) - one fee per
+  destination and one submission per 100 destinations, instead of one
+  transaction per withdrawal
+- retries are the outbox's: an unknown outcome is looked up by hash
+  before anything is re-sent, so a payment is never made twice
+- reconcile() settles each withdrawal from its payment's outcome: paid,
+  or failed and credited back to the wallet. Every transition is a
+  compare-and-swap, so reconciling again changes nothing. Once nothing is
+  in flight the run is completed with a report: amounts paid, failed and
+  in flight, transactions, fees attributed to the run, and any
+  destination whose payments do not add up to its withdrawals
+
+Requests carry an optional idempotency key; repeating a request with the
+same key returns the original instead of debiting the wallet again.
+
+PRODUCTION NOTES:
+- Keep the platform account funded for a run's total before it starts
+- Alert on reports with failures or mismatches
+"""
+
+import uuid
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, List, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Sum, Value, When
+
+from . import ledger, outbox
+
+REFERENCE_TYPE = 'payout'
+
+# Wallet amounts have two decimal places; outbox amounts have Stellar's seven
+CENTS = Decimal('0.01')
+
+
+class PayoutError(Exception):
+    """Raised for withdrawal requests that cannot be queued."""
+
+
+class PayoutConflict(Exception):
+    """Raised when withdrawals changed while a run was being built or reconciled."""
+
+
+def request_withdrawal(user, amount, destination: str, idempotency_key: str = '') -> Tuple[object, bool]:
+    """
+    Debit `amount` from the user's wallet and queue its payout to
+    `destination`. Returns (withdrawal, created); created is False when
+    the idempotency key matched an earlier request. Raises PayoutError,
+    or ledger.InsufficientFunds.
+    """
+    from .models import Withdrawal
+
+    amount = Decimal(amount)
+    if not amount.is_finite() or amount <= 0:
+        raise PayoutError('Amount must be positive')
+    if amount != amount.quantize(CENTS):
+        raise PayoutError('Amount must have at most two decimal places')
+    if not isinstance(destination, str) or len(destination) != 56 or not destination.startswith('G'):
+        raise PayoutError('Destination must be a Stellar account address')
+    user_id = getattr(user, 'pk', user)
+    if idempotency_key:
+        existing = Withdrawal.objects.filter(user_id=user_id, idempotency_key=idempotency_key).first()
+        if existing is not None:
+            return existing, False
+
+    try:
+        with transaction.atomic():
+            withdrawal = Withdrawal.objects.create(user_id=user_id, amount=amount, destination=destination,
+                                                   idempotency_key=idempotency_key)
+            description = f'Withdrawal to {destination}'
+            ledger.post(
+                [
+                    ledger.user_leg(user_id, ledger.WALLET, -amount, 'withdrawal', description, guard=True),
+                    ledger.system_leg(ledger.EXTERNAL, amount, 'withdrawal', description),
+                ],
+                reference_type='withdrawal',
+                reference_id=withdrawal.id,
+            )
+    except IntegrityError:
+        if not idempotency_key:
+            raise
+        # The same request, sent twice at once
+        return Withdrawal.objects.get(user_id=user_id, idempotency_key=idempotency_key), False
+    return withdrawal, True
+
+
+def run_payouts(limit: int = None):
+    """
+    Take up to `limit` queued withdrawals, oldest first, into a new
+    PayoutRun and queue one outbox payment per destination, in one
+    transaction. Returns the run, or None when the queue is empty.
+    """
+    from .models import PayoutRun, Withdrawal
+
+    limit = limit or settings.PAYOUT_BATCH_SIZE
+    with transaction.atomic():
+        rows = list(
+            Withdrawal.objects.select_for_update().filter(status='queued').order_by('created_at')
+            .values_list('pk', 'destination', 'amount')[:limit]
+        )
+        if not rows:
+            return None
+        netted: Dict[str, Decimal] = defaultdict(Decimal)
+        for _, destination, amount in rows:
+            netted[destination] += amount
+        run = PayoutRun.objects.create(
+            withdrawal_count=len(rows), destination_count=len(netted), total_amount=sum(netted.values()),
+        )
+        taken = Withdrawal.states.apply(Withdrawal.objects.filter(pk__in=[row[0] for row in rows]), 'batch',
+                                        run=run)
+        if taken != len(rows):
+            raise PayoutConflict('Withdrawals were taken by another payout run, please retry')
+        outbox.record(
+            outbox.payment(settings.STELLAR_PLATFORM_ACCOUNT, destination, amount,
+                           reference_type=REFERENCE_TYPE, reference_id=run.id)
+            for destination, amount in netted.items()
+        )
+    return run
+
+
+def _report(run, operations: List[Tuple]) -> Dict:
+    """Reconciliation summary of `run` from its (destination, status, amount, batch...) operations."""
+    from .models import OutboxBatch, Withdrawal
+
+    by_status: Dict[str, Decimal] = defaultdict(Decimal)
+    paid_out: Dict[str, Decimal] = defaultdict(Decimal)
+    positions: Dict[uuid.UUID, set] = defaultdict(set)
+    for destination, status, amount, batch_id, position, _ in operations:
+        by_status[status] += amount
+        paid_out[destination] += amount
+        if batch_id is not None:
+            positions[batch_id].add(position)
+    requested = dict(
+        Withdrawal.objects.filter(run=run).order_by().values_list('destination').annotate(Sum('amount'))
+    )
+    fees = 0
+    tx_hashes = []
+    # Stellar charges per operation: a run pays for the operations it had in each shared transaction
+    for batch_id, tx_hash, fee, count in OutboxBatch.objects.filter(pk__in=positions).values_list(
+            'pk', 'tx_hash', 'fee_charged', 'operation_count'):
+        tx_hashes.append(tx_hash)
+        fees += (fee or 0) * len(positions[batch_id]) // count
+    withdrawals = dict(
+        Withdrawal.objects.filter(run=run).order_by().values_list('status').annotate(Sum('amount'))
+    )
+    return {
+        'withdrawals': run.withdrawal_count,
+        'destinations': run.destination_count,
+        'total': str(run.total_amount.quantize(CENTS)),
+        'paid': str(withdrawals.get('paid', Decimal('0')).quantize(CENTS)),
+        'failed': str(withdrawals.get('failed', Decimal('0')).quantize(CENTS)),
+        'in_flight': str((by_status['pending'] + by_status['submitted']).quantize(CENTS)),
+        'transactions': sorted(tx_hashes),
+        'fee_charged': fees,
+        'mismatches': sorted(
+            destination for destination in set(requested) | set(paid_out)
+            if requested.get(destination, 0) != paid_out.get(destination, 0)
+        ),
+    }
+
+
+def reconcile(run) -> Dict:
+    """
+    Settle `run`'s withdrawals from the outcome of their payments: paid
+    when confirmed, failed and credited back when the payment failed.
+    Completes the run once no payment is in flight. Returns the report.
+    """
+    from .models import OutboxOperation, PayoutRun, Withdrawal
+
+    with transaction.atomic():
+        operations = list(
+            OutboxOperation.objects.filter(reference_type=REFERENCE_TYPE, reference_id=run.pk)
+            .values_list('destination', 'status', 'amount', 'batch_id', 'position', 'last_error')
+        )
+        confirmed = {destination for destination, status, *_ in operations if status == 'confirmed'}
+        errors = {destination: error for destination, status, *_, error in operations if status == 'failed'}
+        batched = Withdrawal.objects.filter(run=run, status='batched')
+        if confirmed:
+            Withdrawal.states.apply(batched.filter(destination__in=confirmed), 'pay')
+        failed = list(
+            batched.select_for_update().filter(destination__in=errors).values_list('pk', 'user_id', 'destination',
+                                                                                   'amount')
+        )
+        if failed and Withdrawal.states.apply(
+                Withdrawal.objects.filter(pk__in=[row[0] for row in failed]), 'fail',
+                last_error=Case(*[When(destination=destination, then=Value(error))
+                                  for destination, error in errors.items()], default=Value(''))) != len(failed):
+            raise PayoutConflict('Withdrawals changed during reconciliation, please retry')
+        ledger.post_many(
+            ledger.Journal(
+                legs=[
+                    ledger.system_leg(ledger.EXTERNAL, -amount, 'withdrawal', f'Withdrawal to {destination} failed'),
+                    ledger.user_leg(user_id, ledger.WALLET, amount, 'withdrawal',
+                                    f'Withdrawal to {destination} failed'),
+                ],
+                reference_type='withdrawal',
+                reference_id=pk,
+            )
+            for pk, user_id, destination, amount in failed
+        )
+        report = _report(run, operations)
+        if not any(status in ('pending', 'submitted') for _, status, *_ in operations):
+            PayoutRun.states.advance(run, 'complete', report=report)
+        else:
+            PayoutRun.objects.filter(pk=run.pk).update(report=report)
+            run.report = report
+    return report
+
+
+def reconcile_pending() -> List:
+    """Reconcile every run not yet completed, oldest first; returns the runs completed now."""
+    from .models import PayoutRun
+
+    completed = []
+    for run in PayoutRun.objects.filter(status='pending').order_by('created_at'):
+        reconcile(run)
+        if run.status == 'completed':
+            completed.append(run)
+    return completed
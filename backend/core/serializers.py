@@ -2,16 +2,19 @@
 Core serializers - Users and Wallets.
 """
 
+from decimal import Decimal
+from django.db import transaction
 from rest_framework import serializers
-from .models import User, Transaction
+from .models import User, Transaction, Withdrawal
+from . import ledger
+from .fieldsets import SparseFieldsMixin
 
 from django.contrib.auth import get_user_model
-from .models import User, Transaction
 
 User = get_user_model()
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for the User model.
     Includes wallet and farm details.
@@ -21,11 +24,11 @@ class UserSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'email', 'full_name', 'phone', 
             'is_farmer', 'is_buyer', 'is_admin',
-            'farm_name', 'farm_location', 'farm_size_acres', 'main_crops',
-            'wallet_address', 'wallet_balance', 'escrow_balance', 'available_balance',
+            'farm_name', 'farm_location', 'farm_size_acres', 'main_crops', 'latitude', 'longitude',
+            'wallet_address', 'deposit_memo', 'wallet_balance', 'escrow_balance', 'available_balance',
             'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at', 'wallet_address', 'wallet_balance', 'escrow_balance']
+        read_only_fields = ['id', 'created_at', 'updated_at', 'wallet_address', 'deposit_memo', 'wallet_balance', 'escrow_balance']
 
 
 class UserCreateSerializer(serializers.ModelSerializer):
@@ -39,16 +42,42 @@ class UserCreateSerializer(serializers.ModelSerializer):
         user = User(**validated_data)
         user.set_password(password)
         
-        # Initialize wallet with mock funds for demo
-        if user.is_buyer:
-            user.wallet_balance = 5000.00
+        with transaction.atomic():
+            user.save()
             
-        user.save()
+            # Initialize wallet with mock funds for demo (posted as a deposit so
+            # the transaction ledger matches the balance)
+            if user.is_buyer:
+                opening = Decimal('5000.00')
+                ledger.post([
+                    ledger.user_leg(user, ledger.WALLET, opening, 'deposit', 'Demo wallet funding'),
+                    ledger.system_leg(ledger.EXTERNAL, -opening, 'deposit', 'Demo wallet funding'),
+                ])
+                user.wallet_balance = opening
+        
         return user
 
 
-class TransactionSerializer(serializers.ModelSerializer):
+class TransactionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Transaction
         fields = '__all__'
         read_only_fields = ['stellar_tx_hash']
+
+
+class WithdrawalSerializer(serializers.ModelSerializer):
+    """Withdrawal requests; validates the body of POST /api/users/{id}/withdraw/."""
+    amount = serializers.DecimalField(max_digits=15, decimal_places=2, min_value=Decimal('0.01'))
+    destination = serializers.CharField(min_length=56, max_length=56)
+    idempotency_key = serializers.CharField(max_length=64, required=False, allow_blank=True, default='')
+    
+    class Meta:
+        model = Withdrawal
+        fields = ['id', 'user', 'amount', 'destination', 'idempotency_key', 'status', 'run', 'last_error',
+                  'created_at', 'paid_at']
+        read_only_fields = ['id', 'user', 'status', 'run', 'last_error', 'created_at', 'paid_at']
+    
+    def validate_destination(self, value):
+        if not value.startswith('G'):
+            raise serializers.ValidationError('Must be a Stellar account address')
+        return value
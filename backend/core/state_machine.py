@@ -0,0 +1,96 @@
+"""
+Declarative status state machines with compare-and-swap transitions.
+
+A model declares its transitions once:
+
+    class Order(models.Model):
+        states = StateMachine({
+            'dispatch': Transition(['escrow_held'], 'dispatched', timestamp='dispatched_at'),
+            ...
+        })
+
+and callers move an instance with
+
+    if not Order.states.advance(order, 'dispatch'):
+        ...  # someone else moved it first; order.status is the current one
+
+Every transition is a single `UPDATE ... WHERE id = ? AND status IN
+(sources)`. The row count says whether this caller won the race, so a
+read-check-save pair can no longer let two concurrent requests both
+apply the same transition. Run a transition's effects (ledger postings,
+notifications) only when advance() returns True, inside the same
+transaction, so a failed effect also rolls the status back. The UPDATE's
+row lock lasts only until that transaction commits.
+
+PRODUCTION NOTES:
+- Works the same on SQLite and PostgreSQL; no SELECT ... FOR UPDATE
+- Bulk jobs (sweepers, schedulers) use apply() on a queryset
+"""
+
+from typing import Dict, Iterable, NamedTuple, Optional
+
+from django.db.models import Q
+from django.db.models.expressions import Combinable
+from django.utils import timezone
+
+
+class Transition(NamedTuple):
+    """Move from any of `sources` to `target`, stamping `timestamp` with now."""
+    sources: Iterable[str]
+    target: str
+    timestamp: Optional[str] = None
+
+
+class StateMachine:
+    """The transitions of one model's status field."""
+
+    def __init__(self, transitions: Dict[str, Transition], field: str = 'status'):
+        self.field = field
+        self.transitions = {
+            name: transition._replace(sources=tuple(transition.sources))
+            for name, transition in transitions.items()
+        }
+
+    def can(self, instance, name: str) -> bool:
+        """Whether `name` is allowed from the instance's in-memory status."""
+        return getattr(instance, self.field) in self.transitions[name].sources
+
+    def _values(self, name: str, fields: dict) -> dict:
+        transition = self.transitions[name]
+        values = {self.field: transition.target, **fields}
+        if transition.timestamp:
+            values.setdefault(transition.timestamp, timezone.now())
+        return values
+
+    def _candidates(self, queryset, name: str, guard: Optional[Q]):
+        queryset = queryset.filter(**{f'{self.field}__in': self.transitions[name].sources})
+        return queryset.filter(guard) if guard is not None else queryset
+
+    def advance(self, instance, name: str, guard: Optional[Q] = None, **fields) -> bool:
+        """
+        Apply transition `name` to `instance` with one conditional UPDATE,
+        also writing `fields`. `guard` adds conditions to the WHERE clause
+        (e.g. an expected counter value).
+
+        Returns True if this call made the transition; the instance is then
+        updated in place. Returns False if the row was not in a source
+        status (or failed `guard`); the instance's status is refreshed so
+        the caller can report it.
+        """
+        values = self._values(name, fields)
+        queryset = self._candidates(type(instance)._default_manager.filter(pk=instance.pk), name, guard)
+        if queryset.update(**values) != 1:
+            instance.refresh_from_db(fields=[self.field])
+            return False
+
+        expressions = [field for field, value in values.items() if isinstance(value, Combinable)]
+        for field, value in values.items():
+            if field not in expressions:
+                setattr(instance, field, value)
+        if expressions:
+            instance.refresh_from_db(fields=expressions)
+        return True
+
+    def apply(self, queryset, name: str, guard: Optional[Q] = None, **fields) -> int:
+        """Apply transition `name` to every row of `queryset` still in a source status; returns the count."""
+        return self._candidates(queryset, name, guard).update(**self._values(name, fields))
@@ -0,0 +1,373 @@
+"""
+Stellar network access - transaction envelopes, a Horizon client and a
+local fake Horizon for tests and benchmarks.
+
+Envelopes are plain JSON mirroring a Stellar transaction (source account,
+sequence number, fee, time bounds, up to 100 operations). The hash is
+SHA-256 over the network passphrase and the canonical envelope, so it is
+known before submission, like a real transaction hash: a submitter that
+crashes mid-request can ask Horizon whether the transaction landed.
+
+Clients implement four calls:
+
+    load_account(account_id) -> {'id': ..., 'sequence': int}
+    submit(envelope) -> {'hash', 'ledger', 'fee_charged'}   (raises HorizonError)
+    find_transaction(tx_hash) -> result dict (with 'successful') or None
+    payments(account_id, cursor, limit) -> Horizon payment records, oldest first
+
+HorizonClient talks HTTP to STELLAR_HORIZON_URL. With no URL configured,
+get_client() returns a process-wide in-memory FakeHorizon; serve() puts
+a FakeHorizon behind a local HTTP server (`python manage.py fake_horizon`).
+
+PRODUCTION REPLACEMENT:
+- Build and sign XDR envelopes with stellar_sdk.TransactionBuilder
+- POST the base64 XDR to Horizon's /transactions as the `tx` form field
+"""
+
+import bisect
+import hashlib
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from django.conf import settings
+
+# Stellar protocol limit
+MAX_OPERATIONS = 100
+
+# 1 XLM = 10^7 stroops; amounts carry at most 7 decimal places
+AMOUNT_QUANTUM = Decimal('0.0000001')
+
+# Horizon's largest page
+MAX_PAGE_SIZE = 200
+
+
+class HorizonError(Exception):
+    """Horizon rejected a transaction; `result_codes` says why."""
+
+    def __init__(self, result_codes: Dict, status: int = 400):
+        self.result_codes = result_codes
+        self.status = status
+        super().__init__(f"Transaction rejected: {result_codes.get('transaction')}")
+
+    @property
+    def transaction_code(self) -> str:
+        return self.result_codes.get('transaction', '')
+
+    @property
+    def operation_codes(self) -> List[str]:
+        return self.result_codes.get('operations', [])
+
+
+class HorizonUnavailable(Exception):
+    """The submission's outcome is unknown (network error, timeout, 5xx)."""
+
+
+def format_amount(amount) -> str:
+    return str(Decimal(amount).quantize(AMOUNT_QUANTUM))
+
+
+def build_envelope(source_account: str, sequence: int, operations: List[Dict],
+                   base_fee: int = None, timeout: int = None, memo: str = '') -> Dict:
+    """A transaction envelope for `operations`, valid for `timeout` seconds."""
+    base_fee = settings.STELLAR_BASE_FEE if base_fee is None else base_fee
+    timeout = settings.STELLAR_TX_TIMEOUT_SECONDS if timeout is None else timeout
+    return {
+        'source_account': source_account,
+        'sequence': str(sequence),
+        'fee': base_fee * len(operations),
+        'time_bounds': {'min_time': 0, 'max_time': int(time.time()) + timeout},
+        'memo': memo,
+        'operations': operations,
+    }
+
+
+def transaction_hash(envelope: Dict) -> str:
+    payload = json.dumps(envelope, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(f'{settings.STELLAR_NETWORK_PASSPHRASE}:{payload}'.encode()).hexdigest()
+
+
+class FakeHorizon:
+    """
+    In-memory stand-in for a Horizon server and its ledger.
+
+    Checks what Stellar checks before applying a transaction - operation
+    count, fee bid, time bounds and sequence number - and charges
+    `base_fee` per operation, including for transactions that fail on an
+    operation (their sequence number is consumed, as on the network).
+    Account balances are not tracked. Unknown accounts are created on
+    first use.
+
+    `latency` (seconds) is slept per call to model the network round trip;
+    `fail_next` makes the next submissions fail with HorizonUnavailable.
+    With `ledger_close` (seconds), ledgers close on that interval, each
+    takes at most one transaction per source account, and submit() returns
+    once the transaction's ledger has closed - as synchronous submission
+    to Horizon does.
+
+    Payments in successful transactions are listed by payments(), like
+    Horizon's /accounts/{id}/payments; replay() loads recorded payment
+    records (e.g. deposits from outside) into the same history.
+    """
+
+    def __init__(self, latency: float = 0.0, base_fee: int = None, ledger_close: float = 0.0):
+        self.latency = latency
+        self.base_fee = settings.STELLAR_BASE_FEE if base_fee is None else base_fee
+        self.ledger_close = ledger_close
+        self.accounts: Dict[str, int] = {}
+        self.transactions: Dict[str, Dict] = {}
+        self.ledger = 1
+        self.fail_next = 0
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        # Ledger each source account last had a transaction in
+        self._included: Dict[str, int] = {}
+        # Payment records per account (sent or received), in paging order
+        self._payments: Dict[str, List[Dict]] = {}
+        self._paging_tokens: Dict[str, List[int]] = {}
+        self._next_token = 1
+
+    def _include(self, source: str) -> float:
+        """Pick the ledger for a transaction from `source`; returns when it closes."""
+        if not self.ledger_close:
+            self.ledger += 1
+            return 0.0
+        open_ledger = int((time.monotonic() - self._started) / self.ledger_close) + 1
+        self.ledger = max(open_ledger, self._included.get(source, 0) + 1)
+        self._included[source] = self.ledger
+        return self._started + self.ledger * self.ledger_close
+
+    def _account(self, account_id: str) -> int:
+        return self.accounts.setdefault(account_id, self.ledger << 32)
+
+    def load_account(self, account_id: str) -> Dict:
+        time.sleep(self.latency)
+        with self._lock:
+            return {'id': account_id, 'sequence': self._account(account_id)}
+
+    def find_transaction(self, tx_hash: str) -> Optional[Dict]:
+        time.sleep(self.latency)
+        with self._lock:
+            return self.transactions.get(tx_hash)
+
+    def submit(self, envelope: Dict) -> Dict:
+        time.sleep(self.latency)
+        result = self._queue(envelope)
+        time.sleep(max(result.pop('closes_at') - time.monotonic(), 0))
+        if not result['successful']:
+            raise HorizonError({**result['result_codes'], 'fee_charged': result['fee_charged']})
+        return result
+
+    def _queue(self, envelope: Dict) -> Dict:
+        with self._lock:
+            if self.fail_next:
+                self.fail_next -= 1
+                raise HorizonUnavailable('Simulated timeout')
+
+            operations = envelope.get('operations') or []
+            if not operations or len(operations) > MAX_OPERATIONS:
+                raise HorizonError({'transaction': 'tx_malformed'})
+            if envelope.get('fee', 0) < self.base_fee * len(operations):
+                raise HorizonError({'transaction': 'tx_insufficient_fee'})
+            if envelope['time_bounds']['max_time'] < time.time():
+                raise HorizonError({'transaction': 'tx_too_late'})
+            source = envelope['source_account']
+            if int(envelope['sequence']) != self._account(source) + 1:
+                raise HorizonError({'transaction': 'tx_bad_seq'})
+
+            # From here the transaction is in a ledger: sequence and fee are spent
+            self.accounts[source] += 1
+            closes_at = self._include(source)
+            fee_charged = self.base_fee * len(operations)
+            created = set()
+            codes = [self._check(operation, created) for operation in operations]
+            tx_hash = transaction_hash(envelope)
+            result = {'hash': tx_hash, 'ledger': self.ledger, 'fee_charged': fee_charged,
+                      'operation_count': len(operations), 'successful': True}
+            if any(code != 'op_success' for code in codes):
+                result.update(successful=False, result_codes={'transaction': 'tx_failed', 'operations': codes})
+            self.transactions[tx_hash] = result
+            if result['successful']:
+                for account_id in created:
+                    self._account(account_id)
+                self._record_payments(envelope, tx_hash)
+            return {**result, 'closes_at': closes_at}
+
+    def _record_payments(self, envelope: Dict, tx_hash: str) -> None:
+        for operation in envelope['operations']:
+            if operation['type'] != 'payment':
+                continue
+            self._add_record({
+                'type': 'payment',
+                'from': operation.get('source') or envelope['source_account'],
+                'to': operation['destination'],
+                'asset_type': 'credit_alphanum4',
+                'asset_code': operation['asset']['code'],
+                'asset_issuer': operation['asset']['issuer'],
+                'amount': operation['amount'],
+                'transaction_hash': tx_hash,
+                'transaction': {'memo_type': 'text', 'memo': envelope.get('memo', '')},
+            })
+
+    def _add_record(self, record: Dict) -> Dict:
+        token = self._next_token
+        self._next_token += 1
+        record = {**record, 'id': str(token), 'paging_token': str(token)}
+        for account_id in dict.fromkeys((record['from'], record['to'])):
+            self._payments.setdefault(account_id, []).append(record)
+            self._paging_tokens.setdefault(account_id, []).append(token)
+        return record
+
+    def replay(self, records: Iterable[Dict]) -> int:
+        """Append Horizon payment records (ids are reassigned in order); returns how many."""
+        count = 0
+        with self._lock:
+            for record in records:
+                self._add_record(record)
+                count += 1
+        return count
+
+    def add_payment(self, source: str, destination: str, amount, memo: str = '',
+                    asset_code: str = None) -> Dict:
+        """Record an incoming payment made outside the platform (a deposit)."""
+        with self._lock:
+            return self._add_record({
+                'type': 'payment', 'from': source, 'to': destination, 'asset_type': 'credit_alphanum4',
+                'asset_code': asset_code or settings.STELLAR_ASSET_CODE,
+                'asset_issuer': settings.STELLAR_ASSET_ISSUER, 'amount': format_amount(amount),
+                'transaction_hash': hashlib.sha256(f'deposit:{self._next_token}'.encode()).hexdigest(),
+                'transaction': {'memo_type': 'text' if memo else 'none', 'memo': memo},
+            })
+
+    def payments(self, account_id: str, cursor: str = '', limit: int = MAX_PAGE_SIZE) -> List[Dict]:
+        time.sleep(self.latency)
+        with self._lock:
+            tokens = self._paging_tokens.get(account_id, [])
+            start = bisect.bisect_right(tokens, int(cursor or 0))
+            return self._payments.get(account_id, [])[start:start + min(limit, MAX_PAGE_SIZE)]
+
+    def _check(self, operation: Dict, created: set) -> str:
+        """Result code of `operation`; accounts it would create are collected in `created`."""
+        if not operation.get('destination'):
+            return 'op_no_destination'
+        if Decimal(operation.get('amount') or operation.get('starting_balance') or '0') <= 0:
+            return 'op_malformed'
+        if operation['type'] == 'create_account':
+            if operation['destination'] in self.accounts or operation['destination'] in created:
+                return 'op_already_exists'
+            created.add(operation['destination'])
+        return 'op_success'
+
+    def fees_charged(self) -> int:
+        with self._lock:
+            return sum(result['fee_charged'] for result in self.transactions.values())
+
+
+class HorizonClient:
+    """Minimal JSON-over-HTTP Horizon client (see serve() for the fake server)."""
+
+    def __init__(self, url: str, timeout: float = 30.0):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def _request(self, method: str, path: str, body: Dict = None) -> Optional[Dict]:
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(f'{self.url}{path}', data=data, method=method,
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as exc:
+            if exc.code == 404:
+                return None
+            if exc.code >= 500:
+                raise HorizonUnavailable(f'Horizon returned {exc.code}') from exc
+            payload = json.loads(exc.read() or b'{}')
+            raise HorizonError(payload.get('extras', {}).get('result_codes', {}), exc.code) from exc
+        except (urllib.error.URLError, TimeoutError, ConnectionError) as exc:
+            raise HorizonUnavailable(str(exc)) from exc
+
+    def load_account(self, account_id: str) -> Dict:
+        account = self._request('GET', f'/accounts/{account_id}')
+        return {'id': account['id'], 'sequence': int(account['sequence'])}
+
+    def submit(self, envelope: Dict) -> Dict:
+        return self._request('POST', '/transactions', {'envelope': envelope})
+
+    def find_transaction(self, tx_hash: str) -> Optional[Dict]:
+        return self._request('GET', f'/transactions/{tx_hash}')
+
+    def payments(self, account_id: str, cursor: str = '', limit: int = MAX_PAGE_SIZE) -> List[Dict]:
+        query = urlencode({'cursor': cursor, 'limit': limit, 'order': 'asc', 'join': 'transactions'})
+        page = self._request('GET', f'/accounts/{account_id}/payments?{query}')
+        return page['_embedded']['records'] if page else []
+
+
+def serve(horizon: FakeHorizon = None, host: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+    """
+    An HTTP server exposing `horizon` with Horizon's URL layout. Call
+    serve_forever() on it (e.g. in a thread); server_address has the port.
+    """
+    horizon = horizon or FakeHorizon()
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            parts = url.path.strip('/').split('/')
+            if len(parts) == 3 and parts[0] == 'accounts' and parts[2] == 'payments':
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                records = horizon.payments(parts[1], query.get('cursor', ''),
+                                           int(query.get('limit', MAX_PAGE_SIZE)))
+                return self._reply(200, {'_embedded': {'records': records}})
+            if len(parts) == 2 and parts[0] == 'accounts':
+                account = horizon.load_account(parts[1])
+                return self._reply(200, {'id': account['id'], 'sequence': str(account['sequence'])})
+            if len(parts) == 2 and parts[0] == 'transactions':
+                result = horizon.find_transaction(parts[1])
+                return self._reply(200, result) if result else self._reply(404, {'status': 404})
+            self._reply(404, {'status': 404})
+
+        def do_POST(self):
+            if self.path.rstrip('/') != '/transactions':
+                return self._reply(404, {'status': 404})
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            try:
+                self._reply(200, horizon.submit(body['envelope']))
+            except HorizonError as exc:
+                self._reply(exc.status, {'status': exc.status, 'extras': {'result_codes': exc.result_codes}})
+            except HorizonUnavailable:
+                self._reply(504, {'status': 504})
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.horizon = horizon
+    return server
+
+
+_local_horizon: Optional[FakeHorizon] = None
+
+
+def get_client():
+    """The configured Horizon client; an in-process FakeHorizon when STELLAR_HORIZON_URL is empty."""
+    global _local_horizon
+    if settings.STELLAR_HORIZON_URL:
+        return HorizonClient(settings.STELLAR_HORIZON_URL)
+    if _local_horizon is None:
+        _local_horizon = FakeHorizon()
+    return _local_horizon
@@ -0,0 +1,69 @@
+"""
+Streaming NDJSON responses for large, unpaginated result sets.
+
+Actions that return every matching row (e.g. /users/farmers/) can opt in
+to `Accept: application/x-ndjson`. The queryset is then read in chunks
+with `iterator()` and each row is serialized and written as one JSON line,
+so peak memory stays flat no matter how many rows match.
+"""
+
+import json
+
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+# Rows fetched per database round trip while streaming
+CHUNK_SIZE = 500
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Renders newline-delimited JSON.
+
+    Mostly used for content negotiation: streamed actions bypass it with a
+    StreamingHttpResponse. Non-streamed payloads (errors) are written as a
+    single line, lists as one line per item.
+    """
+    media_type = NDJSON_MEDIA_TYPE
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        items = data if isinstance(data, list) else [data]
+        return ''.join(_dump(item) for item in items).encode(self.charset)
+
+
+# Renderer list for actions that support streaming
+NDJSON_RENDERER_CLASSES = [*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer]
+
+
+def _dump(item) -> str:
+    return json.dumps(item, cls=JSONEncoder, ensure_ascii=False) + '\n'
+
+
+def wants_ndjson(request) -> bool:
+    """True if content negotiation picked the NDJSON renderer."""
+    return isinstance(getattr(request, 'accepted_renderer', None), NDJSONRenderer)
+
+
+def stream_ndjson(queryset, serializer_class, context=None, chunk_size: int = CHUNK_SIZE):
+    """
+    Stream `queryset` as NDJSON, one serialized row per line.
+
+    A single serializer instance is reused for every row so field binding
+    happens once, and rows are pulled `chunk_size` at a time (prefetches
+    declared on the queryset are applied per chunk).
+    """
+    serializer = serializer_class(context=context or {})
+
+    def rows():
+        for instance in queryset.iterator(chunk_size=chunk_size):
+            yield _dump(serializer.to_representation(instance))
+
+    return StreamingHttpResponse(rows(), content_type=NDJSON_MEDIA_TYPE)
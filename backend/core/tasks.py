@@ -0,0 +1,25 @@
+"""
+Core background jobs (see core.jobs).
+"""
+
+from core.jobs import task
+
+
+@task(queue='stellar')
+def dispatch_outbox():
+    """Submit pending on-chain operations (core.outbox.dispatch)."""
+    from .outbox import dispatch
+
+    dispatch()
+
+
+@task(queue='stellar')
+def run_payouts(batch_size=None):
+    """Pay queued withdrawals out in netted runs, then reconcile open runs (core.payouts)."""
+    from .outbox import dispatch
+    from .payouts import reconcile_pending, run_payouts as start_run
+
+    while start_run(batch_size):
+        pass
+    dispatch()
+    reconcile_pending()
@@ -0,0 +1,41 @@
+"""
+Test helpers for query budgets.
+
+Use with QueryBudgetMiddleware (see core.middleware):
+
+    class ListingTests(QueryBudgetTestMixin, TestCase):
+        def test_list(self):
+            response = self.client.get('/api/marketplace/listings/')
+            self.assertWithinQueryBudget(response)
+"""
+
+from .middleware import QUERY_BUDGET_HEADER, QUERY_COUNT_HEADER
+
+
+class QueryBudgetTestMixin:
+    """TestCase mixin that fails when a response exceeds its query budget."""
+
+    def assertWithinQueryBudget(self, response, budget=None):
+        """
+        Fail if `response` ran more queries than `budget`, or than the
+        budget its view declares when `budget` is omitted.
+        """
+        self.assertTrue(
+            response.has_header(QUERY_COUNT_HEADER),
+            'QueryBudgetMiddleware is not installed'
+        )
+        count = int(response[QUERY_COUNT_HEADER])
+
+        if budget is None:
+            self.assertTrue(
+                response.has_header(QUERY_BUDGET_HEADER),
+                f'{response.wsgi_request.path} declares no query budget'
+            )
+            budget = int(response[QUERY_BUDGET_HEADER])
+
+        self.assertLessEqual(
+            count, budget,
+            f'{response.wsgi_request.method} {response.wsgi_request.path} ran '
+            f'{count} queries, over its budget of {budget}'
+        )
+        return count
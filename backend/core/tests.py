@@ -1,3 +1,723 @@
-from django.test import TestCase
+import importlib
+import json
+import threading
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+from django.apps import apps
+from django.core.management import call_command
+from django.test.utils import CaptureQueriesContext
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Sum
+
+from core import channels, deposits, geo, ledger, outbox, payouts, snapshots
+from core.jobs import Worker, claim, enqueue, run_job, task
+from core.middleware import QUERY_COUNT_HEADER, route_stats
+from core.stellar import FakeHorizon, HorizonClient, serve
+
+from core.models import (
+    BalanceSnapshot, ChannelAccount, Deposit, IngestCursor, Job, OutboxBatch, OutboxOperation, PayoutRun, Transaction, User, Withdrawal,
+)
+from core.testing import QueryBudgetTestMixin
+
+
+class QueryBudgetTests(QueryBudgetTestMixin, TestCase):
+    def setUp(self):
+        self.farmer = User.objects.create_user(
+            'farmer@test.com', 'pw', full_name='Test Farmer', is_farmer=True
+        )
+
+    def test_headers_report_query_count(self):
+        response = self.client.get('/api/users/')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(int(response['X-DB-Query-Count']), 0)
+        self.assertIn('X-DB-Query-Time-Ms', response)
+
+    def test_credit_score_within_budget(self):
+        response = self.client.get(f'/api/loans/credit-score/user/{self.farmer.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertWithinQueryBudget(response)
+
+    def test_route_summary(self):
+        self.client.get('/api/users/')
+        summary = self.client.get('/api/debug/queries/')
+        self.assertEqual(summary.status_code, 404)  # DEBUG is off under test
+
+        with self.settings(DEBUG=True):
+            summary = self.client.get('/api/debug/queries/').json()
+        self.assertIn('GET user-list', summary)
+        self.assertGreater(summary['GET user-list']['queries_max'], 0)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(f'user{i}@test.com', 'pw', full_name=f'User {i}') for i in range(7)]
+
+    def walk(self, url):
+        ids, pages = [], 0
+        while url:
+            payload = self.client.get(url).json()
+            ids += [row['id'] for row in payload['results']]
+            url = payload['next']
+            pages += 1
+        return ids, pages
+
+    def test_next_links_walk_every_row_once(self):
+        ids, pages = self.walk('/api/users/?page_size=3')
+        self.assertEqual(pages, 3)
+        expected = [str(user.pk) for user in sorted(self.users, key=lambda user: (user.created_at, user.pk),
+                                                   reverse=True)]
+        self.assertEqual(ids, expected)
+
+    def test_id_breaks_ties_on_created_at(self):
+        User.objects.update(created_at=timezone.now())
+        ids, _ = self.walk('/api/users/?page_size=2')
+        self.assertEqual(ids, sorted((str(user.pk) for user in self.users), reverse=True))
+
+        first = self.client.get('/api/users/?page_size=2').json()
+        second = self.client.get(first['next']).json()
+        self.assertEqual(self.client.get(second['previous']).json()['results'], first['results'])
+
+    def test_count_only_on_request(self):
+        self.assertNotIn('count', self.client.get('/api/users/?page_size=2').json())
+        payload = self.client.get('/api/users/?page_size=2&include_count=1').json()
+        self.assertEqual((payload['count'], len(payload['results'])), (7, 2))
+
+
+class NDJSONStreamingTests(TestCase):
+    def setUp(self):
+        for i in range(3):
+            User.objects.create_user(f'farmer{i}@test.com', 'pw', full_name=f'Farmer {i}', is_farmer=True)
+        User.objects.create_user('buyer@test.com', 'pw', full_name='Buyer', is_buyer=True)
+
+    def test_streams_one_object_per_line(self):
+        response = self.client.get('/api/users/farmers/', HTTP_ACCEPT='application/x-ndjson')
+        self.assertTrue(response.streaming)
+        self.assertTrue(response['Content-Type'].startswith('application/x-ndjson'))
+        body = b''.join(response.streaming_content).decode()
+        self.assertTrue(body.endswith('\n'))
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(rows, self.client.get('/api/users/farmers/').json())
+        self.assertEqual(len(rows), 3)
+
+
+    def test_queries_run_while_streaming_are_counted(self):
+        route_stats.reset()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/users/farmers/', HTTP_ACCEPT='application/x-ndjson')
+            before_body = len(queries)
+            b''.join(response.streaming_content)
+        self.assertNotIn(QUERY_COUNT_HEADER, response)
+        self.assertGreater(len(queries), before_body)
+        self.assertEqual(route_stats.summary()['GET user-farmers']['queries_max'], len(queries))
+
+class SparseFieldsTests(TestCase):
+    def setUp(self):
+        self.farmer = User.objects.create_user('farmer@test.com', 'pw', full_name='Farmer', is_farmer=True)
+
+    def test_fields_and_omit_on_reads(self):
+        url = f'/api/users/{self.farmer.pk}/'
+        self.assertEqual(set(self.client.get(url, {'fields': 'id,email,bogus'}).json()), {'id', 'email'})
+        row = self.client.get(url, {'omit': 'wallet_balance,escrow_balance'}).json()
+        self.assertNotIn('wallet_balance', row)
+        self.assertIn('full_name', row)
+
+    def test_fields_param_does_not_drop_write_input(self):
+        response = self.client.post('/api/users/?fields=email', {
+            'email': 'new@test.com', 'password': 'pw', 'full_name': 'New Farmer', 'is_farmer': True,
+            'farm_name': 'Green Acres',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        user = User.objects.get(email='new@test.com')
+        self.assertEqual((user.full_name, user.farm_name, user.is_farmer), ('New Farmer', 'Green Acres', True))
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice@test.com', 'pw', full_name='Alice')
+        self.bob = User.objects.create_user('bob@test.com', 'pw', full_name='Bob')
+        ledger.post([
+            ledger.user_leg(self.alice, ledger.WALLET, '100', 'deposit'),
+            ledger.system_leg(ledger.EXTERNAL, '-100', 'deposit'),
+        ])
+
+    def balances(self, user):
+        user = User.objects.get(pk=user.pk)
+        return user.wallet_balance, user.escrow_balance
+
+    def test_validate_accepts_only_balanced_journals(self):
+        ledger._validate(ledger.Journal([
+            ledger.user_leg(self.alice, ledger.WALLET, '-5', 'sale_payment'),
+            ledger.user_leg(self.bob, ledger.WALLET, '5', 'sale_payment'),
+        ]))
+        for legs in ([], [ledger.user_leg(self.alice, ledger.WALLET, '-5', 'sale_payment'),
+                          ledger.user_leg(self.bob, ledger.WALLET, '4.99', 'sale_payment')]):
+            with self.assertRaises(ledger.UnbalancedJournal):
+                ledger._validate(ledger.Journal(legs))
+        with self.assertRaises(ledger.UnbalancedJournal):
+            ledger.post([ledger.user_leg(self.alice, ledger.WALLET, '-5', 'sale_payment')])
+        self.assertEqual(self.balances(self.alice), (Decimal('100'), Decimal('0')))
+
+    def test_profile_save_keeps_concurrent_balance_changes(self):
+        stale = User.objects.get(pk=self.alice.pk)
+        ledger.post([
+            ledger.user_leg(self.alice, ledger.WALLET, '25', 'deposit'),
+            ledger.system_leg(ledger.EXTERNAL, '-25', 'deposit'),
+        ])
+        stale.full_name = 'Alice Renamed'
+        stale.save()
+        self.assertEqual(self.balances(self.alice), (Decimal('125'), Decimal('0')))
+        self.assertEqual(User.objects.get(pk=self.alice.pk).full_name, 'Alice Renamed')
+
+    def test_guarded_debit_writes_nothing_when_short(self):
+        legs_before = Transaction.objects.count()
+        with self.assertRaises(ledger.InsufficientFunds):
+            ledger.post_many([
+                ledger.Journal([
+                    ledger.user_leg(self.bob, ledger.WALLET, '50', 'deposit'),
+                    ledger.system_leg(ledger.EXTERNAL, '-50', 'deposit'),
+                ]),
+                ledger.Journal([
+                    ledger.user_leg(self.alice, ledger.WALLET, '-100.01', 'sale_payment', guard=True),
+                    ledger.user_leg(self.bob, ledger.WALLET, '100.01', 'sale_payment'),
+                ]),
+            ])
+        self.assertEqual(self.balances(self.alice), (Decimal('100'), Decimal('0')))
+        self.assertEqual(self.balances(self.bob), (Decimal('0'), Decimal('0')))
+        self.assertEqual(Transaction.objects.count(), legs_before)
+
+    def test_post_many_nets_each_user_into_one_update(self):
+        journals = [
+            ledger.Journal([
+                ledger.user_leg(self.alice, ledger.WALLET, f'-{amount}', 'sale_payment', guard=True),
+                ledger.user_leg(self.bob, ledger.WALLET, amount, 'sale_payment'),
+            ])
+            for amount in ('10', '20', '30')
+        ] + [ledger.Journal([
+            ledger.user_leg(self.bob, ledger.WALLET, '-5', 'sale_payment'),
+            ledger.user_leg(self.alice, ledger.WALLET, '5', 'sale_payment'),
+        ])]
+        with CaptureQueriesContext(connection) as queries:
+            hashes = ledger.post_many(journals)
+        statements = [query['sql'].split()[0] for query in queries.captured_queries]
+        self.assertEqual((statements.count('UPDATE'), statements.count('INSERT')), (1, 1))
+        self.assertEqual(len(set(hashes)), 4)
+        self.assertEqual(self.balances(self.alice), (Decimal('45'), Decimal('0')))
+        self.assertEqual(self.balances(self.bob), (Decimal('55'), Decimal('0')))
+
+    def test_legs_sum_to_the_stored_balances(self):
+        ledger.post_many([
+            ledger.Journal([
+                ledger.user_leg(self.alice, ledger.WALLET, '-40', 'escrow_lock', guard=True),
+                ledger.user_leg(self.alice, ledger.ESCROW, '40', 'escrow_lock'),
+            ]),
+            ledger.Journal([
+                ledger.user_leg(self.alice, ledger.ESCROW, '-15', 'escrow_release'),
+                ledger.user_leg(self.bob, ledger.WALLET, '15', 'sale_payment'),
+            ]),
+        ])
+        for user in (self.alice, self.bob):
+            legs = dict(Transaction.objects.filter(user=user).order_by().values_list('account')
+                        .annotate(Sum('amount')))
+            wallet, escrow = self.balances(user)
+            self.assertEqual((legs.get('wallet', 0), legs.get('escrow', 0)), (wallet, escrow))
+        self.assertEqual(Transaction.objects.aggregate(total=Sum('amount'))['total'], 0)
+
+
+class BalanceSnapshotTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice@test.com', 'pw', full_name='Alice')
+        self.bob = User.objects.create_user('bob@test.com', 'pw', full_name='Bob')
+        self.now = timezone.now()
+
+    def deposit(self, user, amount, ago=None):
+        ledger.post([
+            ledger.user_leg(user, ledger.WALLET, amount, 'deposit'),
+            ledger.system_leg(ledger.EXTERNAL, -Decimal(amount), 'deposit'),
+        ])
+        if ago is not None:
+            Transaction.objects.filter(user=user, created_at__gt=self.now - timedelta(minutes=1)).update(
+                created_at=self.now - ago)
+
+    def test_balance_without_snapshot_sums_all_legs(self):
+        self.deposit(self.alice, '100')
+        self.deposit(self.alice, '25.50')
+        balances = snapshots.balance_as_of(self.alice)
+        self.assertEqual((balances['wallet_balance'], balances['snapshot_as_of']), (Decimal('125.50'), None))
+
+    def test_balance_starts_from_latest_snapshot(self):
+        self.deposit(self.alice, '100', ago=timedelta(hours=3))
+        first = self.now - timedelta(hours=2)
+        self.assertEqual(snapshots.build_snapshots(first), 1)
+        self.deposit(self.alice, '50', ago=timedelta(hours=1))
+        second = self.now - timedelta(minutes=30)
+        self.assertEqual(snapshots.build_snapshots(second), 1)
+        self.deposit(self.alice, '25')
+
+        balances = snapshots.balance_as_of(self.alice)
+        self.assertEqual((balances['wallet_balance'], balances['snapshot_as_of']), (Decimal('175'), second))
+        # Before the latest snapshot: the earlier one plus the legs after it
+        balances = snapshots.balance_as_of(self.alice, self.now - timedelta(minutes=90))
+        self.assertEqual((balances['wallet_balance'], balances['snapshot_as_of']), (Decimal('100'), first))
+        response = self.client.get(f'/api/users/{self.alice.pk}/balance/')
+        self.assertEqual(response.json()['wallet_balance'], str(User.objects.get(pk=self.alice.pk).wallet_balance))
+
+    def test_build_is_incremental_and_rerunnable(self):
+        self.deposit(self.alice, '10', ago=timedelta(hours=2))
+        self.deposit(self.bob, '20', ago=timedelta(hours=2))
+        cutoff = self.now - timedelta(hours=1)
+        out = StringIO()
+        call_command('build_balance_snapshots', as_of=cutoff.isoformat(), stdout=out)
+        self.assertIn('Created 2 balance snapshots', out.getvalue())
+        self.assertEqual(snapshots.build_snapshots(cutoff), 0)
+
+        # Only users with new legs get a new checkpoint, rolled forward from the last
+        self.deposit(self.bob, '5')
+        self.assertEqual(snapshots.build_snapshots(self.now + timedelta(seconds=1)), 1)
+        latest = BalanceSnapshot.objects.filter(user=self.bob).first()
+        self.assertEqual((latest.wallet_balance, latest.transaction_count), (Decimal('25'), 1))
+
+    def test_opening_snapshot_covers_balances_from_before_the_ledger(self):
+        User.objects.filter(pk=self.alice.pk).update(wallet_balance=Decimal('500'), escrow_balance=Decimal('40'))
+        migration = importlib.import_module('core.migrations.0010_opening_balance_snapshots')
+        migration.write_opening_snapshots(apps, None)
+        self.deposit(self.alice, '10')
+
+        balances = snapshots.balance_as_of(self.alice)
+        self.assertEqual((balances['wallet_balance'], balances['escrow_balance']), (Decimal('510'), Decimal('40')))
+        self.assertEqual(BalanceSnapshot.objects.filter(user=self.bob).count(), 1)
+
+
+class GeoTests(SimpleTestCase):
+    def test_geocode_prefers_most_specific_place(self):
+        self.assertEqual(geo.geocode('Nakuru County, Kenya'), geo.geocode('nakuru'))
+        self.assertEqual(geo.geocode('Molo, Nakuru County'), geo.geocode('Molo'))
+        self.assertEqual(geo.geocode("Murang'a"), geo.geocode('muranga'))
+        self.assertIsNone(geo.geocode('Kampala'))
+
+    def test_cover_contains_every_point_in_radius(self):
+        lat, lon = geo.geocode('Nairobi')
+        cells = geo.cover(lat, lon, 30)
+        self.assertLessEqual(len(cells), geo.MAX_COVER_CELLS)
+        for dlat in (-0.25, 0, 0.25):
+            for dlon in (-0.25, 0, 0.25):
+                point = (lat + dlat, lon + dlon)
+                if geo.haversine_km(lat, lon, *point) <= 30:
+                    geohash = geo.encode_geohash(*point)
+                    self.assertTrue(any(geohash.startswith(cell) for cell in cells))
+
+
+CALLS = []
+
+
+@task(name='tests.record')
+def record(value):
+    CALLS.append(value)
+
+
+@task(name='tests.explode', max_attempts=2)
+def explode():
+    raise RuntimeError('boom')
+
+
+@task(name='tests.limited', queue='limited')
+def limited():
+    pass
+
+
+@override_settings(JOB_QUEUE_CONCURRENCY={'limited': 1}, JOB_RETRY_BACKOFF_SECONDS=10,
+                   JOB_RETRY_BACKOFF_MAX_SECONDS=60)
+class JobQueueTests(TestCase):
+    def setUp(self):
+        CALLS.clear()
+
+    def test_runs_by_priority(self):
+        enqueue(record, {'value': 'low'})
+        enqueue(record, {'value': 'high'}, priority=10)
+        enqueue(record, {'value': 'later'}, delay=timedelta(hours=1))
+        worker = Worker(['default'])
+        while worker.run_once():
+            pass
+        self.assertEqual(CALLS, ['high', 'low'])
+        self.assertEqual(Job.objects.filter(status='succeeded').count(), 2)
+        self.assertEqual(Job.objects.get(kwargs={'value': 'later'}).status, 'queued')
+
+    def test_retries_with_backoff_then_fails(self):
+        job = enqueue(explode)
+        worker = Worker(['default'])
+        with self.assertLogs('core.jobs', 'WARNING'):
+            self.assertTrue(worker.run_once())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertIn('boom', job.last_error)
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=5))
+        self.assertFalse(worker.run_once())  # backing off
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with self.assertLogs('core.jobs', 'WARNING'):
+            self.assertTrue(worker.run_once())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_expired_lease_is_reclaimed(self):
+        job = enqueue(record, {'value': 'once'})
+        first = claim(['default'], 'worker-a')
+        self.assertEqual(first.pk, job.pk)
+        self.assertIsNone(claim(['default'], 'worker-b'))
+
+        Job.objects.filter(pk=job.pk).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        second = claim(['default'], 'worker-b')
+        self.assertEqual((second.pk, second.attempts, second.locked_by), (job.pk, 2, 'worker-b'))
+
+        # The first worker lost its lease, so only the second records completion
+        run_job(first, 'worker-a')
+        self.assertEqual(Job.objects.get(pk=job.pk).status, 'running')
+        run_job(second, 'worker-b')
+        self.assertEqual(Job.objects.get(pk=job.pk).status, 'succeeded')
+
+    def test_queue_concurrency_limit(self):
+        enqueue(limited)
+        enqueue(limited)
+        running = claim(['limited'], 'worker-a')
+        self.assertIsNotNone(running)
+        self.assertIsNone(claim(['limited'], 'worker-b'))
+        run_job(running, 'worker-a')
+        self.assertIsNotNone(claim(['limited'], 'worker-b'))
+
+    def test_assess_endpoint_queues_job(self):
+        farmer = User.objects.create_user('grower@test.com', 'pw', full_name='Grower', is_farmer=True)
+        self.client.force_login(farmer)
+        response = self.client.post('/api/crops/assessments/assess/', {'farm_size': 2}, content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        job = Job.objects.get(pk=response.json()['job_id'])
+        self.assertEqual((job.task, job.queue), ('crops.tasks.assess_images', 'assessment'))
+
+        self.assertTrue(Worker(['assessment']).run_once())
+        self.assertEqual(farmer.assessments.count(), 1)
+
+
+    def test_assess_endpoint_refuses_anonymous_callers(self):
+        response = self.client.post('/api/crops/assessments/assess/', {'farm_size': 2}, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Job.objects.exists())
+
+class RunWorkersCommandTests(TransactionTestCase):
+    def setUp(self):
+        CALLS.clear()
+
+    def test_thread_pool_drains_queue(self):
+        for value in range(5):
+            enqueue(record, {'value': value})
+        call_command('run_workers', concurrency=1, once=True, queues='default', stdout=StringIO())
+        self.assertEqual(sorted(CALLS), list(range(5)))
+        self.assertFalse(Job.objects.exclude(status='succeeded').exists())
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.horizon = FakeHorizon()
+
+    def pay(self, source, destination, amount='1'):
+        return outbox.payment(source, destination, amount)
+
+    def test_recorded_only_with_the_transaction(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                outbox.record([self.pay('GA', 'GB')])
+                raise RuntimeError
+        self.assertFalse(OutboxOperation.objects.exists())
+
+    def test_packs_up_to_100_operations_per_transaction(self):
+        outbox.record([self.pay(f'GSRC{i}', 'GDEST') for i in range(250)])
+        result = outbox.dispatch(self.horizon)
+        self.assertEqual((result.batches, result.operations), (3, 250))
+        self.assertEqual(result.fee_charged, 250 * settings.STELLAR_BASE_FEE)
+        self.assertEqual(sorted(OutboxBatch.objects.values_list('operation_count', flat=True)), [50, 100, 100])
+        self.assertFalse(OutboxOperation.objects.exclude(status='confirmed').exists())
+
+    def test_merges_payments_unless_payer_was_funded_in_between(self):
+        outbox.record([
+            self.pay('GA', 'GB', '1'), self.pay('GA', 'GB', '2'),
+            self.pay('GC', 'GA', '5'), self.pay('GA', 'GB', '4'),
+        ])
+        outbox.dispatch(self.horizon)
+        operations = OutboxBatch.objects.get().envelope['operations']
+        self.assertEqual([(op['source'], op['amount']) for op in operations],
+                         [('GA', '3.0000000'), ('GC', '5.0000000'), ('GA', '4.0000000')])
+
+    def test_failed_operation_does_not_block_the_rest(self):
+        outbox.record([self.pay('GA', 'GB'), self.pay('GA', ''), self.pay('GC', 'GD')])
+        with self.assertLogs('core.outbox', 'ERROR'):
+            result = outbox.dispatch(self.horizon)
+        self.assertEqual((result.batches, result.operations), (2, 2))
+        failed = OutboxOperation.objects.get(status='failed')
+        self.assertEqual((failed.destination, failed.last_error), ('', 'op_no_destination'))
+
+    def test_unknown_outcome_is_resolved_on_next_run(self):
+        outbox.record([self.pay('GA', 'GB')])
+        self.horizon.fail_next = 1
+        with self.assertLogs('core.outbox', 'WARNING'):
+            self.assertEqual(outbox.dispatch(self.horizon).operations, 0)
+        batch = OutboxBatch.objects.get()
+        self.assertEqual(batch.status, 'submitted')
+
+        # Still within its time bounds: it might land, so nothing else is sent
+        self.assertEqual(outbox.dispatch(self.horizon).batches, 0)
+
+        batch.envelope['time_bounds']['max_time'] = 0
+        batch.save(update_fields=['envelope'])
+        self.assertEqual(outbox.dispatch(self.horizon).operations, 1)
+        batch.refresh_from_db()
+        self.assertEqual((batch.status, batch.result_codes['transaction']), ('failed', 'tx_too_late'))
+
+    def test_http_client_against_fake_server(self):
+        server = serve(self.horizon)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        client = HorizonClient(f'http://{server.server_address[0]}:{server.server_address[1]}')
+
+        outbox.record([outbox.create_account('GNEW'), self.pay('GA', 'GNEW')])
+        result = outbox.dispatch(client)
+        self.assertEqual((result.batches, result.operations), (1, 2))
+        self.assertTrue(client.find_transaction(OutboxBatch.objects.get().tx_hash)['successful'])
+
+
+class ChannelTests(TestCase):
+    def setUp(self):
+        self.horizon = FakeHorizon()
+        channels.add_channels(['GCHAN1', 'GCHAN2'])
+
+    def test_each_lease_gets_its_own_channel(self):
+        first = channels.lease(self.horizon, 'w1')
+        second = channels.lease(self.horizon, 'w2')
+        self.assertNotEqual(first.address, second.address)
+        self.assertIsNone(channels.lease(self.horizon, 'w3'))
+        self.assertEqual(channels.pool_stats()['utilization'], 1.0)
+
+        channels.release(first)
+        self.assertEqual(channels.lease(self.horizon, 'w3').address, first.address)
+
+    def test_expired_lease_is_taken_over_and_resynced(self):
+        stale = channels.lease(self.horizon, 'w1')
+        stale.consumed()
+        ChannelAccount.objects.filter(address=stale.address).update(
+            sequence=1, lease_expires_at=timezone.now() - timedelta(seconds=1))
+        channels.lease(self.horizon, 'w2')
+
+        taken = channels.lease(self.horizon, 'w3')
+        self.assertEqual(taken.address, stale.address)
+        self.assertEqual(taken.next_sequence(), self.horizon.accounts[stale.address] + 1)
+        # The old holder no longer owns the channel
+        self.assertFalse(channels.release(stale))
+
+    def test_bad_sequence_is_resynced(self):
+        ChannelAccount.objects.filter(address='GCHAN2').delete()
+        self.horizon.load_account('GCHAN1')
+        ChannelAccount.objects.update(sequence=42)
+        outbox.record([outbox.payment('GA', 'GB', '1')])
+
+        result = outbox.dispatch(self.horizon)
+        self.assertEqual((result.batches, result.operations), (2, 1))
+        channel = ChannelAccount.objects.get()
+        self.assertEqual((channel.status, channel.resyncs, channel.transactions), ('idle', 1, 1))
+        self.assertEqual(channel.sequence, self.horizon.accounts['GCHAN1'])
+
+    def test_channel_is_the_transaction_source(self):
+        outbox.record([outbox.create_account('GNEW'), outbox.payment('GA', 'GNEW', '1')])
+        outbox.dispatch(self.horizon)
+        envelope = OutboxBatch.objects.get().envelope
+        self.assertIn(envelope['source_account'], ('GCHAN1', 'GCHAN2'))
+        self.assertEqual([op['source'] for op in envelope['operations']],
+                         [settings.STELLAR_PLATFORM_ACCOUNT, 'GA'])
+
+    def test_accounts_in_flight_elsewhere_are_held_back(self):
+        rows = [(1, 'payment', 'GA', 'GB', 1), (2, 'payment', 'GB', 'GC', 1),
+                (3, 'payment', 'GC', 'GD', 1), (4, 'payment', 'GE', 'GF', 1)]
+        groups = outbox._merge(rows, 100, True, busy={'GB'})
+        self.assertEqual([group[4] for group in groups], [[4]])
+
+    def test_dispatchers_spread_over_the_pool(self):
+        outbox.record([outbox.payment(f'GSRC{i}', 'GDEST', '1') for i in range(300)])
+        results = [outbox.dispatch(self.horizon, max_batches=1, batch_size=50, worker_id=f'w{i}')
+                   for i in range(2)]
+        self.assertEqual(sum(result.operations for result in results), 100)
+        self.assertEqual(set(OutboxBatch.objects.values_list('source_account', flat=True)), {'GCHAN1', 'GCHAN2'})
+        self.assertEqual(channels.pool_stats()['transactions'], 2)
+
+    def test_debug_endpoint_reports_pool(self):
+        staff = User.objects.create_user('ops@test.com', 'pw', full_name='Ops', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get('/api/debug/channels/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['channels'], 2)
+
+
+class DepositTests(TestCase):
+    def setUp(self):
+        self.horizon = FakeHorizon()
+        self.platform = settings.STELLAR_PLATFORM_ACCOUNT
+        self.alice = User.objects.create_user('alice@test.com', 'pw', full_name='Alice')
+        self.bob = User.objects.create_user('bob@test.com', 'pw', full_name='Bob')
+
+    def page(self, cursor=''):
+        return deposits.Page(self.platform, cursor, self.horizon.payments(self.platform, cursor))
+
+    def test_matches_by_memo_then_wallet(self):
+        self.horizon.add_payment('GEXCHANGE', self.platform, '25', memo=self.alice.deposit_memo)
+        self.horizon.add_payment(self.bob.wallet_address, self.platform, '10.129')
+        self.horizon.add_payment('GSTRANGER', self.platform, '5')
+        self.horizon.add_payment('GEXCHANGE', self.platform, '5', asset_code='USDC')
+        # Outbox traffic between platform accounts is not a deposit
+        outbox.record([outbox.payment(settings.STELLAR_LOAN_POOL_ACCOUNT, self.platform, '100')])
+        outbox.dispatch(self.horizon)
+
+        deposits.load_cursor(self.platform)
+        with self.assertLogs('core.deposits', 'WARNING'):
+            result = deposits.ingest([self.page()])
+        self.assertEqual(result, deposits.IngestResult(credited=2, unmatched=1, ignored=1))
+        balances = dict(User.objects.values_list('email', 'wallet_balance'))
+        self.assertEqual((balances['alice@test.com'], balances['bob@test.com']), (Decimal('25'), Decimal('10.12')))
+        self.assertEqual(Deposit.objects.get(status='unmatched').source, 'GSTRANGER')
+        self.assertEqual(Transaction.objects.aggregate(total=Sum('amount'))['total'], 0)
+
+    def test_cursor_is_checkpointed_with_the_credits(self):
+        for _ in range(3):
+            self.horizon.add_payment('GEXCHANGE', self.platform, '1', memo=self.alice.deposit_memo)
+        page = self.page(deposits.load_cursor(self.platform))
+        deposits.ingest([page])
+        self.assertEqual(deposits.load_cursor(self.platform), page.cursor)
+
+        # A watcher still at the old cursor cannot credit the same payments again
+        with self.assertRaises(deposits.CursorConflict):
+            deposits.ingest([page])
+        self.alice.refresh_from_db()
+        self.assertEqual(self.alice.wallet_balance, Decimal('3'))
+        self.assertEqual(self.page(page.cursor).records, [])
+
+
+class DepositWatcherTests(TransactionTestCase):
+    def test_watcher_resumes_from_checkpoint_against_replay_server(self):
+        platform = settings.STELLAR_PLATFORM_ACCOUNT
+        users = [User.objects.create_user(f'dep{i}@test.com', 'pw', full_name=f'Depositor {i}') for i in range(5)]
+        horizon = FakeHorizon()
+        horizon.replay(
+            {'type': 'payment', 'from': f'GEXT{i}', 'to': platform, 'asset_type': 'credit_alphanum4',
+             'asset_code': settings.STELLAR_ASSET_CODE, 'asset_issuer': settings.STELLAR_ASSET_ISSUER,
+             'amount': '2.0000000', 'transaction_hash': f'{i:064x}',
+             'transaction': {'memo_type': 'text', 'memo': users[i % 5].deposit_memo}}
+            for i in range(450)
+        )
+        server = serve(horizon)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        with override_settings(STELLAR_HORIZON_URL=f'http://{server.server_address[0]}:{server.server_address[1]}'):
+            call_command('watch_deposits', once=True, batch_size=300, stdout=StringIO())
+            self.assertEqual(IngestCursor.objects.get().cursor, '450')
+            horizon.add_payment('GEXT', platform, '7', memo=users[0].deposit_memo)
+            out = StringIO()
+            call_command('watch_deposits', once=True, stdout=out)
+
+        self.assertIn('Credited 1 deposits', out.getvalue())
+        self.assertEqual(Deposit.objects.filter(status='credited').count(), 451)
+        self.assertEqual(User.objects.get(pk=users[0].pk).wallet_balance, Decimal('187'))
+
+
+class PayoutTests(TestCase):
+    def setUp(self):
+        self.horizon = FakeHorizon()
+        self.alice = User.objects.create_user('alice@test.com', 'pw', full_name='Alice')
+        self.bob = User.objects.create_user('bob@test.com', 'pw', full_name='Bob')
+        User.objects.filter(pk__in=[self.alice.pk, self.bob.pk]).update(wallet_balance=Decimal('100'))
+        self.exchange = 'GEXCHANGE' + 'A' * 47
+        self.other = 'GOTHER' + 'B' * 50
+
+    def balance(self, user):
+        return User.objects.get(pk=user.pk).wallet_balance
+
+    def test_withdrawals_are_netted_per_destination(self):
+        for user, amount in ((self.alice, '10'), (self.bob, '15'), (self.alice, '5')):
+            payouts.request_withdrawal(user, amount, self.exchange)
+        payouts.request_withdrawal(self.bob, '7', self.other)
+        self.assertEqual((self.balance(self.alice), self.balance(self.bob)), (Decimal('85'), Decimal('78')))
+
+        run = payouts.run_payouts()
+        self.assertEqual((run.withdrawal_count, run.destination_count, run.total_amount), (4, 2, Decimal('37')))
+        self.assertEqual(dict(OutboxOperation.objects.values_list('destination', 'amount')),
+                         {self.exchange: Decimal('30'), self.other: Decimal('7')})
+        self.assertFalse(Withdrawal.objects.exclude(status='batched').exists())
+        self.assertIsNone(payouts.run_payouts())
+
+    def test_idempotency_key_returns_the_first_request(self):
+        first, created = payouts.request_withdrawal(self.alice, '20', self.exchange, idempotency_key='k1')
+        again, created_again = payouts.request_withdrawal(self.alice, '20', self.exchange, idempotency_key='k1')
+        self.assertEqual((first.pk, created, created_again), (again.pk, True, False))
+        self.assertEqual(self.balance(self.alice), Decimal('80'))
+
+    def test_rejects_invalid_and_uncovered_requests(self):
+        with self.assertRaises(payouts.PayoutError):
+            payouts.request_withdrawal(self.alice, '10', 'GSHORT')
+        with self.assertRaises(ledger.InsufficientFunds):
+            payouts.request_withdrawal(self.alice, '100.01', self.exchange)
+        self.assertFalse(Withdrawal.objects.exists())
+        self.assertEqual(self.balance(self.alice), Decimal('100'))
+
+    def test_reconcile_marks_paid_and_completes_the_run(self):
+        payouts.request_withdrawal(self.alice, '10', self.exchange)
+        payouts.request_withdrawal(self.bob, '20', self.exchange)
+        run = payouts.run_payouts()
+        report = payouts.reconcile(run)
+        self.assertEqual((run.status, report['in_flight']), ('pending', '30.00'))
+
+        outbox.dispatch(self.horizon)
+        report = payouts.reconcile(run)
+        run.refresh_from_db()
+        self.assertEqual(run.status, 'completed')
+        self.assertEqual((report['paid'], report['failed'], report['mismatches']), ('30.00', '0.00', []))
+        self.assertEqual(report['fee_charged'], settings.STELLAR_BASE_FEE)
+        self.assertEqual(report['transactions'], [OutboxBatch.objects.get().tx_hash])
+        self.assertFalse(Withdrawal.objects.exclude(status='paid').exists())
+
+    def test_failed_payment_is_credited_back_once(self):
+        payouts.request_withdrawal(self.alice, '10', self.exchange)
+        payouts.request_withdrawal(self.bob, '5', self.other)
+        run = payouts.run_payouts()
+        OutboxOperation.objects.filter(destination=self.other).update(status='failed', last_error='op_no_trust')
+        outbox.dispatch(self.horizon)
+
+        report = payouts.reconcile(run)
+        payouts.reconcile(run)
+        self.assertEqual((report['paid'], report['failed']), ('10.00', '5.00'))
+        self.assertEqual(Withdrawal.objects.get(user=self.bob).last_error, 'op_no_trust')
+        self.assertEqual((self.balance(self.alice), self.balance(self.bob)), (Decimal('90'), Decimal('100')))
+        self.assertEqual(Transaction.objects.aggregate(total=Sum('amount'))['total'], 0)
+
+    def test_withdraw_endpoint_and_command(self):
+        url = f'/api/users/{self.alice.pk}/withdraw/'
+        body = {'amount': '25', 'destination': self.exchange, 'idempotency_key': 'k'}
+        self.assertEqual(self.client.post(url, body, content_type='application/json').status_code, 202)
+        self.assertEqual(self.client.post(url, body, content_type='application/json').status_code, 200)
+        response = self.client.post(url, {**body, 'amount': '500', 'idempotency_key': 'k2'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        for invalid in ({'amount': 5, 'destination': 12345}, {**body, 'amount': 'Infinity'},
+                        {**body, 'amount': '1.005'}, {**body, 'amount': '0'}, {'destination': self.exchange}):
+            response = self.client.post(url, invalid, content_type='application/json')
+            self.assertEqual(response.status_code, 400, invalid)
+        self.assertEqual(Withdrawal.objects.count(), 1)
+        with self.assertRaises(payouts.PayoutError):
+            payouts.request_withdrawal(self.alice, '1.005', self.exchange)
+
+        out = StringIO()
+        call_command('run_payouts', no_dispatch=True, stdout=out)
+        self.assertEqual(PayoutRun.objects.get().status, 'pending')
+        self.assertIn('1 withdrawals', out.getvalue())
@@ -4,11 +4,13 @@ Core URL configuration.
 
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import UserViewSet
+from .views import UserViewSet, channel_stats, query_stats
 
 router = DefaultRouter()
 router.register(r'users', UserViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('debug/queries/', query_stats, name='query-stats'),
+    path('debug/channels/', channel_stats, name='channel-stats'),
 ]
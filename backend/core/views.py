@@ -3,10 +3,19 @@ Core views - Users and Wallets API.
 """
 
 from rest_framework import viewsets, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view
 from rest_framework.response import Response
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from . import ledger
+from .channels import pool_stats
+from .middleware import route_stats
 from .models import User, Transaction
-from .serializers import UserSerializer, UserCreateSerializer, TransactionSerializer
+from .payouts import PayoutError, request_withdrawal
+from .snapshots import balance_as_of
+from .streaming import NDJSON_RENDERER_CLASSES, stream_ndjson, wants_ndjson
+from .serializers import UserSerializer, UserCreateSerializer, TransactionSerializer, WithdrawalSerializer
 
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -15,29 +24,105 @@ class UserViewSet(viewsets.ModelViewSet):
     No authentication required for demo.
     """
     queryset = User.objects.all()
+    cursor_ordering = ('-created_at', '-id')
     
     def get_serializer_class(self):
         if self.action == 'create':
             return UserCreateSerializer
         return UserSerializer
     
-    @action(detail=False, methods=['get'])
+    @action(detail=False, methods=['get'], renderer_classes=NDJSON_RENDERER_CLASSES)
     def farmers(self, request):
-        """List all farmers."""
+        """List all farmers. Send Accept: application/x-ndjson to stream."""
         farmers = User.objects.filter(is_farmer=True)
+        if wants_ndjson(request):
+            return stream_ndjson(farmers, UserSerializer)
         serializer = UserSerializer(farmers, many=True)
         return Response(serializer.data)
     
-    @action(detail=False, methods=['get'])
+    @action(detail=False, methods=['get'], renderer_classes=NDJSON_RENDERER_CLASSES)
     def buyers(self, request):
-        """List all buyers."""
+        """List all buyers. Send Accept: application/x-ndjson to stream."""
         buyers = User.objects.filter(is_buyer=True)
+        if wants_ndjson(request):
+            return stream_ndjson(buyers, UserSerializer)
         serializer = UserSerializer(buyers, many=True)
         return Response(serializer.data)
     
-    @action(detail=False, methods=['get'])
+    @action(detail=False, methods=['get'], renderer_classes=NDJSON_RENDERER_CLASSES)
     def admins(self, request):
-        """List all admins."""
+        """List all admins. Send Accept: application/x-ndjson to stream."""
         admins = User.objects.filter(is_admin=True)
+        if wants_ndjson(request):
+            return stream_ndjson(admins, UserSerializer)
         serializer = UserSerializer(admins, many=True)
         return Response(serializer.data)
+    
+    @action(detail=True, methods=['post'])
+    def withdraw(self, request, pk=None):
+        """
+        Queue a payout of wallet funds to a Stellar address (paid by the next payout run).
+        Body: {"amount": "100.00", "destination": "G...", "idempotency_key": "..."}
+        """
+        user = self.get_object()
+        serializer = WithdrawalSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            withdrawal, created = request_withdrawal(user, **serializer.validated_data)
+        except (PayoutError, ledger.InsufficientFunds) as exc:
+            return Response({'error': str(exc)}, status=400)
+        return Response(WithdrawalSerializer(withdrawal).data,
+                        status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK)
+    
+    @action(detail=True, methods=['get'])
+    def balance(self, request, pk=None):
+        """
+        Get wallet/escrow balances as of a point in time.
+        Usage: /api/users/{id}/balance/?as_of=2026-01-31T23:59:59Z
+        """
+        user = self.get_object()
+        as_of = None
+        
+        if request.query_params.get('as_of'):
+            as_of = parse_datetime(request.query_params['as_of'])
+            if as_of is None:
+                return Response({'error': 'as_of must be an ISO 8601 datetime'}, status=400)
+            if timezone.is_naive(as_of):
+                as_of = timezone.make_aware(as_of)
+        
+        balances = balance_as_of(user, as_of)
+        return Response({
+            'user': user.id,
+            'wallet_balance': str(balances['wallet_balance']),
+            'escrow_balance': str(balances['escrow_balance']),
+            'as_of': balances['as_of'],
+            'snapshot_as_of': balances['snapshot_as_of'],
+        })
+
+
+@api_view(['GET', 'DELETE'])
+def query_stats(request):
+    """
+    Rolling per-route SQL query summary (count, time, slowest statement).
+    DELETE resets the window. Only available in DEBUG or to staff.
+    """
+    if not (settings.DEBUG or request.user.is_staff):
+        return Response({'error': 'Not found'}, status=404)
+    
+    if request.method == 'DELETE':
+        route_stats.reset()
+        return Response(status=204)
+    
+    return Response(route_stats.summary())
+
+
+@api_view(['GET'])
+def channel_stats(request):
+    """
+    Stellar channel-account pool utilization (see core.channels).
+    Only available in DEBUG or to staff.
+    """
+    if not (settings.DEBUG or request.user.is_staff):
+        return Response({'error': 'Not found'}, status=404)
+    
+    return Response(pool_stats())
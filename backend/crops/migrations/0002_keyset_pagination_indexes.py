@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crops', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cropassessment',
+            index=models.Index(fields=['-assessed_at', '-id'], name='crops_assess_assessed_idx'),
+        ),
+    ]
@@ -92,3 +92,7 @@ class CropAssessment(models.Model):
     
     class Meta:
         ordering = ['-assessed_at']
+        indexes = [
+            # Keyset pagination key (see core.pagination)
+            models.Index(fields=['-assessed_at', '-id'], name='crops_assess_assessed_idx'),
+        ]
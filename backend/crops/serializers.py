@@ -3,20 +3,30 @@ Crops serializers - Farms, Images, and Assessments.
 """
 
 from rest_framework import serializers
+from core.fieldsets import SparseFieldsMixin
 from .models import CropImage, CropAssessment
 
 
-class CropImageSerializer(serializers.ModelSerializer):
+class CropImageSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     image_url = serializers.SerializerMethodField()
     farmer_name = serializers.CharField(source='farmer.full_name', read_only=True)
     
     class Meta:
         model = CropImage
-        fields = ['id', 'farmer', 'farmer_name', 'image', 'description', 'image_type', 'uploaded_at']
+        fields = ['id', 'farmer', 'farmer_name', 'image', 'image_url', 'description', 'image_type', 'uploaded_at']
         read_only_fields = ['id', 'uploaded_at', 'farmer']
+        select_related_fields = {'farmer_name': ['farmer']}
+    
+    def get_image_url(self, obj):
+        if not obj.image:
+            return None
+        request = self.context.get('request')
+        if request:
+            return request.build_absolute_uri(obj.image.url)
+        return obj.image.url
 
 
-class CropAssessmentSerializer(serializers.ModelSerializer):
+class CropAssessmentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     farmer_name = serializers.CharField(source='farmer.full_name', read_only=True)
     health_percentage = serializers.IntegerField(read_only=True)
     
@@ -28,6 +38,7 @@ class CropAssessmentSerializer(serializers.ModelSerializer):
             'recommendations', 'confidence_score', 'assessed_at'
         ]
         read_only_fields = ['id', 'assessed_at', 'farmer']
+        select_related_fields = {'farmer_name': ['farmer']}
 
 
 class ImageUploadSerializer(serializers.Serializer):
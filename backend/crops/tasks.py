@@ -0,0 +1,27 @@
+"""
+Crops background jobs (see core.jobs).
+"""
+
+from core.jobs import task
+
+
+@task(queue='assessment', max_attempts=3)
+def assess_images(farmer_id, image_ids=None, farm_size=1.0):
+    """Run the AI assessment over a farmer's uploaded images and store the result."""
+    from .ai_service import assess_crops
+    from .models import CropAssessment, CropImage
+
+    images = CropImage.objects.filter(farmer_id=farmer_id)
+    if image_ids:
+        images = images.filter(pk__in=image_ids)
+    result = assess_crops([image.image.name for image in images], farm_size=farm_size)
+    CropAssessment.objects.create(
+        farmer_id=farmer_id,
+        crop_type=result['crop_type'],
+        health_score=result['health_score'],
+        estimated_yield=result['estimated_yield'],
+        risk_level=result['risk_level'],
+        recommendations=result['recommendations'],
+        confidence_score=result['confidence_score'],
+        raw_ai_response=result,
+    )
@@ -6,8 +6,11 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.permissions import IsAuthenticated
+from core.jobs import enqueue
 from .models import CropImage, CropAssessment
 from .serializers import CropImageSerializer, CropAssessmentSerializer
+from .tasks import assess_images
 import random
 
 class CropImageViewSet(viewsets.ModelViewSet):
@@ -23,9 +26,10 @@ class CropImageViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         user = self.request.user
-        if user.is_staff:
-            return CropImage.objects.all()
-        return CropImage.objects.filter(farmer=user)
+        queryset = CropImage.objects.all()
+        if not user.is_staff:
+            queryset = queryset.filter(farmer=user)
+        return CropImageSerializer.eager_load(queryset, self.request)
 
 
 class CropAssessmentViewSet(viewsets.ModelViewSet):
@@ -40,9 +44,33 @@ class CropAssessmentViewSet(viewsets.ModelViewSet):
         
     def get_queryset(self):
         user = self.request.user
-        if user.is_staff:
-            return CropAssessment.objects.all()
-        return CropAssessment.objects.filter(farmer=user)
+        queryset = CropAssessment.objects.all()
+        if not user.is_staff:
+            queryset = queryset.filter(farmer=user)
+        return CropAssessmentSerializer.eager_load(queryset, self.request)
+
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated])
+    def assess(self, request):
+        """
+        Queue an AI assessment of the farmer's images (all of them, or
+        `image_ids`). Returns 202 with the job id; the assessment appears
+        in the list once a worker has run it. Anonymous callers are
+        refused up front, since the job runs as the requesting farmer.
+        """
+        try:
+            farm_size = float(request.data.get('farm_size', 1.0))
+        except (TypeError, ValueError):
+            return Response({'error': 'farm_size must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        image_ids = request.data.get('image_ids') or []
+        if not isinstance(image_ids, list):
+            return Response({'error': 'image_ids must be a list'}, status=status.HTTP_400_BAD_REQUEST)
+
+        job = enqueue(assess_images, {
+            'farmer_id': str(request.user.pk),
+            'image_ids': [str(image_id) for image_id in image_ids],
+            'farm_size': farm_size,
+        })
+        return Response({'job_id': str(job.pk), 'status': job.status}, status=status.HTTP_202_ACCEPTED)
 
     @action(detail=False, methods=['post'])
     def sim_assess(self, request):
@@ -13,6 +13,8 @@ credit_score = (crop_health * 40) + (past_repayment * 40) + (farm_size * 20)
 from decimal import Decimal
 from typing import Tuple, Dict, Any
 
+from django.db.models import Count, Q
+
 
 def get_repayment_score(user) -> float:
     """
@@ -32,16 +34,20 @@ def get_repayment_score(user) -> float:
     if not completed_loans.exists():
         return 0.5  # Neutral score for new borrowers
     
-    # Get all repayments
-    repayments = LoanRepayment.objects.filter(loan__borrower=user)
+    # Count repayments by status in one aggregate
+    totals = LoanRepayment.objects.filter(loan__borrower=user).aggregate(
+        total=Count('id'),
+        on_time=Count('id', filter=Q(status__in=['on_time', 'auto_deducted'])),
+        late=Count('id', filter=Q(status='late')),
+    )
     
-    if not repayments.exists():
+    if not totals['total']:
         return 0.5
     
     # Calculate score based on repayment status
-    total_repayments = repayments.count()
-    on_time = repayments.filter(status__in=['on_time', 'auto_deducted']).count()
-    late = repayments.filter(status='late').count()
+    total_repayments = totals['total']
+    on_time = totals['on_time']
+    late = totals['late']
     
     # Weight: on_time = 1.0, late = 0.5, missed = 0
     score = (on_time * 1.0 + late * 0.5) / total_repayments
@@ -94,7 +100,11 @@ def calculate_credit_score(user, latest_assessment=None) -> int:
     farm_size = float(user.farm_size_acres) if user.farm_size_acres else 0
     farm_score = normalize_farm_size(farm_size)
     
-    # Calculate weighted score
+    return weighted_score(crop_health, repayment_score, farm_score)
+
+
+def weighted_score(crop_health: float, repayment_score: float, farm_score: float) -> int:
+    """Combine component scores (each 0-1) into the 0-100 credit score."""
     credit_score = (
         (crop_health * 40) +
         (repayment_score * 40) +
@@ -169,6 +179,9 @@ def get_credit_score_breakdown(user, latest_assessment=None) -> Dict[str, Any]:
     farm_size = float(user.farm_size_acres) if user.farm_size_acres else 0
     farm_score = normalize_farm_size(farm_size)
     
+    # Reuse the components instead of re-running calculate_credit_score
+    total_score = weighted_score(crop_health, repayment_score, farm_score)
+    
     return {
         'components': {
             'crop_health': {
@@ -190,6 +203,6 @@ def get_credit_score_breakdown(user, latest_assessment=None) -> Dict[str, Any]:
                 'description': f'Farm size: {farm_size} acres'
             }
         },
-        'total_score': calculate_credit_score(user, latest_assessment),
-        'eligibility': get_loan_eligibility(calculate_credit_score(user, latest_assessment))
+        'total_score': total_score,
+        'eligibility': get_loan_eligibility(total_score)
     }
@@ -0,0 +1,173 @@
+"""
+Pooled escrow - a few long-lived escrow accounts instead of one per order.
+
+With ESCROW_MODE = 'per_order', every paid order and approved loan gets a
+fresh Stellar account (create_escrow_wallet): an account creation, a
+minimum-balance reserve locked for good and an on-chain payment into it.
+In 'pooled' mode ESCROW_POOL_SIZE accounts are created once and the
+funds of many orders share them; an EscrowEntry per order or loan says
+how much of a pool account's balance is whose:
+
+- allocation hashes a key (the buyer, or the borrower) onto a pool slot,
+  so it is one indexed read and one INSERT - no shared counter row that
+  concurrent checkouts would queue on. A buyer's orders all land in the
+  same account, which lets the deposit sweep pay them in with one
+  operation
+- paying for an order writes the entry as 'pending' and queues no chain
+  operation: the funds stay in the buyer's custodial wallet, locked by the
+  ledger's escrow balance
+- sweep_deposits() (`python manage.py sweep_escrow_deposits`) moves
+  pending entries into their pool account with one payment per buyer and
+  account, however many orders that covers
+- settlement and refunds pay out of the pool account for entries already
+  swept, or straight from the buyer's wallet for entries still pending,
+  so an order settled before the sweep never touches the chain twice
+
+Orders and loans that already have their own escrow account (created in
+per-order mode) have no entry and keep paying out of that account.
+
+PRODUCTION NOTES:
+- Pool accounts are custodial multisig accounts like per-order escrow;
+  fund each with enough XLM for its trustline before use
+- Reconcile pool_balances() against the accounts' on-chain balances
+- Releases and sweeps lock only the entry rows (FOR UPDATE OF), never the
+  shared pool account they join to
+"""
+
+import zlib
+from decimal import Decimal
+from typing import Dict, Iterable
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Sum
+
+from core import outbox
+
+
+class EscrowPoolConflict(Exception):
+    """Raised when escrow entries changed while being swept."""
+
+
+def enabled() -> bool:
+    return settings.ESCROW_MODE == 'pooled'
+
+
+def _slot(key) -> int:
+    # crc32 rather than hash(): the slot must not change between processes
+    return zlib.crc32(str(key).encode()) % settings.ESCROW_POOL_SIZE
+
+
+def ensure_pool() -> int:
+    """Create the pool accounts that do not exist yet; returns how many were created."""
+    from .escrow_service import create_escrow_wallet
+    from .models import EscrowAccount
+
+    existing = set(EscrowAccount.objects.values_list('slot', flat=True))
+    created = 0
+    for slot in range(settings.ESCROW_POOL_SIZE):
+        if slot in existing:
+            continue
+        try:
+            with transaction.atomic():
+                EscrowAccount.objects.create(slot=slot, address=create_escrow_wallet())
+            created += 1
+        except IntegrityError:
+            # Created by a concurrent caller; its create-account operation stands
+            pass
+    return created
+
+
+def account_for(key):
+    """The pool account that holds escrow for `key` (a buyer or borrower id)."""
+    from .models import EscrowAccount
+
+    slot = _slot(key)
+    account = EscrowAccount.objects.filter(slot=slot).first()
+    if account is None:
+        ensure_pool()
+        account = EscrowAccount.objects.get(slot=slot)
+    return account
+
+
+def hold(account, reference_type: str, reference_id, amount, depositor: str = ''):
+    """
+    Record that `account` holds `amount` for a reference. With a
+    `depositor`, the funds reach the pool with the next deposit sweep;
+    without one there is nothing to deposit and the entry starts held.
+    """
+    from .models import EscrowEntry
+
+    return EscrowEntry.objects.create(
+        account=account, reference_type=reference_type, reference_id=reference_id,
+        amount=Decimal(amount), depositor=depositor, status='pending' if depositor else 'held',
+    )
+
+
+def release(reference_type: str, reference_ids: Iterable) -> Dict:
+    """
+    Close the open entries of `reference_ids` (two queries) and return,
+    for each, the address its funds are paid out from: the pool account
+    once swept, else the depositor's wallet. References without an open
+    entry are left out.
+    """
+    from .models import EscrowEntry
+
+    entries = list(
+        EscrowEntry.objects.select_for_update(of=('self',))
+        .filter(reference_type=reference_type, reference_id__in=list(reference_ids),
+                status__in=EscrowEntry.states.transitions['release'].sources)
+        .values_list('pk', 'reference_id', 'status', 'depositor', 'account__address')
+    )
+    if not entries:
+        return {}
+    EscrowEntry.states.apply(EscrowEntry.objects.filter(pk__in=[entry[0] for entry in entries]), 'release')
+    return {
+        reference_id: address if status == 'held' or not depositor else depositor
+        for _, reference_id, status, depositor, address in entries
+    }
+
+
+def sweep_deposits(limit: int = 1000) -> int:
+    """
+    Move up to `limit` pending entries' funds into their pool accounts,
+    oldest first: one outbox payment per depositor and account, in one
+    transaction. Returns how many entries were swept; call again until it
+    returns 0.
+    """
+    from .models import EscrowEntry
+
+    with transaction.atomic():
+        entries = list(
+            EscrowEntry.objects.select_for_update(of=('self',)).filter(status='pending')
+            .order_by('created_at').values_list('pk', 'depositor', 'account__address', 'amount')[:limit]
+        )
+        if not entries:
+            return 0
+        deposits: Dict = {}
+        for _, depositor, address, amount in entries:
+            deposits[depositor, address] = deposits.get((depositor, address), Decimal('0')) + amount
+        outbox.record(
+            outbox.payment(depositor, address, amount, reference_type='escrow_deposit')
+            for (depositor, address), amount in deposits.items()
+        )
+        swept = EscrowEntry.states.apply(EscrowEntry.objects.filter(pk__in=[entry[0] for entry in entries]),
+                                         'deposit')
+        if swept != len(entries):
+            raise EscrowPoolConflict('Escrow entries changed during the deposit sweep, please retry')
+    return swept
+
+
+def pool_balances() -> Dict[str, Dict]:
+    """Per pool account: what its open entries hold, and what is still to be swept in."""
+    from .models import EscrowEntry
+
+    balances: Dict[str, Dict] = {}
+    for address, status, count, total in (
+        EscrowEntry.objects.exclude(status='released').order_by()
+        .values_list('account__address', 'status').annotate(Count('pk'), Sum('amount'))
+    ):
+        account = balances.setdefault(address, {'held': Decimal('0'), 'pending': Decimal('0'), 'entries': 0})
+        account[status] += total
+        account['entries'] += count
+    return balances
@@ -8,18 +8,56 @@ This module simulates escrow functionality that would be implemented using:
 3. Multi-signature accounts for release conditions
 
 Each function is annotated with the equivalent Stellar SDK code.
+
+Balance movements go through core.ledger: every operation is a balanced
+journal whose legs are written as Transaction rows, and balances are
+changed with conditional UPDATEs rather than full User saves.
+
+Order and loan status changes go through the models' compare-and-swap
+state machines (core.state_machine); money moves only for the caller that
+wins the transition.
+
+The Stellar operations each movement stands for are recorded in the
+outbox (core.outbox) in the same database transaction as the ledger
+postings, and submitted later in batches of up to 100 operations per
+network transaction by `python manage.py dispatch_outbox`.
+
+With ESCROW_MODE = 'pooled' (loans.escrow_pool), orders and loans share
+a few long-lived escrow accounts instead of getting one each; payment
+then queues no chain operation until the deposit sweep or settlement.
 """
 
 import secrets
 from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Q, Value, When
 from django.utils import timezone
-from typing import Optional, Tuple
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from core import ledger, outbox
+
+from . import escrow_pool
+
+
+def _wallet_address(user) -> str:
+    """Stellar address of `user` (a User, or a user id - one query)."""
+    from core.models import User
+    
+    address = getattr(user, 'wallet_address', None)
+    if address is None:
+        address = User.objects.filter(pk=user).values_list('wallet_address', flat=True).first()
+    return address or ''
 
 
 def create_escrow_wallet() -> str:
     """
     Create a simulated escrow wallet address.
     
+    The create-account operation is queued in the outbox; call this inside
+    the transaction that stores the address, so a rolled-back caller does
+    not leave an account to be created.
+    
     PRODUCTION - Stellar SDK:
     ```python
     from stellar_sdk import Keypair, Server, TransactionBuilder, Network
@@ -54,31 +92,27 @@ def create_escrow_wallet() -> str:
     ```
     """
     # Simulated Stellar public key format
-    return f"G{secrets.token_hex(27).upper()}"
+    address = f"G{secrets.token_hex(27).upper()}"
+    outbox.record([outbox.create_account(address)])
+    return address
 
 
 def fund_escrow(escrow_address: str, amount: Decimal, user) -> Tuple[bool, str]:
     """
     Move funds from user wallet to escrow.
     """
-    from core.models import Transaction
-    
-    # Simulate transaction
-    if user.available_balance < amount:
-        return False, "Insufficient funds"
-    
-    user.wallet_balance -= amount
-    user.save()
-    
-    tx_hash = secrets.token_hex(32)
-    
-    Transaction.objects.create(
-        user=user,
-        transaction_type='escrow_lock',
-        amount=-amount,
-        stellar_tx_hash=tx_hash,
-        description=f'Funded escrow {escrow_address}'
-    )
+    try:
+        with transaction.atomic():
+            tx_hash = ledger.post([
+                ledger.user_leg(user, ledger.WALLET, -amount, 'escrow_lock',
+                                f'Funded escrow {escrow_address}', guard=True),
+                ledger.system_leg(ledger.EXTERNAL, amount, 'escrow_lock',
+                                  f'Funded escrow {escrow_address}'),
+            ])
+            outbox.record([outbox.payment(_wallet_address(user), escrow_address, amount,
+                                          ledger_tx_hash=tx_hash)])
+    except ledger.InsufficientFunds as exc:
+        return False, str(exc)
     
     return True, tx_hash
 
@@ -87,7 +121,7 @@ def release_loan_milestone(loan, milestone_index: int) -> Tuple[bool, str, Decim
     """
     Release a loan milestone to the borrower.
     """
-    from core.models import Transaction
+    from loans.models import Loan
     
     if milestone_index >= len(loan.milestones):
         return False, "Invalid milestone index", Decimal('0')
@@ -101,34 +135,36 @@ def release_loan_milestone(loan, milestone_index: int) -> Tuple[bool, str, Decim
     approved_amount = loan.amount_approved or loan.amount_requested
     release_amount = approved_amount * Decimal(milestone['percentage']) / 100
     
-    # Update loan
-    milestone['released'] = True
-    milestone['released_at'] = timezone.now().isoformat()
-    loan.milestones[milestone_index] = milestone
-    loan.current_milestone = milestone_index + 1
-    loan.amount_disbursed += release_amount
-    
-    if loan.status == 'approved':
-        loan.status = 'released'
-    
-    loan.save()
-    
-    # Credit borrower's wallet
-    borrower = loan.borrower
-    borrower.wallet_balance += release_amount
-    borrower.save()
-    
-    tx_hash = secrets.token_hex(32)
-    
-    Transaction.objects.create(
-        user=borrower,
-        transaction_type='loan_disbursement',
-        amount=release_amount,
-        reference_type='loan',
-        reference_id=loan.id,
-        stellar_tx_hash=tx_hash,
-        description=f'Loan milestone "{milestone["name"]}" released: {release_amount}'
-    )
+    milestones = list(loan.milestones)
+    milestones[milestone_index] = {**milestone, 'released': True, 'released_at': timezone.now().isoformat()}
+    
+    with transaction.atomic():
+        # Guarded on current_milestone: of two concurrent releases only one pays out
+        if not Loan.states.advance(
+            loan, 'disburse', guard=Q(current_milestone=milestone_index),
+            milestones=milestones,
+            current_milestone=milestone_index + 1,
+            amount_disbursed=F('amount_disbursed') + release_amount,
+        ):
+            return False, "Milestone already released", Decimal('0')
+        
+        # Credit borrower's wallet from the lending pool
+        description = f'Loan milestone "{milestone["name"]}" released: {release_amount}'
+        tx_hash = ledger.post(
+            [
+                ledger.system_leg(ledger.LOAN_POOL, -release_amount, 'loan_disbursement', description),
+                ledger.user_leg(loan.borrower_id, ledger.WALLET, release_amount,
+                                'loan_disbursement', description),
+            ],
+            reference_type='loan',
+            reference_id=loan.id,
+        )
+        outbox.record([outbox.payment(
+            settings.STELLAR_LOAN_POOL_ACCOUNT, _wallet_address(loan.borrower), release_amount,
+            reference_type='loan', reference_id=loan.id, ledger_tx_hash=tx_hash,
+        )])
+        if milestone_index + 1 == len(milestones):
+            escrow_pool.release('loan', [loan.id])
     
     return True, tx_hash, release_amount
 
@@ -136,160 +172,253 @@ def release_loan_milestone(loan, milestone_index: int) -> Tuple[bool, str, Decim
 def process_order_payment(order, buyer) -> Tuple[bool, str]:
     """
     Lock buyer payment in escrow for an order.
-    """
-    from core.models import Transaction
-    
-    if buyer.available_balance < order.total_price:
-        return False, "Insufficient funds"
     
-    # Lock funds in escrow
-    buyer.wallet_balance -= order.total_price
-    buyer.escrow_balance += order.total_price
-    buyer.save()
-    
-    # Create escrow address for order
-    order.escrow_wallet_address = create_escrow_wallet()
-    order.status = 'escrow_held'
-    order.payment_at = timezone.now()
+    The pending_payment -> escrow_held transition is claimed first; only
+    the caller that wins it posts the ledger journal.
+    """
+    from marketplace.models import Order
     
+    description = f'Payment locked in escrow for order {order.id}'
     tx_hash = secrets.token_hex(32)
-    order.escrow_transaction_hash = tx_hash
-    order.save()
     
-    Transaction.objects.create(
-        user=buyer,
-        transaction_type='escrow_lock',
-        amount=-order.total_price,
-        reference_type='order',
-        reference_id=order.id,
-        stellar_tx_hash=tx_hash,
-        description=f'Payment locked in escrow for order {order.id}'
-    )
+    try:
+        with transaction.atomic():
+            account = escrow_pool.account_for(buyer.pk) if escrow_pool.enabled() else None
+            escrow_address = account.address if account else create_escrow_wallet()
+            if not Order.states.advance(order, 'pay', escrow_wallet_address=escrow_address,
+                                        escrow_transaction_hash=tx_hash):
+                # Drop the escrow account queued above
+                transaction.set_rollback(True)
+                return False, f'Cannot pay for order in {order.status} status'
+            
+            # Lock funds in escrow (rejected atomically if the buyer is short)
+            ledger.post(
+                [
+                    ledger.user_leg(buyer, ledger.WALLET, -order.total_price, 'escrow_lock',
+                                    description, guard=True),
+                    ledger.user_leg(buyer, ledger.ESCROW, order.total_price, 'escrow_lock',
+                                    description),
+                ],
+                reference_type='order',
+                reference_id=order.id,
+                stellar_tx_hash=tx_hash,
+            )
+            if account is not None:
+                # Stays in the buyer's wallet until the deposit sweep or settlement
+                escrow_pool.hold(account, 'order', order.id, order.total_price, depositor=_wallet_address(buyer))
+            else:
+                outbox.record([outbox.payment(
+                    _wallet_address(buyer), order.escrow_wallet_address, order.total_price,
+                    reference_type='order', reference_id=order.id, ledger_tx_hash=tx_hash,
+                )])
+    except ledger.InsufficientFunds as exc:
+        # The transition was rolled back; drop its in-memory changes too
+        order.refresh_from_db(fields=['status', 'payment_at', 'escrow_wallet_address',
+                                      'escrow_transaction_hash'])
+        return False, str(exc)
     
     return True, tx_hash
 
 
+# Share of each sale auto-deducted towards the farmer's active loan
+LOAN_DEDUCTION_RATE = Decimal('0.30')
+
+
+class Settlement(NamedTuple):
+    """Outcome of releasing one order's escrow to its farmer."""
+    order_id: object
+    tx_hash: str
+    farmer_receives: Decimal
+    loan_deduction: Decimal
+
+
+class SettlementConflict(Exception):
+    """Raised when orders changed status while a batch was being settled."""
+
+
 def release_order_payment(order) -> Tuple[bool, str, Decimal, Decimal]:
     """
     Release payment from escrow to farmer after buyer confirms receipt.
     Auto-deducts loan repayment if farmer has active loan.
+    
+    A batch of one for settle_orders(); `order` is refreshed in place.
+    """
+    settlements = settle_orders([order.pk])
+    if not settlements:
+        order.refresh_from_db(fields=['status'])
+        return (False, f'Cannot release payment for order in {order.status} status',
+                Decimal('0'), Decimal('0'))
+    
+    order.refresh_from_db(fields=['status', 'received_at', 'completed_at', 'loan_deduction_amount'])
+    settlement = settlements[0]
+    return True, settlement.tx_hash, settlement.farmer_receives, settlement.loan_deduction
+
+
+def settle_orders(order_ids: Iterable) -> List[Settlement]:
+    """
+    Release escrow for many delivered orders in one transaction.
+    
+    Orders not in a completable status (dispatched / received) are
+    skipped. The query count does not depend on the batch size:
+    
+    - lock the orders and the farmers' active loans (two SELECTs)
+    - compute every loan deduction in memory, oldest order first, so
+      several sales by one farmer never over-repay a loan
+    - complete all orders with one conditional UPDATE (the 'complete'
+      transition; received_at is stamped if the buyer never confirmed)
+    - add repayments to loans with one UPDATE, mark paid-off loans repaid,
+      and bulk-insert the LoanRepayment rows
+    - post every sale and repayment journal with ledger.post_many: one
+      balance UPDATE aggregated per user plus one bulk INSERT of legs
+    - close the orders' pooled escrow entries (a SELECT, plus an UPDATE
+      if there are any)
+    - queue the on-chain payments with one outbox INSERT: each order's
+      escrow account pays the farmer's share and the loan deduction
+      directly, rather than routing the deduction through the farmer. A
+      pooled order not yet swept into its pool account pays from the
+      buyer's wallet instead
+    
+    Returns one Settlement per order settled.
     """
-    from core.models import Transaction
+    from django.db.models.functions import Coalesce
     from loans.models import Loan, LoanRepayment
-    
-    farmer = order.listing.farmer
-    
-    # Check for active loan requiring repayment
-    active_loan = Loan.objects.filter(
-        borrower=farmer,
-        status='released',
-        amount_repaid__lt=models.F('amount_approved')  # Simplified check
-    ).first()
-    
-    # Better check: compare repayment to total due
-    if active_loan and active_loan.amount_repaid >= active_loan.total_due:
-        active_loan = None
-    
-    loan_deduction = Decimal('0')
-    
-    if active_loan:
-        # Auto-deduct portion for loan repayment (e.g., 30% of sale)
-        deduction_rate = Decimal('0.30')
-        potential_deduction = order.total_price * deduction_rate
+    from marketplace.models import Order
+    
+    now = timezone.now()
+    with transaction.atomic():
+        orders = list(
+            Order.objects.select_for_update(of=('self',))
+            .select_related('listing__farmer')
+            .filter(pk__in=list(order_ids), status__in=Order.states.transitions['complete'].sources)
+            .order_by('created_at', 'pk')
+        )
+        if not orders:
+            return []
         
-        # Don't deduct more than remaining loan balance
-        remaining_balance = active_loan.remaining_balance
-        loan_deduction = min(potential_deduction, remaining_balance)
+        # Each farmer's most recent released loan with a balance left
+        loans = {}
+        for loan in (Loan.objects.select_for_update()
+                     .filter(borrower_id__in={order.listing.farmer_id for order in orders},
+                             status='released', amount_repaid__lt=F('amount_approved'))
+                     .order_by('-applied_at')):
+            if loan.amount_repaid < loan.total_due:
+                loans.setdefault(loan.borrower_id, loan)
+        remaining = {loan.pk: loan.remaining_balance for loan in loans.values()}
+        sources = escrow_pool.release('order', [order.pk for order in orders])
         
-        # Record repayment
-        if loan_deduction > 0:
-            active_loan.amount_repaid += loan_deduction
-            if active_loan.amount_repaid >= active_loan.total_due:
-                active_loan.status = 'repaid'
-                active_loan.completed_at = timezone.now()
-            active_loan.save()
+        settlements, journals, repayments, operations = [], [], [], []
+        repaid = {}
+        for order in orders:
+            farmer_id = order.listing.farmer_id
+            loan = loans.get(farmer_id)
+            deduction = Decimal('0')
+            if loan is not None:
+                deduction = min(order.total_price * LOAN_DEDUCTION_RATE, remaining[loan.pk])
+            tx_hash = secrets.token_hex(32)
+            settlements.append(Settlement(order.pk, tx_hash, order.total_price - deduction, deduction))
+            reference = {'reference_type': 'order', 'reference_id': order.id, 'ledger_tx_hash': tx_hash}
+            escrow_address = sources.get(order.pk, order.escrow_wallet_address)
+            operations.append(outbox.payment(escrow_address, order.listing.farmer.wallet_address,
+                                             order.total_price - deduction, **reference))
             
-            LoanRepayment.objects.create(
-                loan=active_loan,
-                amount=loan_deduction,
+            # Buyer escrow -> farmer wallet
+            journals.append(ledger.Journal(
+                legs=[
+                    ledger.user_leg(order.buyer_id, ledger.ESCROW, -order.total_price, 'escrow_release',
+                                    f'Escrow released for order {order.id}'),
+                    ledger.user_leg(farmer_id, ledger.WALLET, order.total_price, 'sale_payment',
+                                    f'Payment received for {order.listing.title}. Loan deduction: {deduction}'),
+                ],
+                reference_type='order',
+                reference_id=order.id,
+                stellar_tx_hash=tx_hash,
+            ))
+            if deduction <= 0:
+                continue
+            
+            # Farmer wallet -> lending pool
+            operations.append(outbox.payment(escrow_address, settings.STELLAR_LOAN_POOL_ACCOUNT,
+                                             deduction, **reference))
+            remaining[loan.pk] -= deduction
+            repaid[loan.pk] = repaid.get(loan.pk, Decimal('0')) + deduction
+            repayments.append(LoanRepayment(
+                loan=loan,
+                amount=deduction,
                 status='auto_deducted',
                 source_order=order,
+                transaction_hash=tx_hash,
                 notes=f'Auto-deducted from sale of {order.listing.title}'
-            )
-            
-            # Create Transaction for repayment
-            Transaction.objects.create(
-                user=farmer,
-                transaction_type='loan_repayment',
-                amount=-loan_deduction,
+            ))
+            description = f'Auto-repayment from order {order.id}'
+            journals.append(ledger.Journal(
+                legs=[
+                    ledger.user_leg(farmer_id, ledger.WALLET, -deduction, 'loan_repayment', description),
+                    ledger.system_leg(ledger.LOAN_POOL, deduction, 'loan_repayment', description),
+                ],
                 reference_type='loan',
-                reference_id=active_loan.id,
-                description=f'Auto-repayment from order {order.id}'
-            )
-    
-    # Calculate farmer's net payment
-    farmer_receives = order.total_price - loan_deduction
-    order.loan_deduction_amount = loan_deduction
-    
-    # Release funds to farmer
-    farmer.wallet_balance += farmer_receives
-    farmer.save()
-    
-    # Update order status
-    order.status = 'completed'
-    order.completed_at = timezone.now()
-    order.save()
-    
-    tx_hash = secrets.token_hex(32)
-    
-    # Record transaction for payment
-    Transaction.objects.create(
-        user=farmer,
-        transaction_type='sale_payment',
-        amount=farmer_receives,
-        reference_type='order',
-        reference_id=order.id,
-        stellar_tx_hash=tx_hash,
-        description=f'Payment received for {order.listing.title}. Loan deduction: {loan_deduction}'
-    )
-    
-    # Release escrow from buyer's account (buyer funds were already moved to escrow_balance)
-    buyer = order.buyer
-    buyer.escrow_balance -= order.total_price
-    buyer.save()
+                reference_id=loan.id,
+                stellar_tx_hash=tx_hash,
+            ))
+        
+        deductions = {settlement.order_id: settlement.loan_deduction for settlement in settlements}
+        completed = Order.states.apply(
+            Order.objects.filter(pk__in=deductions), 'complete',
+            loan_deduction_amount=Case(
+                *[When(pk=pk, then=Value(amount)) for pk, amount in deductions.items()],
+                output_field=DecimalField(max_digits=15, decimal_places=2),
+            ),
+            received_at=Coalesce('received_at', Value(now)),
+            completed_at=now,
+        )
+        if completed != len(orders):
+            raise SettlementConflict('Orders changed during settlement, please retry')
+        
+        if repaid:
+            Loan.objects.filter(pk__in=repaid).update(amount_repaid=F('amount_repaid') + Case(
+                *[When(pk=pk, then=Value(amount)) for pk, amount in repaid.items()],
+                output_field=DecimalField(max_digits=15, decimal_places=2),
+            ))
+            paid_off = [pk for pk in repaid if remaining[pk] <= 0]
+            if paid_off:
+                Loan.states.apply(Loan.objects.filter(pk__in=paid_off), 'repay')
+            LoanRepayment.objects.bulk_create(repayments)
+        
+        ledger.post_many(journals)
+        outbox.record(operations)
     
-    return True, tx_hash, farmer_receives, loan_deduction
+    return settlements
 
 
 def refund_order(order) -> Tuple[bool, str]:
     """
     Refund order - return escrowed funds to buyer.
     """
-    from core.models import Transaction
-    
-    if order.status not in ['escrow_held', 'dispatched', 'disputed']:
-        return False, "Order cannot be refunded in current state"
-    
-    buyer = order.buyer
-    
-    # Return escrowed funds
-    buyer.escrow_balance -= order.total_price
-    buyer.wallet_balance += order.total_price
-    buyer.save()
+    from marketplace.models import Order
     
-    order.status = 'refunded'
-    order.save()
+    description = f'Refund for order {order.id}'
     
-    tx_hash = secrets.token_hex(32)
-    
-    Transaction.objects.create(
-        user=buyer,
-        transaction_type='escrow_release',
-        amount=order.total_price,
-        reference_type='order',
-        reference_id=order.id,
-        stellar_tx_hash=tx_hash,
-        description=f'Refund for order {order.id}'
-    )
+    with transaction.atomic():
+        if not Order.states.advance(order, 'refund'):
+            return False, "Order cannot be refunded in current state"
+        
+        # Return escrowed funds
+        tx_hash = ledger.post(
+            [
+                ledger.user_leg(order.buyer_id, ledger.ESCROW, -order.total_price,
+                                'escrow_release', description),
+                ledger.user_leg(order.buyer_id, ledger.WALLET, order.total_price,
+                                'escrow_release', description),
+            ],
+            reference_type='order',
+            reference_id=order.id,
+        )
+        escrow_address = escrow_pool.release('order', [order.id]).get(order.id, order.escrow_wallet_address)
+        buyer_address = _wallet_address(order.buyer)
+        # A pooled order refunded before the deposit sweep never left the buyer's wallet
+        if escrow_address != buyer_address:
+            outbox.record([outbox.payment(
+                escrow_address, buyer_address, order.total_price,
+                reference_type='order', reference_id=order.id, ledger_tx_hash=tx_hash,
+            )])
     
     return True, tx_hash
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crops', '0002_keyset_pagination_indexes'),
+        ('loans', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['-applied_at', '-id'], name='loans_loan_applied_idx'),
+        ),
+    ]
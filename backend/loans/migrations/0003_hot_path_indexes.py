@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:48
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crops', '0002_keyset_pagination_indexes'),
+        ('loans', '0002_keyset_pagination_indexes'),
+        ('marketplace', '0006_listing_geohash'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['borrower', 'status'], name='loans_loan_borrower_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(condition=models.Q(('status', 'released')), fields=['borrower'], name='loans_loan_released_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loanrepayment',
+            index=models.Index(fields=['loan', 'status'], name='loans_repay_loan_status_idx'),
+        ),
+    ]
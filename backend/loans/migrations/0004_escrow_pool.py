@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:32
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0003_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EscrowAccount',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('slot', models.PositiveIntegerField(unique=True)),
+                ('address', models.CharField(max_length=56, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['slot'],
+            },
+        ),
+        migrations.CreateModel(
+            name='EscrowEntry',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('reference_type', models.CharField(max_length=20)),
+                ('reference_id', models.UUIDField()),
+                ('depositor', models.CharField(blank=True, max_length=56)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('status', models.CharField(choices=[('pending', 'Awaiting Deposit'), ('held', 'Held in Pool'), ('released', 'Released')], default='pending', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('released_at', models.DateTimeField(blank=True, null=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='entries', to='loans.escrowaccount')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('status', 'pending')), fields=['created_at'], name='loans_escrow_entry_pending_idx')],
+                'constraints': [models.UniqueConstraint(fields=('reference_type', 'reference_id'), name='loans_escrow_entry_ref_uniq')],
+            },
+        ),
+    ]
@@ -1,5 +1,5 @@
 """
-Loans models - Loans and Repayments.
+Loans models - Loans, Repayments and the pooled escrow sub-ledger.
 
 PRODUCTION NOTES:
 - Escrow logic simulates Stellar smart contracts
@@ -11,6 +11,8 @@ from django.conf import settings
 import uuid
 from decimal import Decimal
 
+from core.state_machine import StateMachine, Transition
+
 
 class Loan(models.Model):
     """
@@ -28,6 +30,17 @@ class Loan(models.Model):
         ('rejected', 'Rejected'),
     ]
     
+    # Every status change goes through these (see core.state_machine).
+    # 'disburse' also fires for later milestones of a released loan; it is
+    # guarded on current_milestone so each milestone is paid out once.
+    states = StateMachine({
+        'approve': Transition(['requested'], 'approved', timestamp='approved_at'),
+        'reject': Transition(['requested'], 'rejected'),
+        'disburse': Transition(['approved', 'released'], 'released'),
+        'repay': Transition(['released'], 'repaid', timestamp='completed_at'),
+        'default': Transition(['released'], 'defaulted'),
+    })
+    
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     borrower = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -82,6 +95,14 @@ class Loan(models.Model):
             return self.amount_approved + interest
         return Decimal('0')
     
+    @property
+    def next_milestone(self):
+        """(index, milestone) of the next unreleased milestone, or (index, None) when all are out."""
+        index = self.current_milestone
+        if index < len(self.milestones):
+            return index, self.milestones[index]
+        return index, None
+    
     @property
     def remaining_balance(self):
         """Outstanding balance."""
@@ -89,6 +110,14 @@ class Loan(models.Model):
     
     class Meta:
         ordering = ['-applied_at']
+        indexes = [
+            # Keyset pagination key (see core.pagination)
+            models.Index(fields=['-applied_at', '-id'], name='loans_loan_applied_idx'),
+            models.Index(fields=['borrower', 'status'], name='loans_loan_borrower_status_idx'),
+            # Active-loan lookup on every sale release (escrow_service)
+            models.Index(fields=['borrower'], condition=models.Q(status='released'),
+                         name='loans_loan_released_idx'),
+        ]
 
 
 class LoanRepayment(models.Model):
@@ -129,3 +158,70 @@ class LoanRepayment(models.Model):
     
     class Meta:
         ordering = ['-paid_at']
+        indexes = [
+            models.Index(fields=['loan', 'status'], name='loans_repay_loan_status_idx'),
+        ]
+
+
+class EscrowAccount(models.Model):
+    """
+    A long-lived Stellar account in the pooled escrow (see loans.escrow_pool).
+    Holds the funds of many orders; EscrowEntry rows say whose.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # Position in the pool; allocation hashes onto slots
+    slot = models.PositiveIntegerField(unique=True)
+    address = models.CharField(max_length=56, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Escrow pool slot {self.slot}: {self.address}"
+    
+    class Meta:
+        ordering = ['slot']
+
+
+class EscrowEntry(models.Model):
+    """
+    Sub-ledger line: the amount a pooled escrow account holds for one
+    order or loan.
+    
+    State Machine:
+    PENDING (still in the depositor's wallet) -> HELD (swept into the pool)
+    PENDING / HELD -> RELEASED (paid out by settlement or refund)
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Awaiting Deposit'),
+        ('held', 'Held in Pool'),
+        ('released', 'Released'),
+    ]
+    
+    states = StateMachine({
+        'deposit': Transition(['pending'], 'held'),
+        'release': Transition(['pending', 'held'], 'released', timestamp='released_at'),
+    })
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    account = models.ForeignKey(EscrowAccount, on_delete=models.PROTECT, related_name='entries')
+    reference_type = models.CharField(max_length=20)
+    reference_id = models.UUIDField()
+    # Wallet the funds come from; empty when nothing is deposited (loans
+    # are disbursed from the loan pool account)
+    depositor = models.CharField(max_length=56, blank=True)
+    amount = models.DecimalField(max_digits=15, decimal_places=2)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    created_at = models.DateTimeField(auto_now_add=True)
+    released_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"Escrow {self.reference_type} {self.reference_id}: {self.amount} ({self.status})"
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['reference_type', 'reference_id'], name='loans_escrow_entry_ref_uniq'),
+        ]
+        indexes = [
+            # Deposit sweep
+            models.Index(fields=['created_at'], condition=models.Q(status='pending'),
+                         name='loans_escrow_entry_pending_idx'),
+        ]
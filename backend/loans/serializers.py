@@ -3,11 +3,12 @@ Loans serializers - Lending Pool, Loans, and Repayments.
 """
 
 from rest_framework import serializers
+from core.fieldsets import SparseFieldsMixin
 from .models import Loan, LoanRepayment
 from crops.serializers import CropAssessmentSerializer
 
 
-class LoanRepaymentSerializer(serializers.ModelSerializer):
+class LoanRepaymentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = LoanRepayment
         fields = ['id', 'loan', 'amount', 'status', 'source_order',
@@ -15,7 +16,7 @@ class LoanRepaymentSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'paid_at', 'transaction_hash']
 
 
-class LoanSerializer(serializers.ModelSerializer):
+class LoanSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     borrower_name = serializers.CharField(source='borrower.full_name', read_only=True)
     total_due = serializers.DecimalField(max_digits=15, decimal_places=2, read_only=True)
     remaining_balance = serializers.DecimalField(max_digits=15, decimal_places=2, read_only=True)
@@ -32,6 +33,8 @@ class LoanSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'status', 'credit_score_at_application', 
                            'escrow_wallet_address', 'amount_disbursed', 'amount_repaid',
                            'applied_at', 'approved_at', 'completed_at']
+        select_related_fields = {'borrower_name': ['borrower']}
+        prefetch_related_fields = {'repayments': ['repayments']}
 
 
 class LoanApplicationSerializer(serializers.ModelSerializer):
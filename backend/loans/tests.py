@@ -1,3 +1,135 @@
-from django.test import TestCase
+from datetime import date
+from decimal import Decimal
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+
+from core.models import OutboxOperation, User
+from core.testing import QueryBudgetTestMixin
+from loans import escrow_pool
+from loans.escrow_service import process_order_payment, refund_order, release_loan_milestone, settle_orders
+from loans.models import EscrowAccount, EscrowEntry, Loan, LoanRepayment
+from marketplace.models import Listing, Order
+
+
+class LoanQueryCountTests(QueryBudgetTestMixin, TestCase):
+    """Loan lists join the borrower and prefetch repayments in one extra query."""
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(10):
+            farmer = User.objects.create_user(f'farmer{i}@test.com', 'pw',
+                                              full_name=f'Farmer {i}', is_farmer=True)
+            loan = Loan.objects.create(borrower=farmer, amount_requested=1000,
+                                       amount_approved=1000, status='released')
+            for _ in range(3):
+                LoanRepayment.objects.create(loan=loan, amount=Decimal('100'))
+
+    def test_loan_list_is_constant(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/loans/loans/')
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertEqual(len(response.data['results'][0]['repayments']), 3)
+        self.assertWithinQueryBudget(response)
+
+    def test_omitting_repayments_skips_prefetch(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/loans/loans/', {'omit': 'repayments'})
+        self.assertNotIn('repayments', response.data['results'][0])
+
+
+class LoanTransitionTests(TestCase):
+    def setUp(self):
+        self.farmer = User.objects.create_user('lt@test.com', 'pw', full_name='Borrower', is_farmer=True)
+        self.loan = Loan.objects.create(borrower=self.farmer, amount_requested=1000)
+
+    def test_stale_instances_cannot_repeat_a_transition(self):
+        stale = Loan.objects.get(pk=self.loan.pk)
+        self.assertEqual(self.client.post(f'/api/loans/loans/{self.loan.id}/approve/').status_code, 200)
+        self.assertFalse(Loan.states.advance(stale, 'reject'))
+        self.assertEqual(stale.status, 'approved')
+
+    def test_milestone_is_paid_out_once(self):
+        self.client.post(f'/api/loans/loans/{self.loan.id}/approve/')
+        first, second = Loan.objects.get(pk=self.loan.pk), Loan.objects.get(pk=self.loan.pk)
+        ok, _, amount = release_loan_milestone(first, 0)
+        self.assertEqual((ok, amount), (True, Decimal('500')))
+        ok, message, _ = release_loan_milestone(second, 0)
+        self.assertEqual((ok, message), (False, 'Milestone already released'))
+
+        self.loan.refresh_from_db()
+        self.assertEqual((self.loan.status, self.loan.amount_disbursed, self.loan.current_milestone),
+                         ('released', Decimal('500'), 1))
+        self.farmer.refresh_from_db()
+        self.assertEqual(self.farmer.wallet_balance, Decimal('500'))
+
+        response = self.client.post(f'/api/loans/loans/{self.loan.id}/release_milestone/')
+        self.assertEqual(response.data['amount'], '300.00')
+
+
+class EscrowPoolTests(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user('pool@test.com', 'pw', full_name='Pool Buyer', is_buyer=True,
+                                              wallet_balance=Decimal('1000'))
+        self.farmer = User.objects.create_user('poolfarm@test.com', 'pw', full_name='Pool Farmer', is_farmer=True)
+        self.listing = Listing.objects.create(
+            farmer=self.farmer, title='Beans', description='', crop_type='Beans', quantity_kg=100,
+            quantity_available=100, price_per_kg=10, expected_harvest_date=date(2026, 12, 1),
+        )
+
+    def pay(self, count=1):
+        orders = []
+        for _ in range(count):
+            order = Order.objects.create(listing=self.listing, buyer=self.buyer, quantity_kg=1,
+                                         price_per_kg=10, total_price=10)
+            self.assertTrue(process_order_payment(order, self.buyer)[0])
+            orders.append(order)
+        return orders
+
+    def test_payment_queues_no_chain_operation(self):
+        first, = self.pay()
+        pool_setup = OutboxOperation.objects.count()
+        self.assertEqual(pool_setup, EscrowAccount.objects.count())
+        self.assertFalse(OutboxOperation.objects.exclude(kind='create_account').exists())
+
+        second, = self.pay()
+        self.assertEqual(OutboxOperation.objects.count(), pool_setup)
+        self.assertEqual(first.escrow_wallet_address, second.escrow_wallet_address)
+        self.assertEqual(EscrowEntry.objects.filter(status='pending').count(), 2)
+
+    def test_sweep_deposits_once_per_buyer_and_account(self):
+        self.pay(3)
+        self.assertEqual(escrow_pool.sweep_deposits(), 3)
+        deposit = OutboxOperation.objects.get(reference_type='escrow_deposit')
+        self.assertEqual((deposit.source, deposit.amount), (self.buyer.wallet_address, Decimal('30')))
+        self.assertEqual(escrow_pool.sweep_deposits(), 0)
+        balances = escrow_pool.pool_balances()
+        self.assertEqual(list(balances.values()), [{'held': Decimal('30'), 'pending': Decimal('0'), 'entries': 3}])
+
+    def test_payout_source_follows_sweep(self):
+        swept, unswept, refunded = self.pay(3)
+        EscrowEntry.objects.filter(reference_id=swept.pk).update(status='held')
+        Order.objects.filter(pk__in=[swept.pk, unswept.pk]).update(status='received')
+        settle_orders([swept.pk, unswept.pk])
+        self.assertTrue(refund_order(Order.objects.get(pk=refunded.pk))[0])
+
+        payouts = dict(OutboxOperation.objects.filter(reference_type='order').values_list('reference_id', 'source'))
+        self.assertEqual(payouts, {swept.pk: swept.escrow_wallet_address, unswept.pk: self.buyer.wallet_address})
+        self.assertFalse(EscrowEntry.objects.exclude(status='released').exists())
+
+    @override_settings(ESCROW_MODE='per_order')
+    def test_per_order_mode_creates_an_account_each(self):
+        first, second = self.pay(2)
+        self.assertNotEqual(first.escrow_wallet_address, second.escrow_wallet_address)
+        self.assertEqual(OutboxOperation.objects.filter(kind='create_account').count(), 2)
+        self.assertFalse(EscrowEntry.objects.exists())
+
+    def test_loan_uses_pool_until_fully_disbursed(self):
+        loan = Loan.objects.create(borrower=self.farmer, amount_requested=1000)
+        self.client.post(f'/api/loans/loans/{loan.id}/approve/')
+        loan.refresh_from_db()
+        entry = EscrowEntry.objects.get(reference_id=loan.pk)
+        self.assertEqual((entry.account.address, entry.status), (loan.escrow_wallet_address, 'held'))
+        for index in range(3):
+            release_loan_milestone(Loan.objects.get(pk=loan.pk), index)
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, 'released')
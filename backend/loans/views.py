@@ -5,7 +5,6 @@ Loans views - Lending, Credit Scoring, and Loan Management API.
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from django.utils import timezone
 from django.db import transaction
 
 from .models import Loan, LoanRepayment
@@ -14,16 +13,23 @@ from .serializers import (
     LoanRepaymentSerializer, CreditScoreSerializer
 )
 from .credit_scoring import calculate_credit_score, get_credit_score_breakdown, get_loan_eligibility
+from . import escrow_pool
 from .escrow_service import create_escrow_wallet, release_loan_milestone
+from core.conditional import ConditionalGetMixin
 from core.models import User
+from core.streaming import NDJSON_RENDERER_CLASSES, stream_ndjson, wants_ndjson
 
 
-class LoanViewSet(viewsets.ModelViewSet):
+class LoanViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     API endpoint for loans.
     Supports application, approval, and milestone release.
     """
     queryset = Loan.objects.all()
+    # No updated_at on Loan: ETag hashes the row (amount_repaid moves with
+    # every repayment) plus the borrower it renders
+    etag_related = ('borrower.updated_at',)
+    query_budgets = {'list': 2, 'retrieve': 2, 'pending': 2}
     
     def get_serializer_class(self):
         if self.action == 'create':
@@ -40,7 +46,7 @@ class LoanViewSet(viewsets.ModelViewSet):
         if status_filter:
             queryset = queryset.filter(status=status_filter)
         
-        return queryset
+        return LoanSerializer.eager_load(queryset, self.request)
     
     @transaction.atomic
     def create(self, request, *args, **kwargs):
@@ -99,29 +105,33 @@ class LoanViewSet(viewsets.ModelViewSet):
         """
         loan = self.get_object()
         
-        if loan.status != 'requested':
-            return Response({'error': f'Cannot approve loan in {loan.status} status'}, status=400)
-        
         # Allow optional amount adjustment
         approved_amount = request.data.get('amount', loan.amount_requested)
         admin_notes = request.data.get('notes', '')
         
+        # Use simplified milestones for MVP
         with transaction.atomic():
-            loan.status = 'approved'
-            loan.amount_approved = approved_amount
-            loan.approved_at = timezone.now()
-            loan.admin_notes = admin_notes
-            loan.escrow_wallet_address = create_escrow_wallet()
-            
-            # Use simplified milestones for MVP
-            loan.milestones = [
-                {'name': 'Initial Disbursement', 'percentage': 50, 'released': False},
-                {'name': 'Mid-Season Check', 'percentage': 30, 'released': False},
-                {'name': 'Pre-Harvest', 'percentage': 20, 'released': False}
-            ]
-            loan.current_milestone = 0
-            
-            loan.save()
+            account = escrow_pool.account_for(loan.borrower_id) if escrow_pool.enabled() else None
+            approved = Loan.states.advance(
+                loan, 'approve',
+                amount_approved=approved_amount,
+                admin_notes=admin_notes,
+                escrow_wallet_address=account.address if account else create_escrow_wallet(),
+                milestones=[
+                    {'name': 'Initial Disbursement', 'percentage': 50, 'released': False},
+                    {'name': 'Mid-Season Check', 'percentage': 30, 'released': False},
+                    {'name': 'Pre-Harvest', 'percentage': 20, 'released': False}
+                ],
+                current_milestone=0,
+            )
+            if not approved:
+                # Drop the escrow account queued above
+                transaction.set_rollback(True)
+            elif account is not None:
+                # Disbursed from the loan pool account: nothing is deposited
+                escrow_pool.hold(account, 'loan', loan.id, loan.amount_approved)
+        if not approved:
+            return Response({'error': f'Cannot approve loan in {loan.status} status'}, status=400)
         
         return Response({
             'message': 'Loan approved successfully',
@@ -133,13 +143,9 @@ class LoanViewSet(viewsets.ModelViewSet):
         """Reject a loan application."""
         loan = self.get_object()
         
-        if loan.status != 'pending':
+        if not Loan.states.advance(loan, 'reject', admin_notes=request.data.get('reason', 'Application rejected')):
             return Response({'error': f'Cannot reject loan in {loan.status} status'}, status=400)
         
-        loan.status = 'rejected'
-        loan.admin_notes = request.data.get('reason', 'Application rejected')
-        loan.save()
-        
         return Response({'message': 'Loan rejected', 'loan': LoanSerializer(loan).data})
     
     @action(detail=True, methods=['post'])
@@ -151,7 +157,7 @@ class LoanViewSet(viewsets.ModelViewSet):
         """
         loan = self.get_object()
         
-        if loan.status not in ['approved', 'active']:
+        if not Loan.states.can(loan, 'disburse'):
             return Response({'error': f'Cannot release milestone for {loan.status} loan'}, status=400)
         
         milestone_index, next_milestone = loan.next_milestone
@@ -170,16 +176,23 @@ class LoanViewSet(viewsets.ModelViewSet):
             'loan': LoanSerializer(loan).data
         })
     
-    @action(detail=False, methods=['get'])
+    @action(detail=False, methods=['get'], renderer_classes=NDJSON_RENDERER_CLASSES)
     def pending(self, request):
-        """Get all pending loans for admin review."""
-        pending_loans = Loan.objects.filter(status='pending')
-        serializer = LoanSerializer(pending_loans, many=True)
+        """
+        Get all pending loans for admin review.
+        Send Accept: application/x-ndjson to stream.
+        """
+        pending_loans = LoanSerializer.eager_load(Loan.objects.filter(status='pending'), request)
+        context = {'request': request}
+        if wants_ndjson(request):
+            return stream_ndjson(pending_loans, LoanSerializer, context=context)
+        serializer = LoanSerializer(pending_loans, many=True, context=context)
         return Response(serializer.data)
 
 
 class CreditScoreViewSet(viewsets.ViewSet):
     """API endpoint for credit score calculation."""
+    query_budgets = {'user_score': 4}
     
     @action(detail=False, methods=['get'], url_path='user/(?P<user_id>[^/.]+)')
     def user_score(self, request, user_id=None):
@@ -193,8 +206,7 @@ class CreditScoreViewSet(viewsets.ViewSet):
             return Response({'error': 'Only farmers have credit scores'}, status=400)
         
         # Get latest assessment
-        latest_farm = user.farms.first()
-        latest_assessment = latest_farm.latest_assessment if latest_farm else None
+        latest_assessment = user.assessments.order_by('-assessed_at').first()
         
         breakdown = get_credit_score_breakdown(user, latest_assessment)
         
@@ -0,0 +1,78 @@
+"""
+Auto-release of escrow for orders the buyer never confirmed.
+
+An order left in `dispatched` for longer than
+MARKETPLACE_AUTO_RELEASE_DAYS is treated as delivered: its escrow is
+released to the farmer through the batch settlement path
+(loans.escrow_service.settle_orders), with the usual loan deduction.
+
+Due orders are found through the (status, dispatched_at) index and
+processed in keyset-ordered chunks. Only one chunk of ids is in memory
+at a time, and each chunk settles in its own transaction. A crash loses
+at most the chunk in flight, and that chunk rolls back. Settled orders
+leave `dispatched`, so the next run simply picks up whatever is still
+due; running twice never pays twice (the 'complete' transition is a
+compare-and-swap).
+
+PRODUCTION NOTES:
+- Run `python manage.py auto_release_orders` hourly
+- Notify buyers before the window closes (not implemented)
+"""
+
+import logging
+from datetime import timedelta
+from typing import Iterator, List
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def release_cutoff(now=None):
+    """Orders dispatched at or before this moment are due for auto-release."""
+    return (now or timezone.now()) - timedelta(days=settings.MARKETPLACE_AUTO_RELEASE_DAYS)
+
+
+def due_order_batches(cutoff, batch_size: int = 500) -> Iterator[List]:
+    """
+    Yield lists of at most `batch_size` ids of orders dispatched by
+    `cutoff`, oldest first. Each batch is a fresh index range scan
+    starting after the last (dispatched_at, id) seen.
+    """
+    from .models import Order
+
+    due = Order.objects.filter(status='dispatched', dispatched_at__lte=cutoff)
+    after = None
+    while True:
+        page = due
+        if after is not None:
+            dispatched_at, pk = after
+            page = page.filter(Q(dispatched_at__gt=dispatched_at) | Q(dispatched_at=dispatched_at, pk__gt=pk))
+        rows = list(page.order_by('dispatched_at', 'pk').values_list('dispatched_at', 'pk')[:batch_size])
+        if not rows:
+            return
+        yield [pk for _, pk in rows]
+        after = rows[-1]
+
+
+def release_due_orders(now=None, batch_size: int = 500, limit: int = None) -> int:
+    """
+    Settle up to `limit` (default: all) orders past the confirmation
+    window. Returns how many were settled.
+    """
+    from loans.escrow_service import SettlementConflict, settle_orders
+
+    released = 0
+    for order_ids in due_order_batches(release_cutoff(now), batch_size):
+        if limit is not None:
+            order_ids = order_ids[:limit - released]
+        try:
+            released += len(settle_orders(order_ids))
+        except SettlementConflict:
+            # Someone else moved these orders; what is still due is retried next run
+            logger.warning('Auto-release batch of %d orders conflicted; skipping', len(order_ids))
+        if limit is not None and released >= limit:
+            break
+    return released
@@ -0,0 +1,103 @@
+"""
+Versioned response cache for marketplace read endpoints.
+
+Cached payloads are keyed by endpoint, normalized query params and a
+per-table version counter. Writers never delete cache entries; they bump
+the version (after their transaction commits), which makes every older key
+unreachable at once. Works with any Django cache backend: local-memory in
+development, Redis/Memcached in production.
+
+Bumps happen in marketplace.signals for Listing saves/deletes, and must be
+called explicitly (bump_version('listing')) by code that changes listings
+with queryset.update(), since that skips signals.
+"""
+
+import hashlib
+import time
+from typing import Callable
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.response import Response
+
+from core.conditional import not_modified, read_validators, set_validators
+
+CACHE_PREFIX = 'mkt'
+
+
+def _cache():
+    return caches[getattr(settings, 'MARKETPLACE_CACHE_ALIAS', 'default')]
+
+
+def _version_key(table: str) -> str:
+    return f'{CACHE_PREFIX}:version:{table}'
+
+
+def get_version(table: str) -> int:
+    """
+    Current version for `table`.
+
+    A missing counter (first use, eviction, restart) is seeded from the
+    clock so it can never fall back to a version whose entries still exist.
+    """
+    cache = _cache()
+    key = _version_key(table)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def _bump(table: str):
+    cache = _cache()
+    key = _version_key(table)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, int(time.time() * 1000), timeout=None)
+
+
+def bump_version(table: str):
+    """Invalidate every cached response for `table` once the current transaction commits."""
+    transaction.on_commit(lambda: _bump(table))
+
+
+def cache_key(request, endpoint: str, table: str) -> str:
+    """Build the cache key for `endpoint` from the normalized request params."""
+    params = sorted(
+        (name, sorted(values)) for name, values in request.query_params.lists()
+    )
+    # Paginated payloads embed absolute next/previous links
+    raw = f'{request.get_host()}|{params}'
+    digest = hashlib.md5(raw.encode('utf-8')).hexdigest()
+    return f'{CACHE_PREFIX}:{endpoint}:{get_version(table)}:{digest}'
+
+
+def cached_response(request, endpoint: str, compute: Callable[[], Response],
+                    table: str = 'listing') -> Response:
+    """
+    Serve `endpoint` from cache, computing and storing it on a miss.
+
+    The version is read before computing, so a write that commits while
+    the response is being built bumps past the key it will be stored under.
+    Only 200 responses are cached, together with their ETag/Last-Modified
+    so cache hits still answer conditional GETs with 304.
+    """
+    cache = _cache()
+    key = cache_key(request, endpoint, table)
+    cached = cache.get(key)
+    if cached is not None:
+        data, etag, last_modified = cached
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+        return set_validators(Response(data), etag, last_modified)
+
+    response = compute()
+    if response.status_code == 200:
+        etag, last_modified = read_validators(response)
+        cache.set(key, (response.data, etag, last_modified),
+                  getattr(settings, 'MARKETPLACE_CACHE_TIMEOUT', 300))
+    return response
@@ -0,0 +1,230 @@
+"""
+Crop catalog maintenance.
+
+Each Crop row carries live aggregates over the active listings of that
+crop: how many there are, the kg still available and the min/max price per
+kg. Rather than recomputing them per request, every listing save/delete
+applies its delta to the affected Crop rows inside the same transaction:
+
+- Counts and kg move by F() increments, so concurrent writers don't lose
+  updates.
+- Min/max only widen on the way in (Least/Greatest). They are recomputed
+  from the crop's active listings only when the price that left was the
+  current min or max.
+
+Listing.save() and the delete handlers in marketplace.signals call in
+here, taking the old side of the delta from the stored row: reservations
+move stock with queryset.update(), so a loaded instance may be stale. Code that changes listings with queryset.update() must call
+apply_change()/apply_changes() itself (or run `rebuild_crop_catalog`).
+
+PRODUCTION NOTES:
+- The (crop_slug, status, created_at, id) index serves crop-filtered pages
+- rebuild_catalog() is idempotent and safe to run from cron as a check
+"""
+
+from decimal import Decimal
+from typing import Iterable, NamedTuple, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, Max, Min, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest, Least
+from django.utils.text import slugify
+
+ACTIVE_STATUS = 'active'
+
+
+class CatalogState(NamedTuple):
+    """What one listing contributes to its crop's aggregates."""
+    crop: Optional[str]
+    active: bool
+    available_kg: Decimal
+    price_per_kg: Decimal
+
+
+def normalize_crop(name: str) -> str:
+    """Catalog slug for a free-text crop name ('  Sweet Potato ' -> 'sweet-potato')."""
+    return slugify(' '.join((name or '').split()))
+
+
+def display_name(name: str) -> str:
+    return ' '.join((name or '').split()).title()
+
+
+def catalog_state(listing) -> Optional[CatalogState]:
+    """
+    State of `listing` as far as the catalog is concerned, or None if the
+    instance was loaded without the fields needed (e.g. via .only()).
+    """
+    if {'crop_id', 'status', 'quantity_available', 'price_per_kg'} & listing.get_deferred_fields():
+        return None
+    return CatalogState(
+        crop=listing.crop_id,
+        active=listing.status == ACTIVE_STATUS,
+        available_kg=Decimal(listing.quantity_available or 0),
+        price_per_kg=Decimal(listing.price_per_kg or 0),
+    )
+
+
+def stored_state(listing_id, lock: bool = False) -> Optional[CatalogState]:
+    """
+    Catalog state of the listing row as currently stored in the database.
+    With `lock`, the row is locked until the end of the transaction, so
+    no stock update can slip in between this read and the caller's write.
+    """
+    from .models import Listing
+    rows = Listing.objects.select_for_update() if lock else Listing.objects
+    row = rows.filter(pk=listing_id).values_list(
+        'crop_id', 'status', 'quantity_available', 'price_per_kg'
+    ).first()
+    if row is None:
+        return None
+    crop, status, available_kg, price_per_kg = row
+    return CatalogState(crop, status == ACTIVE_STATUS, available_kg, price_per_kg)
+
+
+def saved_state(listing, stored: Optional[CatalogState], update_fields=None) -> Optional[CatalogState]:
+    """
+    Catalog state of the row `listing` was just saved to. Columns the save
+    did not write (left out of update_fields, or deferred) keep their
+    `stored` values.
+    """
+    if stored is None:
+        return catalog_state(listing)
+    columns = {'crop_id': 'crop', 'status': 'active', 'quantity_available': 'available_kg',
+               'price_per_kg': 'price_per_kg'}
+    written = set(columns) - listing.get_deferred_fields()
+    if update_fields is not None:
+        written &= {'crop_id' if name == 'crop' else name for name in update_fields}
+    values = {}
+    for column in written:
+        value = getattr(listing, column)
+        if column == 'status':
+            value = value == ACTIVE_STATUS
+        elif column != 'crop_id':
+            value = Decimal(value or 0)
+        values[columns[column]] = value
+    return stored._replace(**values)
+
+
+def ensure_crop(crop_type: str, current: Optional[str] = None) -> Optional[str]:
+    """Return the catalog slug for `crop_type`, creating the Crop if needed."""
+    from .models import Crop
+    slug = normalize_crop(crop_type)
+    if not slug:
+        return None
+    if slug != current:
+        Crop.objects.get_or_create(slug=slug, defaults={'name': display_name(crop_type)})
+    return slug
+
+
+def _active_price(aggregate):
+    """Subquery aggregating price_per_kg over the outer crop's active listings."""
+    from .models import Listing
+    return Subquery(
+        Listing.objects.filter(crop_id=OuterRef('slug'), status=ACTIVE_STATUS)
+        .values('crop_id').annotate(value=aggregate('price_per_kg')).values('value')[:1],
+        output_field=DecimalField(max_digits=10, decimal_places=2),
+    )
+
+
+def apply_change(old: Optional[CatalogState], new: Optional[CatalogState]):
+    """
+    Move the catalog from reflecting `old` to reflecting `new` for one
+    listing. Either side may be None (created / deleted listing).
+    """
+    apply_changes([(old, new)])
+
+
+def _per_crop(values, field, expression):
+    """CASE slug WHEN ... THEN expression(value) ... ELSE field END."""
+    from .models import Crop
+
+    whens = [When(slug=slug, then=expression(value)) for slug, value in values.items()]
+    return Case(*whens, default=F(field), output_field=Crop._meta.get_field(field))
+
+
+def apply_changes(changes: Iterable[Tuple[Optional[CatalogState], Optional[CatalogState]]]):
+    """
+    Apply many (old, new) listing changes at once: one UPDATE for all the
+    affected crops' counts, kg and widened price ranges, plus one more
+    to recompute ranges that lost an extreme. Used by bulk writers such
+    as cart checkout so catalog upkeep does not grow with the batch.
+    """
+    from .models import Crop
+
+    deltas, entering_prices, departing_prices = {}, {}, {}
+    for old, new in changes:
+        leaving = old if old is not None and old.active and old.crop else None
+        entering = new if new is not None and new.active and new.crop else None
+        if leaving == entering:
+            continue
+        if leaving is not None:
+            count, kg = deltas.get(leaving.crop, (0, Decimal('0')))
+            deltas[leaving.crop] = (count - 1, kg - leaving.available_kg)
+            if entering is None or (entering.crop, entering.price_per_kg) != (leaving.crop, leaving.price_per_kg):
+                departing_prices.setdefault(leaving.crop, []).append(leaving.price_per_kg)
+        if entering is not None:
+            count, kg = deltas.get(entering.crop, (0, Decimal('0')))
+            deltas[entering.crop] = (count + 1, kg + entering.available_kg)
+            entering_prices.setdefault(entering.crop, []).append(entering.price_per_kg)
+    if not deltas:
+        return
+
+    def price(value):
+        return Value(value, output_field=DecimalField(max_digits=10, decimal_places=2))
+
+    with transaction.atomic():
+        updates = {
+            'active_listings': _per_crop(
+                {slug: count for slug, (count, _) in deltas.items()}, 'active_listings',
+                lambda count: F('active_listings') + count),
+            'total_available_kg': _per_crop(
+                {slug: kg for slug, (_, kg) in deltas.items()}, 'total_available_kg',
+                lambda kg: F('total_available_kg') + kg),
+        }
+        if entering_prices:
+            updates['min_price_per_kg'] = _per_crop(
+                {slug: min(prices) for slug, prices in entering_prices.items()}, 'min_price_per_kg',
+                lambda low: Least(Coalesce('min_price_per_kg', price(low)), price(low)))
+            updates['max_price_per_kg'] = _per_crop(
+                {slug: max(prices) for slug, prices in entering_prices.items()}, 'max_price_per_kg',
+                lambda high: Greatest(Coalesce('max_price_per_kg', price(high)), price(high)))
+        Crop.objects.filter(slug__in=deltas).update(**updates)
+
+        # Only a departing extreme can narrow the range
+        if departing_prices:
+            narrowed = Q(pk__in=[])
+            for slug, prices in departing_prices.items():
+                narrowed |= Q(slug=slug) & (Q(min_price_per_kg__gte=min(prices)) | Q(max_price_per_kg__lte=max(prices)))
+            Crop.objects.filter(narrowed).update(
+                min_price_per_kg=_active_price(Min),
+                max_price_per_kg=_active_price(Max),
+            )
+
+
+def rebuild_catalog() -> int:
+    """
+    Recompute every Crop from the listings table and backfill missing
+    listing crop links. Returns the number of crops in the catalog.
+    """
+    from .models import Crop, Listing
+
+    with transaction.atomic():
+        unlinked = Listing.objects.filter(crop__isnull=True).values_list('crop_type', flat=True).distinct()
+        for crop_type in list(unlinked):
+            slug = ensure_crop(crop_type)
+            if slug:
+                Listing.objects.filter(crop__isnull=True, crop_type=crop_type).update(crop_id=slug)
+
+        active = Listing.objects.filter(crop_id=OuterRef('slug'), status=ACTIVE_STATUS).values('crop_id')
+        Crop.objects.update(
+            active_listings=Coalesce(Subquery(active.annotate(n=Count('pk')).values('n')[:1]), 0),
+            total_available_kg=Coalesce(
+                Subquery(active.annotate(kg=Sum('quantity_available')).values('kg')[:1]),
+                Value(Decimal('0')),
+                output_field=DecimalField(max_digits=14, decimal_places=2),
+            ),
+            min_price_per_kg=_active_price(Min),
+            max_price_per_kg=_active_price(Max),
+        )
+        return Crop.objects.count()
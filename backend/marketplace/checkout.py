@@ -0,0 +1,124 @@
+"""
+Cart checkout - turn a buyer's cart into orders as one set-based pipeline.
+
+The number of queries does not grow with the cart:
+
+1. Load the buyer and the cart items (two SELECTs).
+2. Lock every listing in the cart in primary-key order (one SELECT ... FOR
+   UPDATE), then the buyer's live cart holds on them. The fixed lock order
+   (listings first, see marketplace.reservations) means checkouts and the
+   hold sweeper cannot deadlock each other.
+3. Take whatever the cart holds do not already cover with one conditional
+   UPDATE whose WHERE clause requires `quantity_available >= quantity` for
+   each row (reservations.take_stock). Overselling is therefore impossible
+   even where FOR UPDATE is a no-op (SQLite serialises writers instead).
+4. Insert all orders with one bulk INSERT.
+5. Move the cart holds onto the new orders with one UPDATE, and create
+   holds for items that had none, so unpaid orders give their stock back
+   when the order hold expires.
+6. Delete the cart.
+
+PRODUCTION NOTES:
+- On PostgreSQL step 2 takes row locks; the conditional UPDATE stays as a
+  second line of defence against writers that skip the lock
+- Payment is still a separate step (process_order_payment) per order
+"""
+
+from decimal import Decimal
+from typing import List, Tuple
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, UUIDField, Value, When
+from django.utils import timezone
+
+from .reservations import (
+    HELD, ReservationError, give_back_stock, lock_listings, order_expiry, take_stock,
+)
+
+
+class CheckoutError(Exception):
+    """Raised when the cart cannot be checked out as a whole."""
+
+
+def checkout_cart(buyer_id, delivery_address: str = '') -> Tuple[bool, object]:
+    """
+    Create one order per cart item and empty the cart.
+
+    Returns (True, orders) or (False, error message). Nothing is written
+    unless every item can be fulfilled.
+    """
+    try:
+        return True, _checkout(buyer_id, delivery_address)
+    except (CheckoutError, ReservationError) as exc:
+        return False, str(exc)
+
+
+def _checkout(buyer_id, delivery_address) -> List:
+    from core.models import User
+    from .cache import bump_version
+    from .models import CartItem, Order, Reservation
+
+    with transaction.atomic():
+        buyer = User.objects.only('pk', 'full_name').filter(pk=buyer_id).first()
+        if buyer is None:
+            raise CheckoutError('Buyer not found')
+        items = list(CartItem.objects.filter(buyer_id=buyer_id).values_list('pk', 'listing_id', 'quantity_kg'))
+        if not items:
+            raise CheckoutError('Cart is empty')
+        quantities = {listing_id: quantity for _, listing_id, quantity in items}
+
+        listings = lock_listings(quantities)
+        holds, held = {}, {}
+        for listing_id, pk, quantity in (
+            Reservation.objects.select_for_update()
+            .filter(buyer_id=buyer_id, listing_id__in=quantities, order__isnull=True, status=HELD)
+            .values_list('listing_id', 'pk', 'quantity_kg')
+        ):
+            holds[listing_id], held[listing_id] = pk, quantity
+
+        # Held stock is already out of quantity_available, so the listing
+        # may read as sold; only listings withdrawn by the farmer are refused
+        withdrawn = [listing.title for listing in listings
+                     if listing.status not in ('active', 'sold') and listing.pk in held]
+        if withdrawn:
+            raise CheckoutError('; '.join(f'{title}: no longer available' for title in withdrawn))
+        take_stock(listings, {
+            pk: quantity - held.get(pk, Decimal('0')) for pk, quantity in quantities.items()
+        })
+        give_back_stock(listings, {pk: quantity - quantities[pk] for pk, quantity in held.items()})
+
+        # listing and buyer are set as objects so serialising the orders needs no queries
+        orders = Order.objects.bulk_create([
+            Order(
+                listing=listing,
+                buyer=buyer,
+                quantity_kg=quantities[listing.pk],
+                price_per_kg=listing.price_per_kg,
+                total_price=quantities[listing.pk] * listing.price_per_kg,
+                delivery_address=delivery_address,
+            )
+            for listing in listings
+        ])
+
+        expires_at = order_expiry(timezone.now())
+        order_ids = {order.listing_id: order.pk for order in orders}
+        if holds:
+            Reservation.objects.filter(pk__in=holds.values()).update(
+                order_id=Case(*[When(listing_id=pk, then=Value(order_ids[pk])) for pk in holds],
+                              output_field=UUIDField()),
+                quantity_kg=Case(
+                    *[When(listing_id=pk, then=Value(quantities[pk])) for pk in holds],
+                    output_field=DecimalField(max_digits=10, decimal_places=2),
+                ),
+                expires_at=expires_at,
+            )
+        Reservation.objects.bulk_create([
+            Reservation(listing_id=order.listing_id, buyer=buyer, order=order,
+                        quantity_kg=order.quantity_kg, expires_at=expires_at)
+            for order in orders if order.listing_id not in holds
+        ])
+
+        CartItem.objects.filter(pk__in=[pk for pk, _, _ in items]).delete()
+        bump_version('listing')
+
+    return orders
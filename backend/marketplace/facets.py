@@ -0,0 +1,83 @@
+"""
+Faceted counts for marketplace browsing.
+
+facet_counts() returns the counts shown next to search results - by crop,
+price bucket, health badge and delivery availability - for whatever
+filtered Listing queryset it is given. Everything comes from one GROUP BY
+over (crop, price bucket, health badge, delivery) with the bucket and
+badge computed in SQL; each facet is then a marginal sum of that small
+result in Python. One query regardless of how many facets are shown.
+
+The health badge thresholds are shared with Listing.health_badge, so the
+facet counts always agree with the badges rendered on listings.
+"""
+
+from decimal import Decimal
+from typing import Any, Dict
+
+from django.db.models import Case, CharField, Count, F, Value, When
+
+from .models import HEALTH_BADGES
+
+# (label, lower bound inclusive, upper bound exclusive) in KES per kg
+PRICE_BUCKETS = [
+    ('0-25', None, Decimal('25')),
+    ('25-50', Decimal('25'), Decimal('50')),
+    ('50-100', Decimal('50'), Decimal('100')),
+    ('100-200', Decimal('100'), Decimal('200')),
+    ('200+', Decimal('200'), None),
+]
+
+UNASSESSED = 'Unassessed'
+
+
+def _price_bucket():
+    whens = [
+        When(price_per_kg__lt=upper, then=Value(label))
+        for label, _, upper in PRICE_BUCKETS if upper is not None
+    ]
+    return Case(*whens, default=Value(PRICE_BUCKETS[-1][0]), output_field=CharField())
+
+
+def _health_badge():
+    whens = [When(assessment__isnull=True, then=Value(UNASSESSED))]
+    whens += [
+        When(assessment__health_score__gte=threshold, then=Value(label))
+        for threshold, label, _ in HEALTH_BADGES[:-1]
+    ]
+    return Case(*whens, default=Value(HEALTH_BADGES[-1][1]), output_field=CharField())
+
+
+def facet_counts(queryset) -> Dict[str, Any]:
+    """Compute every facet for `queryset` in a single aggregate query."""
+    cells = queryset.order_by().values(
+        crop_slug=F('crop_id'), crop_name=F('crop__name'),
+        price_bucket=_price_bucket(), health=_health_badge(), delivery=F('delivery_available'),
+    ).annotate(count=Count('pk'))
+
+    crops, prices, badges, delivery = {}, {}, {}, {}
+    total = 0
+    for cell in cells:
+        count = cell['count']
+        total += count
+        crop = crops.setdefault(cell['crop_slug'], {'value': cell['crop_slug'], 'label': cell['crop_name'], 'count': 0})
+        crop['count'] += count
+        prices[cell['price_bucket']] = prices.get(cell['price_bucket'], 0) + count
+        badges[cell['health']] = badges.get(cell['health'], 0) + count
+        delivery[cell['delivery']] = delivery.get(cell['delivery'], 0) + count
+
+    return {
+        'total': total,
+        'crop_type': sorted(crops.values(), key=lambda crop: (-crop['count'], crop['label'] or '')),
+        'price_per_kg': [
+            {'value': label, 'min': lower, 'max': upper, 'count': prices.get(label, 0)}
+            for label, lower, upper in PRICE_BUCKETS
+        ],
+        'health_badge': [
+            {'value': label, 'color': color, 'count': badges.get(label, 0)}
+            for _, label, color in HEALTH_BADGES
+        ] + [{'value': UNASSESSED, 'color': None, 'count': badges.get(UNASSESSED, 0)}],
+        'delivery_available': [
+            {'value': value, 'count': delivery.get(value, 0)} for value in (True, False)
+        ],
+    }
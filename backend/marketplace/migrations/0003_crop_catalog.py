@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crops', '0002_keyset_pagination_indexes'),
+        ('marketplace', '0002_keyset_pagination_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Crop',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.SlugField(max_length=100, unique=True)),
+                ('name', models.CharField(max_length=100)),
+                ('active_listings', models.PositiveIntegerField(default=0)),
+                ('total_available_kg', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('min_price_per_kg', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('max_price_per_kg', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='crop',
+            field=models.ForeignKey(blank=True, db_column='crop_slug', editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='listings', to='marketplace.crop', to_field='slug'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['crop', 'status', '-created_at', '-id'], name='mkt_listing_crop_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:28
+
+from decimal import Decimal
+
+from django.db import migrations
+from django.db.models import Count, Max, Min, Sum
+from django.utils.text import slugify
+
+
+def populate_catalog(apps, schema_editor):
+    Crop = apps.get_model('marketplace', 'Crop')
+    Listing = apps.get_model('marketplace', 'Listing')
+
+    for crop_type in Listing.objects.values_list('crop_type', flat=True).distinct():
+        name = ' '.join(crop_type.split())
+        slug = slugify(name)
+        if not slug:
+            continue
+        Crop.objects.get_or_create(slug=slug, defaults={'name': name.title()})
+        Listing.objects.filter(crop_type=crop_type).update(crop_id=slug)
+
+    totals = Listing.objects.filter(status='active', crop__isnull=False).values('crop_id').annotate(
+        count=Count('pk'), kg=Sum('quantity_available'),
+        low=Min('price_per_kg'), high=Max('price_per_kg'),
+    )
+    for row in totals:
+        Crop.objects.filter(slug=row['crop_id']).update(
+            active_listings=row['count'], total_available_kg=row['kg'] or Decimal('0'),
+            min_price_per_kg=row['low'], max_price_per_kg=row['high'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0003_crop_catalog'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_catalog, migrations.RunPython.noop),
+    ]
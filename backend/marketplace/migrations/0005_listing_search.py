@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from marketplace.search import PG_SEARCH_COLUMNS, pg_vector_sql
+
+FTS_TABLE = 'marketplace_listing_fts'
+
+PG_INDEX = 'mkt_listing_search_idx'
+# Shared with the search query, which must match this expression to use the index
+PG_VECTOR = pg_vector_sql([column for column, _ in PG_SEARCH_COLUMNS])
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+            "title, description, crop_type, "
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+        Listing = apps.get_model('marketplace', 'Listing')
+        ListingSearchRow = apps.get_model('marketplace', 'ListingSearchRow')
+        ListingSearchRow.objects.bulk_create(
+            [ListingSearchRow(listing_id=pk) for pk in Listing.objects.values_list('pk', flat=True)],
+            batch_size=1000,
+        )
+        schema_editor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, title, description, crop_type) "
+            "SELECT r.id, l.title, l.description, l.crop_type "
+            "FROM marketplace_listingsearchrow r JOIN marketplace_listing l ON l.id = r.listing_id"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(f"CREATE INDEX {PG_INDEX} ON marketplace_listing USING GIN (({PG_VECTOR}))")
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif vendor == 'postgresql':
+        schema_editor.execute(f"DROP INDEX IF EXISTS {PG_INDEX}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0004_populate_crop_catalog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingSearchRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('listing', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='search_row', to='marketplace.listing')),
+            ],
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+from core.geo import point_fields
+
+
+def locate_listings(apps, schema_editor):
+    User = apps.get_model('core', 'User')
+    Listing = apps.get_model('marketplace', 'Listing')
+    farmers = User.objects.filter(latitude__isnull=False, longitude__isnull=False, listings__isnull=False)
+    for farmer in farmers.distinct().only('pk', 'latitude', 'longitude').iterator():
+        Listing.objects.filter(farmer_id=farmer.pk).update(**point_fields((farmer.latitude, farmer.longitude)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_user_coordinates'),
+        ('crops', '0002_keyset_pagination_indexes'),
+        ('marketplace', '0005_listing_search'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='geohash',
+            field=models.CharField(blank=True, editable=False, max_length=12),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='latitude',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='longitude',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['geohash', 'status'], name='mkt_listing_geohash_idx'),
+        ),
+        migrations.RunPython(locate_listings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:48
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crops', '0002_keyset_pagination_indexes'),
+        ('marketplace', '0006_listing_geohash'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('status', 'active')), fields=['-created_at', '-id'], name='mkt_listing_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('featured', True), ('status', 'active')), fields=['-created_at'], name='mkt_listing_featured_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['buyer', 'status', '-created_at'], name='mkt_order_buyer_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['listing', 'status'], name='mkt_order_listing_status_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:22
+
+import django.db.models.deletion
+import marketplace.search
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0009_order_dispatched_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingSearchDocument',
+            fields=[
+                ('row', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='document', serialize=False, to='marketplace.listingsearchrow')),
+                ('title', models.TextField()),
+                ('description', models.TextField()),
+                ('crop_type', models.TextField()),
+                ('fts', marketplace.search.FullTextColumn(db_column='marketplace_listing_fts')),
+            ],
+            options={
+                'db_table': 'marketplace_listing_fts',
+                'managed': False,
+            },
+        ),
+    ]
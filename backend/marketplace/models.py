@@ -7,10 +7,48 @@ PRODUCTION NOTES:
 - Auto-deduction from sales supports loan repayment
 """
 
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 import uuid
 
+from core.state_machine import StateMachine, Transition
+
+from .search import FTS_TABLE, FullTextColumn
+
+
+# (minimum health score, label, color), best first; shared with marketplace.facets
+HEALTH_BADGES = [
+    (0.8, 'Excellent', 'success'),
+    (0.6, 'Good', 'info'),
+    (0.4, 'Fair', 'warning'),
+    (float('-inf'), 'Poor', 'error'),
+]
+
+
+class Crop(models.Model):
+    """
+    Crop catalog entry with live aggregates over its active listings.
+    
+    Maintained incrementally by marketplace.catalog whenever a listing is
+    saved or deleted, so the crop dropdown and crop filters never scan the
+    listings table. `rebuild_crop_catalog` recomputes it from scratch.
+    """
+    slug = models.SlugField(max_length=100, unique=True)
+    name = models.CharField(max_length=100)
+    
+    active_listings = models.PositiveIntegerField(default=0)
+    total_available_kg = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    min_price_per_kg = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    max_price_per_kg = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name} ({self.active_listings} active)"
+    
+    class Meta:
+        ordering = ['name']
+
 
 class Listing(models.Model):
     """
@@ -36,6 +74,17 @@ class Listing(models.Model):
     title = models.CharField(max_length=200)
     description = models.TextField()
     crop_type = models.CharField(max_length=100)
+    # Normalized catalog entry for crop_type, set on save
+    crop = models.ForeignKey(
+        Crop,
+        to_field='slug',
+        db_column='crop_slug',
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='listings'
+    )
     
     # Quantity and pricing
     quantity_kg = models.DecimalField(max_digits=10, decimal_places=2)
@@ -47,6 +96,11 @@ class Listing(models.Model):
     delivery_available = models.BooleanField(default=True)
     delivery_radius_km = models.IntegerField(default=50)
     
+    # Farm coordinates, copied from the farmer (see core.geo)
+    latitude = models.FloatField(null=True, blank=True, editable=False)
+    longitude = models.FloatField(null=True, blank=True, editable=False)
+    geohash = models.CharField(max_length=12, blank=True, editable=False)
+    
     # AI assessment summary (linked from latest assessment)
     assessment = models.ForeignKey(
         'crops.CropAssessment',
@@ -69,6 +123,42 @@ class Listing(models.Model):
     def __str__(self):
         return f"{self.title} by {self.farmer.full_name}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the indexed text, so saves that leave it unchanged skip reindexing
+        from .search import search_text
+        instance._search_text = None if instance.get_deferred_fields() else search_text(instance)
+        return instance
+    
+    def save(self, *args, **kwargs):
+        """Save and apply this listing's change to the crop catalog and search index atomically."""
+        from .catalog import apply_change, ensure_crop, saved_state, stored_state
+        from .search import index_listing, search_text
+        
+        update_fields = kwargs.get('update_fields')
+        if self._state.adding and not self.geohash:
+            self.set_coordinates(self.farmer.coordinates)
+        with transaction.atomic():
+            # The stored row, not the instance as loaded: stock may have moved since
+            old = None if self._state.adding else stored_state(self.pk, lock=True)
+            if update_fields is None or 'crop_type' in update_fields:
+                self.crop_id = ensure_crop(self.crop_type, current=self.crop_id)
+                if update_fields is not None:
+                    kwargs['update_fields'] = {*update_fields, 'crop'}
+            super().save(*args, **kwargs)
+            apply_change(old, saved_state(self, old, kwargs.get('update_fields')))
+            
+            text = search_text(self)
+            if text != getattr(self, '_search_text', None):
+                index_listing(self)
+                self._search_text = text
+    
+    def set_coordinates(self, coordinates):
+        from core.geo import point_fields
+        for name, value in point_fields(coordinates).items():
+            setattr(self, name, value)
+    
     @property
     def total_value(self):
         return self.quantity_available * self.price_per_kg
@@ -78,18 +168,63 @@ class Listing(models.Model):
         """Return health assessment for display."""
         if self.assessment:
             score = float(self.assessment.health_score)
-            if score >= 0.8:
-                return {'label': 'Excellent', 'color': 'success'}
-            elif score >= 0.6:
-                return {'label': 'Good', 'color': 'info'}
-            elif score >= 0.4:
-                return {'label': 'Fair', 'color': 'warning'}
-            else:
-                return {'label': 'Poor', 'color': 'error'}
+            for threshold, label, color in HEALTH_BADGES:
+                if score >= threshold:
+                    return {'label': label, 'color': color}
         return None
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination key (see core.pagination)
+            models.Index(fields=['-created_at', '-id'], name='mkt_listing_created_idx'),
+            # Crop filter: equality on the normalized slug, then the page key
+            models.Index(fields=['crop', 'status', '-created_at', '-id'], name='mkt_listing_crop_idx'),
+            # Radius / nearest queries: one range scan per geohash cell (geohash
+            # leads so the planner picks the ranges without ANALYZE stats)
+            models.Index(fields=['geohash', 'status'], name='mkt_listing_geohash_idx'),
+            # Hot filter paths (see benchmark_indexes). Partial indexes only
+            # cover active listings and are skipped where unsupported.
+            # status + crop + price filters use mkt_listing_crop_idx, which
+            # also yields rows in page order; a price-leading index measured
+            # slower because every match then has to be sorted.
+            models.Index(fields=['-created_at', '-id'], condition=models.Q(status='active'),
+                         name='mkt_listing_active_idx'),
+            models.Index(fields=['-created_at'], condition=models.Q(status='active', featured=True),
+                         name='mkt_listing_featured_idx'),
+        ]
+
+
+class ListingSearchRow(models.Model):
+    """
+    Stable integer key for a listing's row in the full-text index.
+    
+    The FTS5 table (see marketplace.search) is addressed by rowid; this
+    maps it to the listing's UUID so reindexing a listing is a keyed
+    update instead of a scan.
+    """
+    listing = models.OneToOneField(Listing, on_delete=models.CASCADE, related_name='search_row')
+    
+    def __str__(self):
+        return f"Search row {self.pk} for {self.listing_id}"
+
+
+class ListingSearchDocument(models.Model):
+    """
+    A row of the FTS5 index (SQLite only), for joining searches onto
+    listings. Unmanaged: migration 0005 creates the virtual table and
+    marketplace.search writes it.
+    """
+    row = models.OneToOneField(ListingSearchRow, primary_key=True, db_column='rowid', on_delete=models.DO_NOTHING,
+                               db_constraint=False, related_name='document')
+    title = models.TextField()
+    description = models.TextField()
+    crop_type = models.TextField()
+    fts = FullTextColumn(db_column=FTS_TABLE)
+    
+    class Meta:
+        managed = False
+        db_table = FTS_TABLE
 
 
 class Order(models.Model):
@@ -121,6 +256,18 @@ class Order(models.Model):
         ('cancelled', 'Cancelled'),
     ]
     
+    # Every status change goes through these (see core.state_machine)
+    states = StateMachine({
+        'pay': Transition(['pending_payment'], 'escrow_held', timestamp='payment_at'),
+        'cancel': Transition(['pending_payment'], 'cancelled'),
+        'dispatch': Transition(['escrow_held'], 'dispatched', timestamp='dispatched_at'),
+        'receive': Transition(['dispatched'], 'received', timestamp='received_at'),
+        # From dispatched too: batch settlement and auto-release skip the receipt step
+        'complete': Transition(['dispatched', 'received'], 'completed', timestamp='completed_at'),
+        'dispute': Transition(['escrow_held', 'dispatched'], 'disputed'),
+        'refund': Transition(['escrow_held', 'dispatched', 'disputed'], 'refunded'),
+    })
+    
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     listing = models.ForeignKey(Listing, on_delete=models.PROTECT, related_name='orders')
     buyer = models.ForeignKey(
@@ -169,6 +316,15 @@ class Order(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination key (see core.pagination)
+            models.Index(fields=['-created_at', '-id'], name='mkt_order_created_idx'),
+            # Buyer order history and farmer sales (joined through listing)
+            models.Index(fields=['buyer', 'status', '-created_at'], name='mkt_order_buyer_status_idx'),
+            models.Index(fields=['listing', 'status'], name='mkt_order_listing_status_idx'),
+            # Auto-release scan for overdue dispatched orders (marketplace.auto_release)
+            models.Index(fields=['status', 'dispatched_at'], name='mkt_order_dispatched_idx'),
+        ]
 
 
 class CartItem(models.Model):
@@ -196,3 +352,57 @@ class CartItem(models.Model):
     
     class Meta:
         unique_together = ['buyer', 'listing']
+
+
+class Reservation(models.Model):
+    """
+    Time-limited hold on listing stock for a cart item or a pending order.
+    
+    Holding takes the quantity out of Listing.quantity_available straight
+    away (see marketplace.reservations), so availability checks never sum
+    holds. Paying commits the hold; the sweeper gives expired holds back.
+    
+    A cart hold has no order and is keyed by (buyer, listing), like
+    CartItem. Checkout moves it onto the order it creates.
+    """
+    STATUS_CHOICES = [
+        ('held', 'Held'),
+        ('committed', 'Committed'),
+        ('released', 'Released'),
+        ('expired', 'Expired'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='reservations')
+    buyer = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='reservations'
+    )
+    order = models.OneToOneField(
+        Order, on_delete=models.CASCADE, null=True, blank=True, related_name='reservation'
+    )
+    
+    quantity_kg = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='held')
+    expires_at = models.DateTimeField()
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Hold {self.quantity_kg}kg of {self.listing_id} ({self.status})"
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # Sweeper: oldest live holds first
+            models.Index(fields=['expires_at'], name='mkt_hold_expiry_idx',
+                         condition=models.Q(status='held')),
+        ]
+        constraints = [
+            # One live cart hold per buyer and listing
+            models.UniqueConstraint(
+                fields=['buyer', 'listing'], name='mkt_hold_one_cart_hold',
+                condition=models.Q(status='held', order__isnull=True),
+            ),
+        ]
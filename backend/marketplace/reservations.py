@@ -0,0 +1,272 @@
+"""
+Inventory reservations - time-limited stock holds for carts and orders.
+
+A hold takes its quantity out of Listing.quantity_available as soon as it
+is placed, so "is there enough stock?" stays a single-row check instead of
+a SUM over live holds. Hot listings therefore cost the same to reserve
+against no matter how many buyers hold part of them:
+
+- placing a hold locks the listing row, runs one conditional UPDATE
+  (`quantity_available >= quantity`) and writes the Reservation row
+- paying for an order commits its hold; the stock stays taken
+- releasing a hold (cart item removed, or expired) adds the quantity back
+
+Expired holds are given back in bulk by release_expired(), run from
+`python manage.py release_expired_holds`. Pending orders whose hold
+expires are cancelled.
+
+Listings are always locked in primary-key order, then their reservations,
+then their orders - here, in cart checkout and when an order is paid - so
+concurrent holds, checkouts, payments and sweeps cannot deadlock. Listing rows change via queryset.update(), so
+the crop catalog and listing cache version are maintained explicitly.
+
+PRODUCTION NOTES:
+- Run the sweeper every minute; each batch is one short transaction
+- On PostgreSQL the listing lock is a row lock (SELECT ... FOR UPDATE);
+  SQLite serialises writers, and the conditional UPDATE guards both
+"""
+
+from datetime import timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Q, Value, When
+from django.utils import timezone
+
+HELD = 'held'
+COMMITTED = 'committed'
+RELEASED = 'released'
+EXPIRED = 'expired'
+
+
+class ReservationError(Exception):
+    """Base error for holds that cannot be placed."""
+
+
+class OutOfStock(ReservationError):
+    """Raised when a listing no longer has enough stock for a hold."""
+
+
+def cart_expiry(now=None):
+    return (now or timezone.now()) + timedelta(minutes=settings.MARKETPLACE_CART_HOLD_MINUTES)
+
+
+def order_expiry(now=None):
+    return (now or timezone.now()) + timedelta(minutes=settings.MARKETPLACE_ORDER_HOLD_MINUTES)
+
+
+def lock_listings(listing_ids: Iterable) -> List:
+    """Lock and load `listing_ids` in primary-key order (one query)."""
+    from .models import Listing
+
+    return list(
+        Listing.objects.select_for_update(of=('self',))
+        .select_related('farmer')
+        .filter(pk__in=list(listing_ids))
+        .order_by('pk')
+    )
+
+
+def _per_listing(quantities, then):
+    """CASE id WHEN ... THEN then(quantity) ... ELSE default END over `quantities`."""
+    whens = [When(pk=pk, then=then(quantity)) for pk, quantity in quantities.items()]
+    return Case(*whens, default=F('quantity_available'),
+                output_field=DecimalField(max_digits=10, decimal_places=2))
+
+
+def _adjust_stock(listings, deltas: Dict, now) -> None:
+    """
+    Mirror a stock UPDATE on the locked `listings` and apply the matching
+    crop catalog change in one batch.
+    """
+    from .catalog import apply_changes, catalog_state
+
+    changes = []
+    for listing in listings:
+        if listing.pk not in deltas:
+            continue
+        old = catalog_state(listing)
+        listing.quantity_available += deltas[listing.pk]
+        if listing.quantity_available <= 0:
+            listing.status = 'sold'
+        elif listing.status == 'sold':
+            listing.status = 'active'
+        listing.updated_at = now
+        changes.append((old, catalog_state(listing)))
+    apply_changes(changes)
+
+
+def take_stock(listings, quantities: Dict) -> None:
+    """
+    Take `quantities` (listing id -> kg) out of the locked `listings` with
+    one conditional UPDATE. Raises OutOfStock, naming every listing that
+    falls short, if any of them cannot cover its quantity.
+    """
+    from .models import Listing
+
+    quantities = {pk: quantity for pk, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return
+    by_pk = {listing.pk: listing for listing in listings}
+    problems = []
+    for pk, quantity in quantities.items():
+        listing = by_pk.get(pk)
+        if listing is None or listing.status != 'active':
+            problems.append(f'{listing.title if listing else pk}: no longer available')
+        elif listing.quantity_available < quantity:
+            problems.append(f'{listing.title}: only {listing.quantity_available}kg available')
+    if problems:
+        raise OutOfStock('; '.join(problems))
+
+    now = timezone.now()
+    guard = Q(pk__in=[])
+    for pk, quantity in quantities.items():
+        guard |= Q(pk=pk, status='active', quantity_available__gte=quantity)
+    updated = Listing.objects.filter(guard).update(
+        quantity_available=_per_listing(quantities, lambda quantity: F('quantity_available') - quantity),
+        status=Case(
+            *[When(pk=pk, quantity_available__lte=quantity, then=Value('sold'))
+              for pk, quantity in quantities.items()],
+            default=F('status'),
+        ),
+        updated_at=now,
+    )
+    if updated != len(quantities):
+        raise OutOfStock('Stock changed while reserving, please try again')
+    _adjust_stock(listings, {pk: -quantity for pk, quantity in quantities.items()}, now)
+
+
+def give_back_stock(listings, quantities: Dict) -> None:
+    """Return `quantities` to the locked `listings`; sold-out listings become active again."""
+    from .models import Listing
+
+    quantities = {pk: quantity for pk, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return
+    now = timezone.now()
+    Listing.objects.filter(pk__in=quantities).update(
+        quantity_available=_per_listing(quantities, lambda quantity: F('quantity_available') + quantity),
+        status=Case(When(status='sold', then=Value('active')), default=F('status')),
+        updated_at=now,
+    )
+    _adjust_stock(listings, quantities, now)
+
+
+def hold_cart(buyer_id, listing_id, quantity) -> None:
+    """
+    Make the buyer's cart hold on `listing_id` exactly `quantity` kg and
+    restart its timer. Only the difference from the current hold is taken
+    or given back. Raises OutOfStock.
+    """
+    from .cache import bump_version
+    from .models import Reservation
+
+    with transaction.atomic():
+        listings = lock_listings([listing_id])
+        hold = (Reservation.objects.select_for_update()
+                .filter(buyer_id=buyer_id, listing_id=listing_id, order__isnull=True, status=HELD)
+                .first())
+        held = hold.quantity_kg if hold else Decimal('0')
+        if quantity > held:
+            take_stock(listings, {listing_id: quantity - held})
+        else:
+            give_back_stock(listings, {listing_id: held - quantity})
+
+        if hold is None:
+            Reservation.objects.create(buyer_id=buyer_id, listing_id=listing_id,
+                                       quantity_kg=quantity, expires_at=cart_expiry())
+        else:
+            Reservation.objects.filter(pk=hold.pk).update(quantity_kg=quantity, expires_at=cart_expiry())
+        bump_version('listing')
+
+
+def release_cart(buyer_id, listing_ids: Iterable) -> None:
+    """Give back the buyer's cart holds on `listing_ids` (items removed from the cart)."""
+    _release(Q(buyer_id=buyer_id, listing_id__in=list(listing_ids), order__isnull=True), RELEASED)
+
+
+def hold_order(order) -> None:
+    """Hold stock for a new pending order. Raises OutOfStock."""
+    from .cache import bump_version
+    from .models import Reservation
+
+    with transaction.atomic():
+        take_stock(lock_listings([order.listing_id]), {order.listing_id: order.quantity_kg})
+        Reservation.objects.create(buyer_id=order.buyer_id, listing_id=order.listing_id, order=order,
+                                   quantity_kg=order.quantity_kg, expires_at=order_expiry())
+        bump_version('listing')
+
+
+def commit_order(order) -> None:
+    """
+    Make the order's hold permanent; call it before the order is paid, in
+    the payment's transaction. An order whose hold already lapsed takes
+    its stock again if there still is some. Raises OutOfStock, or
+    ReservationError if the order is no longer awaiting payment.
+    """
+    from .cache import bump_version
+    from .models import Order, Reservation
+
+    with transaction.atomic():
+        # Listing, then hold, then order: the same order release_expired() locks in
+        listings = lock_listings([order.listing_id])
+        if Reservation.objects.filter(order=order, status=HELD).update(status=COMMITTED):
+            return
+        status = Order.objects.filter(pk=order.pk).values_list('status', flat=True).first()
+        if status == 'cancelled':
+            raise ReservationError('Order was cancelled when its hold expired')
+        if status != 'pending_payment':
+            raise ReservationError(f'Cannot pay for order in {status} status')
+        take_stock(listings, {order.listing_id: order.quantity_kg})
+        Reservation.objects.update_or_create(order=order, defaults={
+            'buyer_id': order.buyer_id, 'listing_id': order.listing_id,
+            'quantity_kg': order.quantity_kg, 'status': COMMITTED, 'expires_at': timezone.now(),
+        })
+        bump_version('listing')
+
+
+def release_expired(now=None, limit: int = 1000) -> int:
+    """
+    Give back up to about `limit` holds that expired by `now` and cancel
+    their pending orders. Returns how many holds were released; call
+    again until it returns 0.
+    """
+    now = now or timezone.now()
+    return _release(Q(expires_at__lte=now), EXPIRED, limit=limit)
+
+
+def _release(condition: Q, status: str, limit: int = None) -> int:
+    """
+    Release the live holds matching `condition`: lock their listings, then
+    the holds, mark them `status` and give the stock back in one UPDATE.
+    """
+    from .cache import bump_version
+    from .models import Order, Reservation
+
+    live = Reservation.objects.filter(condition, status=HELD)
+    with transaction.atomic():
+        candidates = live.order_by('expires_at').values_list('listing_id', flat=True)
+        listing_ids = set(candidates[:limit] if limit else candidates)
+        if not listing_ids:
+            return 0
+        listings = lock_listings(listing_ids)
+        holds: List[Tuple] = list(
+            live.select_for_update().filter(listing_id__in=listing_ids)
+            .values_list('pk', 'listing_id', 'quantity_kg', 'order_id')
+        )
+        if not holds:
+            return 0
+
+        Reservation.objects.filter(pk__in=[pk for pk, _, _, _ in holds]).update(status=status)
+        quantities: Dict = {}
+        for _, listing_id, quantity, _ in holds:
+            quantities[listing_id] = quantities.get(listing_id, Decimal('0')) + quantity
+        give_back_stock(listings, quantities)
+
+        order_ids = [order_id for _, _, _, order_id in holds if order_id]
+        if order_ids:
+            Order.states.apply(Order.objects.filter(pk__in=order_ids), 'cancel')
+        bump_version('listing')
+    return len(holds)
@@ -0,0 +1,202 @@
+"""
+Full-text search over marketplace listings.
+
+Listings are searchable by title, crop type and description, ranked by
+relevance (title matches weigh most). The last word of a query also
+matches as a prefix, so "swee pot" finds "Sweet Potatoes" while typing.
+
+Backends, picked from the database vendor:
+- SQLite: an FTS5 table (marketplace_listing_fts) with prefix indexes,
+  kept in sync by index_listing()/remove_row() from marketplace.signals
+  inside the listing's own transaction. FTS rows are keyed by
+  ListingSearchRow.id, so updates and deletes are rowid lookups rather
+  than scans. Queries join it as the unmanaged ListingSearchDocument
+  model and rank with bm25().
+- PostgreSQL: a weighted tsvector expression (pg_vector_sql) matched by
+  a GIN index on the same expression (migration 0005), so there is
+  nothing to keep in sync. Ranked with ts_rank.
+- Anything else: unranked icontains matching on every word.
+
+search_listings() takes an already-filtered Listing queryset, so price,
+status and crop filters are applied in the same SQL statement as the match.
+
+PRODUCTION NOTES:
+- Code that bulk-updates title/description/crop_type with
+  queryset.update() must call index_listing() or run rebuild_search_index
+- FTS5 match + bm25 stays in the low milliseconds at 1M rows for selective
+  queries; very common single prefixes ("a*") are what to watch
+"""
+
+import re
+from typing import List
+
+from django.db import connection, models, transaction
+from django.db.models import F, FloatField, Func, Lookup, Q, Value
+
+FTS_TABLE = 'marketplace_listing_fts'
+ROW_TABLE = 'marketplace_listingsearchrow'
+
+# Column weights: title, description, crop_type
+FTS_WEIGHTS = (10.0, 1.0, 5.0)
+
+# Shortest final word that is expanded as a prefix
+MIN_PREFIX_LENGTH = 2
+
+# Postgres: text search config and (column, weight) of the indexed tsvector
+PG_SEARCH_CONFIG = 'simple'
+PG_SEARCH_COLUMNS = (('title', 'A'), ('crop_type', 'B'), ('description', 'C'))
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query: str) -> List[str]:
+    return [word.lower() for word in _WORD_RE.findall(query or '')]
+
+
+def _uses_fts5() -> bool:
+    return connection.vendor == 'sqlite'
+
+
+def _fts_match(words: List[str], prefix: bool) -> str:
+    """Build an FTS5 MATCH expression; every word is quoted so user input is never parsed as syntax."""
+    terms = [f'"{word}"' for word in words]
+    if prefix and len(words[-1]) >= MIN_PREFIX_LENGTH:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def _pg_tsquery(words: List[str], prefix: bool) -> str:
+    terms = [f"'{word}'" for word in words]
+    if prefix and len(words[-1]) >= MIN_PREFIX_LENGTH:
+        terms[-1] += ':*'
+    return ' & '.join(terms)
+
+
+def pg_vector_sql(columns) -> str:
+    """
+    The weighted tsvector over `columns` (SQL for each of PG_SEARCH_COLUMNS).
+    The GIN index in migration 0005 is built from this same text, so the
+    query expression stays identical to the indexed one.
+    """
+    return ' || '.join(
+        f"setweight(to_tsvector('{PG_SEARCH_CONFIG}', coalesce({column}, '')), '{weight}')"
+        for column, (_, weight) in zip(columns, PG_SEARCH_COLUMNS)
+    )
+
+
+class ListingSearchVector(Func):
+    """pg_vector_sql() over the listing's columns, as a query expression."""
+
+    def __init__(self, output_field):
+        super().__init__(*(F(column) for column, _ in PG_SEARCH_COLUMNS), output_field=output_field)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        columns, params = [], []
+        for expression in self.get_source_expressions():
+            sql, expression_params = compiler.compile(expression)
+            columns.append(sql)
+            params.extend(expression_params)
+        return f'({pg_vector_sql(columns)})', params
+
+
+class FullTextColumn(models.TextField):
+    """An FTS5 table's hidden column (named after the table): the left side of MATCH and bm25()."""
+
+
+@FullTextColumn.register_lookup
+class FullTextMatch(Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', (*lhs_params, *rhs_params)
+
+
+class BM25(Func):
+    """bm25() of the matched FTS5 row, negated: it is lower-is-better, and every backend ranks descending."""
+    function = 'bm25'
+    template = '-%(function)s(%(expressions)s)'
+    output_field = FloatField()
+
+
+def search_listings(queryset, query: str, prefix: bool = True):
+    """
+    Restrict `queryset` to listings matching `query`, best match first.
+
+    Matching rows are annotated with `search_rank` (higher is better on
+    every backend). An empty query matches nothing.
+    """
+    words = tokenize(query)
+    if not words:
+        return queryset.none()
+
+    if _uses_fts5():
+        # Joined through ListingSearchRow to the FTS5 table's rows
+        # (ListingSearchDocument), so the match is evaluated once
+        return queryset.filter(search_row__document__fts__match=_fts_match(words, prefix)).annotate(
+            search_rank=BM25(F('search_row__document__fts'), *(Value(weight) for weight in FTS_WEIGHTS))
+        ).order_by('-search_rank', '-created_at')
+
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField
+
+        vector = ListingSearchVector(output_field=SearchVectorField())
+        search_query = SearchQuery(_pg_tsquery(words, prefix), search_type='raw', config=PG_SEARCH_CONFIG)
+        return queryset.alias(search_vector=vector).filter(search_vector=search_query).annotate(
+            search_rank=SearchRank(vector, search_query)
+        ).order_by('-search_rank', '-created_at')
+
+    for word in words:
+        queryset = queryset.filter(
+            Q(title__icontains=word) | Q(crop_type__icontains=word) | Q(description__icontains=word)
+        )
+    return queryset.annotate(search_rank=Value(0.0))
+
+
+def search_text(listing):
+    """The indexed text of `listing`; a save that leaves it unchanged skips reindexing."""
+    return (listing.title, listing.description, listing.crop_type)
+
+
+def index_listing(listing):
+    """Insert or refresh `listing`'s row in the FTS5 index."""
+    if not _uses_fts5():
+        return
+    from .models import ListingSearchRow
+    row, created = ListingSearchRow.objects.get_or_create(listing_id=listing.pk)
+    with connection.cursor() as cursor:
+        if not created:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [row.pk])
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, title, description, crop_type) VALUES (%s, %s, %s, %s)',
+            [row.pk, *search_text(listing)]
+        )
+
+
+def remove_row(row_id):
+    """Drop an FTS5 row (called when its ListingSearchRow is deleted)."""
+    if not _uses_fts5():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [row_id])
+
+
+def rebuild_index() -> int:
+    """Repopulate the FTS5 index from the listings table. Returns rows indexed."""
+    if not _uses_fts5():
+        return 0
+    from .models import Listing, ListingSearchRow
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        ListingSearchRow.objects.bulk_create(
+            [ListingSearchRow(listing_id=pk) for pk in
+             Listing.objects.filter(search_row__isnull=True).values_list('pk', flat=True).iterator()],
+            batch_size=1000,
+        )
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, title, description, crop_type) '
+            f'SELECT r.id, l.title, l.description, l.crop_type '
+            f'FROM {ROW_TABLE} r JOIN marketplace_listing l ON l.id = r.listing_id'
+        )
+        return cursor.rowcount
@@ -2,14 +2,25 @@
 Marketplace serializers - Listings, Orders, and Cart.
 """
 
+from django.conf import settings
 from rest_framework import serializers
-from .models import Listing, Order, CartItem
+from core.fieldsets import SparseFieldsMixin
+from .models import Crop, Listing, Order, CartItem
 from crops.serializers import CropAssessmentSerializer
 
 
-class ListingSerializer(serializers.ModelSerializer):
+class CropSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Crop
+        fields = ['slug', 'name', 'active_listings', 'total_available_kg',
+                  'min_price_per_kg', 'max_price_per_kg', 'updated_at']
+        read_only_fields = fields
+
+
+class ListingSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     farmer_name = serializers.CharField(source='farmer.full_name', read_only=True)
     farmer_location = serializers.CharField(source='farmer.location', read_only=True)
+    crop = serializers.CharField(source='crop_id', read_only=True)
     health_badge = serializers.DictField(read_only=True)
     total_value = serializers.DecimalField(max_digits=15, decimal_places=2, read_only=True)
     assessment = CropAssessmentSerializer(read_only=True)
@@ -17,13 +28,20 @@ class ListingSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Listing
-        fields = ['id', 'farmer', 'farmer_name', 'farmer_location', 'farm', 
-                  'title', 'description', 'crop_type', 'quantity_kg', 'quantity_available',
+        fields = ['id', 'farmer', 'farmer_name', 'farmer_location',
+                  'title', 'description', 'crop_type', 'crop', 'quantity_kg', 'quantity_available',
                   'price_per_kg', 'total_value', 'expected_harvest_date', 
-                  'delivery_available', 'delivery_radius_km', 'assessment', 'health_badge',
+                  'delivery_available', 'delivery_radius_km', 'latitude', 'longitude',
+                  'assessment', 'health_badge',
                   'status', 'featured', 'cover_image', 'cover_image_url',
                   'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
+        select_related_fields = {
+            'farmer_name': ['farmer'],
+            'farmer_location': ['farmer'],
+            'assessment': ['assessment__farmer'],
+            'health_badge': ['assessment'],
+        }
     
     def get_cover_image_url(self, obj):
         if obj.cover_image:
@@ -31,13 +49,6 @@ class ListingSerializer(serializers.ModelSerializer):
             if request:
                 return request.build_absolute_uri(obj.cover_image.url)
             return obj.cover_image.url
-        # Fallback to first farm image
-        if obj.farm and obj.farm.images.exists():
-            first_image = obj.farm.images.first()
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(first_image.image.url)
-            return first_image.image.url
         return None
 
 
@@ -46,23 +57,29 @@ class ListingCreateSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Listing
-        fields = ['farmer', 'farm', 'title', 'description', 'crop_type',
+        fields = ['farmer', 'title', 'description', 'crop_type',
                   'quantity_kg', 'price_per_kg', 'expected_harvest_date',
                   'delivery_available', 'delivery_radius_km', 'cover_image']
     
+    def validate_delivery_radius_km(self, value):
+        limit = settings.MARKETPLACE_MAX_DELIVERY_RADIUS_KM
+        if value < 0 or value > limit:
+            raise serializers.ValidationError(f'Delivery radius must be between 0 and {limit} km')
+        return value
+    
     def create(self, validated_data):
         # Set quantity_available same as quantity_kg initially
         validated_data['quantity_available'] = validated_data['quantity_kg']
         
-        # Link latest assessment from farm
-        farm = validated_data.get('farm')
-        if farm and farm.latest_assessment:
-            validated_data['assessment'] = farm.latest_assessment
+        # Link farmer's latest assessment
+        latest_assessment = validated_data['farmer'].assessments.order_by('-assessed_at').first()
+        if latest_assessment:
+            validated_data['assessment'] = latest_assessment
         
         return super().create(validated_data)
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     listing_title = serializers.CharField(source='listing.title', read_only=True)
     buyer_name = serializers.CharField(source='buyer.full_name', read_only=True)
     farmer_name = serializers.CharField(source='farmer.full_name', read_only=True)
@@ -80,6 +97,11 @@ class OrderSerializer(serializers.ModelSerializer):
                            'escrow_transaction_hash', 'loan_deduction_amount',
                            'created_at', 'payment_at', 'dispatched_at', 
                            'received_at', 'completed_at']
+        select_related_fields = {
+            'listing_title': ['listing'],
+            'buyer_name': ['buyer'],
+            'farmer_name': ['listing__farmer'],
+        }
 
 
 class OrderCreateSerializer(serializers.ModelSerializer):
@@ -114,7 +136,7 @@ class OrderCreateSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     listing_title = serializers.CharField(source='listing.title', read_only=True)
     listing_price = serializers.DecimalField(source='listing.price_per_kg', 
                                              max_digits=10, decimal_places=2, read_only=True)
@@ -125,3 +147,8 @@ class CartItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'buyer', 'listing', 'listing_title', 'listing_price',
                   'quantity_kg', 'subtotal', 'added_at']
         read_only_fields = ['id', 'added_at']
+        select_related_fields = {
+            'listing_title': ['listing'],
+            'listing_price': ['listing'],
+            'subtotal': ['listing'],
+        }
@@ -0,0 +1,50 @@
+"""
+Marketplace signal handlers - cache invalidation.
+
+Listing responses embed farmer and assessment details, so changes to any
+of those bump the listing cache version (see marketplace.cache).
+Deleted listings (including cascades) are taken out of the crop catalog
+and the full-text index. Listings follow their farmer's geocoded location.
+"""
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from core.geo import point_fields
+from crops.models import CropAssessment
+from .cache import bump_version
+from .catalog import apply_change, stored_state
+from .models import Listing, ListingSearchRow
+from .search import remove_row
+
+
+@receiver(post_save, sender=Listing)
+@receiver(post_delete, sender=Listing)
+@receiver(post_save, sender=CropAssessment)
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_listing_cache(sender, **kwargs):
+    bump_version('listing')
+
+
+@receiver(pre_delete, sender=Listing)
+def read_catalog_state(sender, instance, **kwargs):
+    # The row is gone by post_delete; read (and lock) what it contributes now
+    instance._catalog_state = stored_state(instance.pk, lock=True)
+
+
+@receiver(post_delete, sender=Listing)
+def remove_from_catalog(sender, instance, **kwargs):
+    apply_change(getattr(instance, '_catalog_state', None), None)
+
+
+@receiver(post_delete, sender=ListingSearchRow)
+def remove_from_search_index(sender, instance, **kwargs):
+    remove_row(instance.pk)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def move_farmer_listings(sender, instance, created, **kwargs):
+    if created or not getattr(instance, '_coordinates_changed', False):
+        return
+    Listing.objects.filter(farmer=instance).update(**point_fields(instance.coordinates))
@@ -0,0 +1,43 @@
+"""
+Marketplace background jobs (see core.jobs).
+
+Each task wraps an idempotent service, so a retried or re-claimed run
+does no harm. Escrow work goes to the `escrow` queue, which
+JOB_QUEUE_CONCURRENCY keeps to one job at a time.
+"""
+
+from core.jobs import task
+
+
+@task(queue='escrow')
+def settle_orders(order_ids):
+    """Release escrow for delivered orders (loans.escrow_service.settle_orders)."""
+    from loans.escrow_service import settle_orders as settle
+
+    settle(order_ids)
+
+
+@task(queue='escrow')
+def auto_release_orders(batch_size=500):
+    """Release escrow for dispatched orders past the confirmation window."""
+    from .auto_release import release_due_orders
+
+    release_due_orders(batch_size=batch_size)
+
+
+@task()
+def release_expired_holds(batch_size=1000):
+    """Give back expired stock holds until none are left."""
+    from .reservations import release_expired
+
+    while release_expired(limit=batch_size):
+        pass
+
+
+@task(queue='escrow')
+def sweep_escrow_deposits(batch_size=1000):
+    """Move paid orders' funds into their pooled escrow accounts."""
+    from loans.escrow_pool import sweep_deposits
+
+    while sweep_deposits(limit=batch_size):
+        pass
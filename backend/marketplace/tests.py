@@ -1,3 +1,762 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import skipUnless
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from core.models import OutboxOperation, Transaction, User
+from core.testing import QueryBudgetTestMixin
+from crops.models import CropAssessment
+from loans.models import Loan, LoanRepayment
+from marketplace.auto_release import release_due_orders
+from marketplace.catalog import rebuild_catalog
+from marketplace.models import CartItem, Crop, Listing, Order, Reservation
+from marketplace.reservations import hold_cart
+from marketplace.search import search_listings
+
+
+class MarketplaceQueryCountTests(QueryBudgetTestMixin, TestCase):
+    """Pin query counts so N+1 patterns don't creep back into list views."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.buyer = User.objects.create_user('buyer@test.com', 'pw', full_name='Buyer', is_buyer=True)
+        cls.farmers = [
+            User.objects.create_user(f'farmer{i}@test.com', 'pw', full_name=f'Farmer {i}',
+                                     is_farmer=True, location='Nakuru')
+            for i in range(4)
+        ]
+        cls.listings = []
+        for i in range(20):
+            farmer = cls.farmers[i % len(cls.farmers)]
+            assessment = CropAssessment.objects.create(
+                farmer=farmer, crop_type='Maize', health_score=Decimal('0.85'),
+                estimated_yield='high', risk_level='low'
+            )
+            cls.listings.append(Listing.objects.create(
+                farmer=farmer, title=f'Maize {i}', description='Fresh maize', crop_type='Maize',
+                quantity_kg=100, quantity_available=100, price_per_kg=45,
+                expected_harvest_date=date(2026, 12, 1), assessment=assessment, featured=True
+            ))
+        for listing in cls.listings:
+            Order.objects.create(listing=listing, buyer=cls.buyer, quantity_kg=1,
+                                 price_per_kg=45, total_price=45)
+            CartItem.objects.create(buyer=cls.buyer, listing=listing, quantity_kg=2)
+
+    def setUp(self):
+        # Cached listing responses would otherwise hide the queries
+        cache.clear()
+
+    def test_listing_page_is_constant(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/marketplace/listings/')
+        self.assertEqual(len(response.data['results']), 20)
+        self.assertEqual(response.data['results'][0]['assessment']['farmer_name'][:6], 'Farmer')
+        self.assertWithinQueryBudget(response)
+
+    def test_listing_detail_and_featured(self):
+        response = self.client.get(f'/api/marketplace/listings/{self.listings[0].id}/')
+        self.assertWithinQueryBudget(response)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/marketplace/listings/featured/')
+        self.assertEqual(len(response.data), 10)
+
+    def test_sparse_fields_prune_output_and_joins(self):
+        url = '/api/marketplace/listings/'
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'fields': 'id,title,farmer_name'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'title', 'farmer_name'})
+        self.assertIn('JOIN "core_user"', queries.captured_queries[0]['sql'])
+        self.assertNotIn('crops_cropassessment', queries.captured_queries[0]['sql'])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'omit': 'farmer_name,farmer_location,assessment,health_badge'})
+        row = response.data['results'][0]
+        self.assertFalse({'farmer_name', 'farmer_location', 'assessment', 'health_badge'} & set(row))
+        self.assertIn('title', row)
+        self.assertNotIn('JOIN', queries.captured_queries[0]['sql'])
+
+    def test_order_views_are_constant(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/marketplace/orders/')
+        self.assertEqual(len(response.data['results']), 20)
+        with self.assertNumQueries(1):
+            self.client.get('/api/marketplace/orders/my_sales/', {'farmer_id': self.farmers[0].id})
+
+    def test_cart_views_are_constant(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/marketplace/cart/', {'buyer': self.buyer.id})
+        self.assertEqual(len(response.data['results']), 20)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/marketplace/cart/summary/', {'buyer_id': self.buyer.id})
+        self.assertEqual(response.data['total_items'], 20)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite-specific')
+class HotPathIndexTests(TestCase):
+    """The partial indexes only help while their conditions match the view filters."""
+
+    def setUp(self):
+        cache.clear()
+        farmer = User.objects.create_user('farmer@test.com', 'pw', full_name='Farmer', is_farmer=True)
+        for i in range(5):
+            Listing.objects.create(
+                farmer=farmer, title=f'Maize {i}', description='', crop_type='Maize', quantity_kg=10,
+                quantity_available=10, price_per_kg=40, expected_harvest_date=date(2026, 12, 1), featured=i < 2,
+            )
+
+    def plan(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {queries.captured_queries[0]['sql']}")
+            return '\n'.join(str(row[-1]) for row in cursor.fetchall())
+
+    def test_listing_views_use_partial_indexes(self):
+        self.assertIn('USING INDEX mkt_listing_active_idx', self.plan('/api/marketplace/listings/'))
+        self.assertIn('USING INDEX mkt_listing_featured_idx', self.plan('/api/marketplace/listings/featured/'))
+
+    def test_benchmark_leaves_the_database_untouched(self):
+        out = StringIO()
+        call_command('benchmark_indexes', listings=200, users=10, repeat=1, stdout=out)
+        self.assertIn('mkt_listing_active_idx', out.getvalue())
+        self.assertEqual(Listing.objects.count(), 5)
+        with connection.cursor() as cursor:
+            self.assertIn('mkt_listing_featured_idx',
+                          connection.introspection.get_constraints(cursor, Listing._meta.db_table))
+
+
+class ListingCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.farmer = User.objects.create_user('farmer@test.com', 'pw', full_name='Farmer', is_farmer=True)
+        self.listing = Listing.objects.create(
+            farmer=self.farmer, title='Beans', description='Dry beans', crop_type='Beans',
+            quantity_kg=50, quantity_available=50, price_per_kg=120,
+            expected_harvest_date=date(2026, 12, 1)
+        )
+
+    def test_reads_are_cached_until_a_listing_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.listing.save()
+        self.client.get('/api/marketplace/listings/crop_types/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/marketplace/listings/crop_types/')
+        self.assertEqual(response.data, ['Beans'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.listing.crop_type = 'Maize'
+            self.listing.save()
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/marketplace/listings/crop_types/')
+        self.assertEqual(response.data, ['Maize'])
+
+
+class CropCatalogTests(TestCase):
+    def setUp(self):
+        self.farmer = User.objects.create_user('farmer@test.com', 'pw', full_name='Farmer', is_farmer=True)
+
+    def make_listing(self, crop_type='Maize', quantity=100, price=40, **kwargs):
+        return Listing.objects.create(
+            farmer=self.farmer, title=crop_type, description='Fresh', crop_type=crop_type,
+            quantity_kg=quantity, quantity_available=quantity, price_per_kg=price,
+            expected_harvest_date=date(2026, 12, 1), **kwargs
+        )
+
+    def assertCrop(self, slug, count, kg, low, high):
+        crop = Crop.objects.get(slug=slug)
+        self.assertEqual((crop.active_listings, crop.total_available_kg, crop.min_price_per_kg,
+                          crop.max_price_per_kg), (count, Decimal(kg), low, high))
+
+    def test_counts_follow_listing_lifecycle(self):
+        cheap = self.make_listing(' maize ', price=30)
+        dear = self.make_listing('Maize', quantity=50, price=60)
+        self.make_listing('Maize', price=90, status='draft')
+        self.assertEqual(cheap.crop_id, 'maize')
+        self.assertCrop('maize', 2, 150, Decimal('30'), Decimal('60'))
+
+        # Selling part of the cheapest listing only moves the kg
+        listing = Listing.objects.get(pk=cheap.pk)
+        listing.quantity_available -= 40
+        listing.save()
+        self.assertCrop('maize', 2, 110, Decimal('30'), Decimal('60'))
+
+        # Selling out the cheapest listing narrows the price range
+        listing.quantity_available = 0
+        listing.status = 'sold'
+        listing.save()
+        self.assertCrop('maize', 1, 50, Decimal('60'), Decimal('60'))
+
+        dear.crop_type = 'Beans'
+        dear.save()
+        self.assertCrop('maize', 0, 0, None, None)
+        self.assertCrop('beans', 1, 50, Decimal('60'), Decimal('60'))
+
+        Listing.objects.get(pk=dear.pk).delete()
+        self.assertCrop('beans', 0, 0, None, None)
+
+    def test_filter_and_dropdown_use_catalog(self):
+        self.make_listing('Sweet Potato')
+        self.make_listing('Maize')
+        response = self.client.get('/api/marketplace/listings/', {'crop_type': 'sweet potato'})
+        self.assertEqual([row['crop'] for row in response.data['results']], ['sweet-potato'])
+        response = self.client.get('/api/marketplace/listings/catalog/')
+        self.assertEqual([row['slug'] for row in response.data], ['maize', 'sweet-potato'])
+
+    def test_saving_a_stale_instance_keeps_catalog_in_step(self):
+        buyer = User.objects.create_user('buyer@test.com', 'pw', full_name='Buyer', is_buyer=True)
+        listing = self.make_listing('Maize', quantity=100, price=40)
+        other = self.make_listing('Maize', quantity=10, price=50)
+        stale = Listing.objects.get(pk=listing.pk)
+        # Reservations move stock with queryset.update() behind the loaded instance
+        hold_cart(buyer.pk, listing.pk, Decimal('30'))
+        self.assertCrop('maize', 2, 80, Decimal('40'), Decimal('50'))
+
+        stale.price_per_kg = 45
+        stale.save()
+        stored = Listing.objects.get(pk=listing.pk).quantity_available
+        self.assertCrop('maize', 2, stored + 10, Decimal('45'), Decimal('50'))
+
+        # A partial save leaves the stored stock alone
+        stale = Listing.objects.get(pk=listing.pk)
+        hold_cart(buyer.pk, listing.pk, Decimal('50'))
+        stale.price_per_kg = 42
+        stale.save(update_fields=['price_per_kg'])
+        stored = Listing.objects.get(pk=listing.pk).quantity_available
+        self.assertCrop('maize', 2, stored + 10, Decimal('42'), Decimal('50'))
+
+        stale_other = Listing.objects.get(pk=other.pk)
+        hold_cart(buyer.pk, other.pk, Decimal('4'))
+        stale_other.delete()
+        self.assertCrop('maize', 1, stored, Decimal('42'), Decimal('42'))
+
+    def test_rebuild_matches_incremental(self):
+        self.make_listing('Maize', price=30)
+        self.make_listing('Maize', price=50)
+        Listing.objects.filter(price_per_kg=30).update(status='expired')
+        rebuild_catalog()
+        self.assertCrop('maize', 1, 100, Decimal('50'), Decimal('50'))
+
+
+class ListingSearchTests(QueryBudgetTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.farmer = User.objects.create_user('farmer@test.com', 'pw', full_name='Farmer', is_farmer=True)
+        self.potatoes = self.make_listing('Sweet Potatoes', 'Orange flesh, Kisii', 'Sweet Potato', 80)
+        self.maize = self.make_listing('Dry Maize', 'Goes well with sweet potatoes', 'Maize', 40)
+        self.beans = self.make_listing('Rosecoco Beans', 'Sorted and dried', 'Beans', 120)
+
+    def make_listing(self, title, description, crop_type, price):
+        return Listing.objects.create(
+            farmer=self.farmer, title=title, description=description, crop_type=crop_type,
+            quantity_kg=100, quantity_available=100, price_per_kg=price,
+            expected_harvest_date=date(2026, 12, 1)
+        )
+
+    def search(self, **params):
+        response = self.client.get('/api/marketplace/listings/search/', params)
+        self.assertWithinQueryBudget(response)
+        return [row['title'] for row in response.data['results']]
+
+    def test_ranked_prefix_search(self):
+        self.assertEqual(self.search(q='sweet potato'), ['Sweet Potatoes', 'Dry Maize'])
+        self.assertEqual(self.search(q='swee'), ['Sweet Potatoes', 'Dry Maize'])
+        self.assertEqual(self.search(q='swee', prefix='false'), [])
+        self.assertEqual(self.search(q='"beans" * ('), ['Rosecoco Beans'])
+
+    def test_filters_apply_to_matches(self):
+        self.assertEqual(self.search(q='sweet', max_price=50), ['Dry Maize'])
+
+    def test_composes_with_other_querysets(self):
+        matches = search_listings(Listing.objects.filter(farmer__full_name='Farmer'), 'sweet')
+        self.assertEqual(list(matches.filter(price_per_kg__gte=50)), [self.potatoes])
+        self.assertEqual(matches.count(), 2)
+        # Searching within a search reuses the join, so both queries must match
+        self.assertEqual(list(search_listings(matches, 'potatoes').values_list('title', flat=True)),
+                         ['Sweet Potatoes', 'Dry Maize'])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.beans.title = 'Yellow Beans'
+        self.beans.save()
+        self.assertEqual(self.search(q='yellow'), ['Yellow Beans'])
+        cache.clear()
+        self.assertEqual(self.search(q='rosecoco'), [])
+
+        self.potatoes.delete()
+        self.assertEqual(self.search(q='orange'), [])
+
+
+
+@skipUnless(connection.vendor == 'postgresql', 'The GIN search index only exists on PostgreSQL')
+class PostgresSearchIndexTests(TestCase):
+    """The search expression has to match the indexed one exactly for the planner to use it."""
+
+    def setUp(self):
+        farmer = User.objects.create_user('farmer@test.com', 'pw', full_name='Farmer', is_farmer=True)
+        for i, crop in enumerate(['Maize', 'Beans', 'Sweet Potato']):
+            Listing.objects.create(
+                farmer=farmer, title=f'{crop} lot {i}', description='', crop_type=crop, quantity_kg=10,
+                quantity_available=10, price_per_kg=40, expected_harvest_date=date(2026, 12, 1),
+            )
+
+    def test_search_uses_gin_index(self):
+        with connection.cursor() as cursor:
+            # A handful of rows would otherwise always be scanned
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = search_listings(Listing.objects.filter(status='active'), 'swee').explain()
+        self.assertIn('mkt_listing_search_idx', plan)
+
+class FacetTests(QueryBudgetTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        farmer = User.objects.create_user('farmer@test.com', 'pw', full_name='Farmer', is_farmer=True)
+        for crop_type, price, score, delivery in [
+            ('Maize', 20, '0.9', True), ('Maize', 45, '0.65', False),
+            ('Beans', 120, '0.3', True), ('Beans', 250, None, True),
+        ]:
+            assessment = score and CropAssessment.objects.create(
+                farmer=farmer, crop_type=crop_type, health_score=Decimal(score),
+                estimated_yield='high', risk_level='low'
+            )
+            Listing.objects.create(
+                farmer=farmer, title=f'{crop_type} lot', description='Fresh', crop_type=crop_type,
+                quantity_kg=10, quantity_available=10, price_per_kg=price,
+                expected_harvest_date=date(2026, 12, 1), assessment=assessment or None,
+                delivery_available=delivery
+            )
+
+    def facets(self, **params):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/marketplace/listings/facets/', params)
+        self.assertWithinQueryBudget(response)
+        return response.data
+
+    def counts(self, facet):
+        return {entry['value']: entry['count'] for entry in facet}
+
+    def test_all_facets_in_one_query(self):
+        data = self.facets()
+        self.assertEqual(data['total'], 4)
+        self.assertEqual(self.counts(data['crop_type']), {'maize': 2, 'beans': 2})
+        self.assertEqual(self.counts(data['price_per_kg']),
+                         {'0-25': 1, '25-50': 1, '50-100': 0, '100-200': 1, '200+': 1})
+        self.assertEqual(self.counts(data['health_badge']),
+                         {'Excellent': 1, 'Good': 1, 'Fair': 0, 'Poor': 1, 'Unassessed': 1})
+        self.assertEqual(self.counts(data['delivery_available']), {True: 3, False: 1})
+
+    def test_facets_follow_filters_and_search(self):
+        self.assertEqual(self.facets(max_price=100)['total'], 2)
+        data = self.facets(q='beans')
+        self.assertEqual(self.counts(data['crop_type']), {'beans': 2})
+
+
+class NearbyListingTests(QueryBudgetTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.listings = {}
+        for town, radius in [('Nakuru', 50), ('Naivasha', 100), ('Molo', 10), ('Kisumu', 300)]:
+            farmer = User.objects.create_user(f'{town}@test.com', 'pw', full_name=town,
+                                              is_farmer=True, farm_location=f'{town}, Kenya')
+            self.listings[town] = Listing.objects.create(
+                farmer=farmer, title=f'{town} maize', description='Maize', crop_type='Maize',
+                quantity_kg=100, quantity_available=100, price_per_kg=40,
+                expected_harvest_date=date(2026, 12, 1), delivery_radius_km=radius
+            )
+
+    def nearby(self, **params):
+        response = self.client.get('/api/marketplace/listings/nearby/', params)
+        self.assertWithinQueryBudget(response)
+        return [row['title'] for row in response.data['results']]
+
+    def test_radius_and_nearest(self):
+        self.assertEqual(self.nearby(near='Nakuru', radius_km=65), ['Nakuru maize', 'Molo maize', 'Naivasha maize'])
+        self.assertEqual(self.nearby(near='Nakuru', k=2), ['Nakuru maize', 'Molo maize'])
+        self.assertEqual(self.nearby(near='Mombasa', k=1), ['Naivasha maize'])
+        self.assertEqual(self.client.get('/api/marketplace/listings/nearby/', {'near': 'Atlantis'}).status_code, 400)
+
+    def test_deliverable_uses_each_listing_radius(self):
+        # Naivasha is ~60 km from Nakuru town, Molo ~40 km, Kisumu ~150 km
+        self.assertEqual(self.nearby(near='Nakuru', deliverable='true'),
+                         ['Nakuru maize', 'Naivasha maize', 'Kisumu maize'])
+
+    def test_listings_follow_farmer_location(self):
+        farmer = self.listings['Molo'].farmer
+        farmer.farm_location = 'Mombasa'
+        farmer.save()
+        self.assertEqual(self.nearby(near='Mombasa', radius_km=5), ['Molo maize'])
+
+
+class CheckoutTests(QueryBudgetTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.buyer = User.objects.create_user('cart@test.com', 'pw', full_name='Cart Buyer', is_buyer=True)
+        self.farmer = User.objects.create_user('grower@test.com', 'pw', full_name='Grower', is_farmer=True)
+
+    def make_listing(self, crop_type='Maize', quantity=100, price=40):
+        return Listing.objects.create(
+            farmer=self.farmer, title=f'{crop_type} lot', description='', crop_type=crop_type,
+            quantity_kg=quantity, quantity_available=quantity, price_per_kg=price,
+            expected_harvest_date=date(2026, 12, 1)
+        )
+
+    def checkout(self):
+        response = self.client.post('/api/marketplace/cart/checkout/',
+                                    {'buyer_id': str(self.buyer.id), 'delivery_address': 'Nakuru'})
+        return response, self.assertWithinQueryBudget(response)
+
+    def test_query_count_does_not_grow_with_cart(self):
+        # Both carts sell out a listing, so both pay for the catalog price recompute
+        CartItem.objects.create(buyer=self.buyer, listing=self.make_listing(), quantity_kg=100)
+        response, single = self.checkout()
+        self.assertEqual(response.status_code, 200)
+
+        for i in range(15):
+            listing = self.make_listing(crop_type=['Maize', 'Beans', 'Kale'][i % 3], price=30 + i)
+            CartItem.objects.create(buyer=self.buyer, listing=listing, quantity_kg=100 if i == 0 else 5)
+        response, many = self.checkout()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(many, single)
+        self.assertEqual(len(response.data['orders']), 15)
+        self.assertEqual(response.data['orders'][0]['buyer_name'], 'Cart Buyer')
+        self.assertFalse(CartItem.objects.filter(buyer=self.buyer).exists())
+
+        sold = Listing.objects.get(title='Maize lot', price_per_kg=30)
+        self.assertEqual((sold.status, sold.quantity_available), ('sold', 0))
+        # The catalog follows the bulk decrement exactly
+        expected = {crop.slug: (crop.active_listings, crop.total_available_kg, crop.min_price_per_kg)
+                    for crop in Crop.objects.all()}
+        rebuild_catalog()
+        self.assertEqual(expected, {crop.slug: (crop.active_listings, crop.total_available_kg, crop.min_price_per_kg)
+                                    for crop in Crop.objects.all()})
+        self.assertEqual(Crop.objects.get(slug='maize').min_price_per_kg, 33)
+
+    def test_insufficient_stock_rejects_whole_cart(self):
+        plenty, scarce = self.make_listing(crop_type='Beans'), self.make_listing(quantity=5)
+        CartItem.objects.create(buyer=self.buyer, listing=plenty, quantity_kg=10)
+        CartItem.objects.create(buyer=self.buyer, listing=scarce, quantity_kg=10)
+
+        response, _ = self.checkout()
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('only 5.00kg available', response.data['error'])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartItem.objects.filter(buyer=self.buyer).count(), 2)
+        plenty.refresh_from_db()
+        self.assertEqual(plenty.quantity_available, 100)
+
+    def test_empty_cart(self):
+        response, _ = self.checkout()
+        self.assertEqual(response.status_code, 400)
+
+
+class ReservationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.farmer = User.objects.create_user('holds@test.com', 'pw', full_name='Holder', is_farmer=True)
+        self.buyer = User.objects.create_user('hb@test.com', 'pw', full_name='Hold Buyer', is_buyer=True,
+                                              wallet_balance=Decimal('10000'))
+        self.listing = Listing.objects.create(
+            farmer=self.farmer, title='Beans lot', description='', crop_type='Beans',
+            quantity_kg=100, quantity_available=100, price_per_kg=50,
+            expected_harvest_date=date(2026, 12, 1)
+        )
+
+    def add_to_cart(self, buyer, quantity):
+        return self.client.post('/api/marketplace/cart/', {
+            'buyer': str(buyer.id), 'listing': str(self.listing.id), 'quantity_kg': quantity})
+
+    def available(self):
+        self.listing.refresh_from_db()
+        return self.listing.quantity_available, self.listing.status
+
+    def expire_all(self):
+        Reservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        call_command('release_expired_holds', stdout=StringIO())
+
+    def test_cart_holds_stock_until_removed(self):
+        item = self.add_to_cart(self.buyer, 60).data
+        self.assertEqual(self.available(), (Decimal('40'), 'active'))
+
+        rival = User.objects.create_user('rival@test.com', 'pw', full_name='Rival', is_buyer=True)
+        self.assertEqual(self.add_to_cart(rival, 50).status_code, 400)
+        self.assertFalse(CartItem.objects.filter(buyer=rival).exists())
+
+        self.client.patch(f"/api/marketplace/cart/{item['id']}/", {'quantity_kg': 100},
+                          content_type='application/json')
+        self.assertEqual(self.available(), (Decimal('0'), 'sold'))
+        self.client.delete(f"/api/marketplace/cart/{item['id']}/")
+        self.assertEqual(self.available(), (Decimal('100'), 'active'))
+        self.assertEqual(Crop.objects.get(slug='beans').active_listings, 1)
+
+    def test_checkout_moves_cart_hold_to_order(self):
+        self.add_to_cart(self.buyer, 30)
+        response = self.client.post('/api/marketplace/cart/checkout/', {'buyer_id': str(self.buyer.id)})
+        self.assertEqual(response.status_code, 200)
+        # Stock was taken once, when the item was added
+        self.assertEqual(self.available(), (Decimal('70'), 'active'))
+        hold = Reservation.objects.get()
+        self.assertEqual((str(hold.order_id), hold.status), (response.data['orders'][0]['id'], 'held'))
+
+    def test_unpaid_order_gives_stock_back_when_hold_expires(self):
+        response = self.client.post('/api/marketplace/orders/', {
+            'listing': str(self.listing.id), 'buyer': str(self.buyer.id), 'quantity_kg': 100})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.available(), (Decimal('0'), 'sold'))
+
+        self.expire_all()
+        self.assertEqual(self.available(), (Decimal('100'), 'active'))
+        self.assertEqual(Order.objects.get().status, 'cancelled')
+        self.assertEqual(Reservation.objects.get().status, 'expired')
+        self.assertEqual(Crop.objects.get(slug='beans').total_available_kg, 100)
+
+    def test_paying_commits_the_hold(self):
+        order_id = self.client.post('/api/marketplace/orders/', {
+            'listing': str(self.listing.id), 'buyer': str(self.buyer.id), 'quantity_kg': 40}).data['order']['id']
+        self.assertEqual(self.client.post(f'/api/marketplace/orders/{order_id}/pay/').status_code, 200)
+        self.assertEqual(Reservation.objects.get().status, 'committed')
+
+        self.expire_all()
+        self.assertEqual(self.available(), (Decimal('60'), 'active'))
+        self.assertEqual(Order.objects.get().status, 'escrow_held')
+
+
+    def test_paying_an_order_without_a_hold_takes_its_stock(self):
+        # Orders placed before reservations existed, or whose hold was released
+        order_id = self.client.post('/api/marketplace/orders/', {
+            'listing': str(self.listing.id), 'buyer': str(self.buyer.id), 'quantity_kg': 40}).data['order']['id']
+        Reservation.objects.all().delete()
+        Listing.objects.filter(pk=self.listing.pk).update(quantity_available=100)
+
+        self.assertEqual(self.client.post(f'/api/marketplace/orders/{order_id}/pay/').status_code, 200)
+        self.assertEqual(self.available(), (Decimal('60'), 'active'))
+        self.assertEqual(Reservation.objects.get().status, 'committed')
+        self.assertEqual(Order.objects.get().status, 'escrow_held')
+
+    def test_paying_an_expired_order_is_rejected(self):
+        order_id = self.client.post('/api/marketplace/orders/', {
+            'listing': str(self.listing.id), 'buyer': str(self.buyer.id), 'quantity_kg': 40}).data['order']['id']
+        self.expire_all()
+
+        response = self.client.post(f'/api/marketplace/orders/{order_id}/pay/')
+        self.assertEqual(response.data['error'], 'Order was cancelled when its hold expired')
+        self.assertEqual(self.available(), (Decimal('100'), 'active'))
+        self.buyer.refresh_from_db()
+        self.assertEqual(self.buyer.wallet_balance, Decimal('10000'))
+
+class OrderTransitionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.farmer = User.objects.create_user('seller@test.com', 'pw', full_name='Seller', is_farmer=True)
+        self.buyer = User.objects.create_user('payer@test.com', 'pw', full_name='Payer', is_buyer=True,
+                                              wallet_balance=Decimal('1000'))
+        listing = Listing.objects.create(
+            farmer=self.farmer, title='Kale lot', description='', crop_type='Kale',
+            quantity_kg=100, quantity_available=100, price_per_kg=10,
+            expected_harvest_date=date(2026, 12, 1)
+        )
+        self.order_id = self.client.post('/api/marketplace/orders/', {
+            'listing': str(listing.id), 'buyer': str(self.buyer.id), 'quantity_kg': 10}).data['order']['id']
+
+    def post(self, action):
+        return self.client.post(f'/api/marketplace/orders/{self.order_id}/{action}/')
+
+    def test_each_transition_wins_once(self):
+        self.assertEqual(self.post('pay').status_code, 200)
+        self.assertEqual(self.post('pay').data['error'], 'Cannot pay for order in escrow_held status')
+        self.assertEqual(self.post('dispatch').status_code, 200)
+        self.assertEqual(self.post('receive').status_code, 200)
+        self.assertEqual(self.post('receive').status_code, 400)
+
+        self.farmer.refresh_from_db()
+        self.buyer.refresh_from_db()
+        self.assertEqual(self.farmer.wallet_balance, Decimal('100'))
+        self.assertEqual((self.buyer.wallet_balance, self.buyer.escrow_balance), (Decimal('900'), Decimal('0')))
+        self.assertEqual(Order.objects.get().status, 'completed')
+
+    def test_stale_instance_loses_the_race(self):
+        self.post('pay')
+        self.post('dispatch')
+        stale = Order.objects.get(pk=self.order_id)
+        self.post('receive')
+        self.assertFalse(Order.states.advance(stale, 'complete'))
+        self.assertEqual(stale.status, 'completed')
+        self.assertEqual(Order.states.apply(Order.objects.all(), 'cancel'), 0)
+
+
+class SettlementTests(QueryBudgetTestMixin, TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user('coop@test.com', 'pw', full_name='Coop', is_buyer=True,
+                                              wallet_balance=Decimal('10000'), escrow_balance=Decimal('10000'))
+        self.farmers = [
+            User.objects.create_user(f'settle{i}@test.com', 'pw', full_name=f'Settler {i}', is_farmer=True)
+            for i in range(3)
+        ]
+        self.listings = [
+            Listing.objects.create(
+                farmer=farmer, title='Tea lot', description='', crop_type='Tea',
+                quantity_kg=100, quantity_available=100, price_per_kg=10,
+                expected_harvest_date=date(2026, 12, 1)
+            )
+            for farmer in self.farmers
+        ]
+        # Interest-free for round numbers: 20 left to repay
+        self.loan = Loan.objects.create(borrower=self.farmers[0], amount_requested=1000, amount_approved=1000,
+                                        interest_rate=0, amount_repaid=980, status='released')
+
+    def make_orders(self, count, status='received'):
+        return [
+            Order.objects.create(listing=self.listings[i % 3], buyer=self.buyer, quantity_kg=10,
+                                 price_per_kg=10, total_price=100, status=status)
+            for i in range(count)
+        ]
+
+    def settle(self, orders):
+        response = self.client.post('/api/marketplace/orders/settle/',
+                                    {'order_ids': [str(order.id) for order in orders]},
+                                    content_type='application/json')
+        return response, self.assertWithinQueryBudget(response)
+
+    def test_query_count_does_not_grow_with_batch(self):
+        self.loan.delete()
+        response, single = self.settle(self.make_orders(1))
+        self.assertEqual(response.data['settled'], 1)
+        response, many = self.settle(self.make_orders(30))
+        self.assertEqual(response.data['settled'], 30)
+        self.assertEqual(many, single)
+
+    def test_batch_matches_per_order_accounting(self):
+        orders = self.make_orders(6) + self.make_orders(1, status='escrow_held')
+        response, _ = self.settle(orders)
+        self.assertEqual((response.data['settled'], response.data['skipped']), (6, 1))
+
+        # Only 20 was left on the loan: the first sale repays it, the second deducts nothing
+        self.loan.refresh_from_db()
+        self.assertEqual((self.loan.status, self.loan.amount_repaid), ('repaid', Decimal('1000')))
+        self.assertEqual(sorted(LoanRepayment.objects.values_list('amount', flat=True)), [Decimal('20')])
+
+        balances = dict(User.objects.filter(pk__in=[f.pk for f in self.farmers]).values_list('pk', 'wallet_balance'))
+        self.assertEqual([balances[f.pk] for f in self.farmers], [Decimal('180'), Decimal('200'), Decimal('200')])
+        self.buyer.refresh_from_db()
+        self.assertEqual(self.buyer.escrow_balance, Decimal('9400'))
+        self.assertEqual(Order.objects.filter(status='completed', received_at__isnull=False).count(), 6)
+        self.assertEqual(Transaction.objects.aggregate(total=Sum('amount'))['total'], 0)
+
+        # On-chain: escrow pays each farmer, plus the loan pool for the one deduction
+        payments = OutboxOperation.objects.filter(kind='payment', reference_type='order')
+        self.assertEqual(payments.count(), 7)
+        self.assertEqual(payments.filter(destination=settings.STELLAR_LOAN_POOL_ACCOUNT).get().amount, Decimal('20'))
+        self.assertEqual(payments.aggregate(total=Sum('amount'))['total'], Decimal('600'))
+
+    def test_command_settles_received_orders(self):
+        self.make_orders(4)
+        self.make_orders(2, status='dispatched')
+        call_command('settle_orders', batch_size=3, stdout=StringIO())
+        self.assertEqual(Order.objects.filter(status='completed').count(), 4)
+
+
+class AutoReleaseTests(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user('late@test.com', 'pw', full_name='Late Buyer', is_buyer=True,
+                                              wallet_balance=Decimal('1000'), escrow_balance=Decimal('1000'))
+        self.farmer = User.objects.create_user('waiting@test.com', 'pw', full_name='Waiting', is_farmer=True)
+        self.listing = Listing.objects.create(
+            farmer=self.farmer, title='Sorghum lot', description='', crop_type='Sorghum',
+            quantity_kg=100, quantity_available=100, price_per_kg=10,
+            expected_harvest_date=date(2026, 12, 1)
+        )
+
+    def dispatched(self, days_ago, count=1):
+        dispatched_at = timezone.now() - timedelta(days=days_ago)
+        return [
+            Order.objects.create(listing=self.listing, buyer=self.buyer, quantity_kg=1, price_per_kg=10,
+                                 total_price=10, status='dispatched', dispatched_at=dispatched_at)
+            for _ in range(count)
+        ]
+
+    def test_releases_only_overdue_orders_in_batches(self):
+        overdue = self.dispatched(days_ago=10, count=5)
+        recent = self.dispatched(days_ago=1)
+
+        call_command('auto_release_orders', batch_size=2, stdout=StringIO())
+        self.assertEqual(set(Order.objects.filter(status='completed').values_list('pk', flat=True)),
+                         {order.pk for order in overdue})
+        self.assertEqual(Order.objects.get(pk=recent[0].pk).status, 'dispatched')
+        self.farmer.refresh_from_db()
+        self.assertEqual(self.farmer.wallet_balance, Decimal('50'))
+
+        # Re-running (e.g. after a crash) pays nobody twice
+        call_command('auto_release_orders', stdout=StringIO())
+        self.farmer.refresh_from_db()
+        self.assertEqual(self.farmer.wallet_balance, Decimal('50'))
+
+    def test_limit_stops_early(self):
+        self.dispatched(days_ago=8, count=5)
+        self.assertEqual(release_due_orders(batch_size=2, limit=3), 3)
+        self.assertEqual(Order.objects.filter(status='dispatched').count(), 2)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.farmer = User.objects.create_user('farmer@test.com', 'pw', full_name='Farmer', is_farmer=True)
+        self.buyer = User.objects.create_user('buyer@test.com', 'pw', full_name='Buyer', is_buyer=True)
+        self.listing = Listing.objects.create(
+            farmer=self.farmer, title='Beans', description='Dry beans', crop_type='Beans',
+            quantity_kg=50, quantity_available=50, price_per_kg=120,
+            expected_harvest_date=date(2026, 12, 1)
+        )
+        self.order = Order.objects.create(listing=self.listing, buyer=self.buyer, quantity_kg=1,
+                                          price_per_kg=120, total_price=120)
+
+    def test_listing_detail_not_modified(self):
+        url = f'/api/marketplace/listings/{self.listing.id}/'
+        response = self.client.get(url)
+        self.assertIn('Last-Modified', response)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        etag = response['ETag']
+        self.listing.price_per_kg = 130
+        self.listing.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_listing_etag_tracks_its_assessment(self):
+        assessment = CropAssessment.objects.create(
+            farmer=self.farmer, crop_type='Beans', health_score=Decimal('0.90'), estimated_yield='high',
+            risk_level='low',
+        )
+        Listing.objects.filter(pk=self.listing.pk).update(assessment=assessment)
+        url = f'/api/marketplace/listings/{self.listing.id}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.client.force_login(self.farmer)
+        response = self.client.patch(f'/api/crops/assessments/{assessment.id}/', {'health_score': '0.30'},
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.client.logout()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.json()['health_badge'], None)
+        self.assertEqual(response.json()['assessment']['health_score'], '0.30')
+
+    def test_order_etag_tracks_content(self):
+        url = f'/api/marketplace/orders/{self.order.id}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Order.objects.filter(pk=self.order.pk).update(status='cancelled')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
 
-# Create your tests here.
+    def test_list_not_modified(self):
+        response = self.client.get('/api/marketplace/orders/')
+        response = self.client.get('/api/marketplace/orders/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
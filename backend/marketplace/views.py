@@ -4,28 +4,56 @@ Marketplace views - Listings, Orders, Cart, and Escrow Actions API.
 
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
-from django.utils import timezone
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.db import transaction
 from decimal import Decimal
 
-from .models import Listing, Order, CartItem
+from .models import Crop, Listing, Order, CartItem
 from .serializers import (
     ListingSerializer, ListingCreateSerializer,
     OrderSerializer, OrderCreateSerializer,
-    CartItemSerializer
+    CartItemSerializer, CropSerializer
+)
+from .cache import cached_response
+from .catalog import normalize_crop
+from .checkout import checkout_cart
+from .reservations import ReservationError, commit_order, hold_cart, hold_order, release_cart
+from .facets import facet_counts
+from .search import search_listings
+from core import geo
+from core.conditional import ConditionalGetMixin
+from core.models import User
+from core.streaming import NDJSON_RENDERER_CLASSES, stream_ndjson, wants_ndjson
+from loans.escrow_service import (
+    SettlementConflict, process_order_payment, refund_order, release_order_payment, settle_orders,
 )
-from loans.escrow_service import process_order_payment, release_order_payment, refund_order
 
 
-class ListingViewSet(viewsets.ModelViewSet):
+class ListingViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     API endpoint for marketplace listings.
     Farmers create listings, buyers browse them.
     """
     queryset = Listing.objects.all()
+    etag_fields = ('id', 'updated_at', 'assessment_id')
+    # Assessments have no updated_at and editing one does not touch the
+    # listing, so hash the assessment fields the payload renders
+    etag_related = ('farmer.updated_at', 'assessment.crop_type', 'assessment.health_score',
+                    'assessment.estimated_yield', 'assessment.risk_level', 'assessment.recommendations',
+                    'assessment.confidence_score', 'assessment.farmer.updated_at')
+    last_modified_field = 'updated_at'
     parser_classes = [MultiPartParser, FormParser]
+    query_budgets = {'list': 1, 'retrieve': 1, 'featured': 1, 'crop_types': 1, 'catalog': 1, 'search': 1, 'facets': 1,
+                     'nearby': len(geo.NEAREST_RADII_KM) + 1}
+    
+    # Ranked search returns the top matches rather than cursor pages
+    search_default_limit = 20
+    search_max_limit = 100
+    nearby_default_radius_km = 50
     
     def get_serializer_class(self):
         if self.action == 'create':
@@ -50,36 +78,164 @@ class ListingViewSet(viewsets.ModelViewSet):
             # Default to active listings for marketplace
             queryset = queryset.filter(status='active')
         if crop_type:
-            queryset = queryset.filter(crop_type__icontains=crop_type)
+            # Indexed equality on the normalized catalog slug
+            queryset = queryset.filter(crop_id=normalize_crop(crop_type))
         if min_price:
             queryset = queryset.filter(price_per_kg__gte=min_price)
         if max_price:
             queryset = queryset.filter(price_per_kg__lte=max_price)
         
-        return queryset
+        return ListingSerializer.eager_load(queryset, self.request)
+    
+    def list(self, request, *args, **kwargs):
+        """Browse listings (cached per query string until listings change)."""
+        return cached_response(
+            request, 'listing-list',
+            lambda: super(ListingViewSet, self).list(request, *args, **kwargs)
+        )
     
     @action(detail=False, methods=['get'])
     def featured(self, request):
         """Get featured listings."""
-        featured = Listing.objects.filter(status='active', featured=True)[:10]
-        serializer = ListingSerializer(featured, many=True, context={'request': request})
-        return Response(serializer.data)
+        def compute():
+            featured = Listing.objects.filter(status='active', featured=True)
+            featured = ListingSerializer.eager_load(featured, request)[:10]
+            serializer = ListingSerializer(featured, many=True, context={'request': request})
+            return Response(serializer.data)
+        return cached_response(request, 'listing-featured', compute)
+    
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Full-text search over title, crop type and description, best match first.
+        
+        ?q= is required; the last word also matches as a prefix, so this
+        doubles as autocomplete (e.g. ?q=swee&fields=id,title&limit=8).
+        The usual status/crop_type/price/farmer filters apply. ?prefix=false
+        turns prefix matching off, ?limit= caps the results (max 100).
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'q required'}, status=400)
+        try:
+            limit = min(int(request.query_params.get('limit', self.search_default_limit)), self.search_max_limit)
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=400)
+        prefix = request.query_params.get('prefix', 'true').lower() not in ('0', 'false', 'no')
+        
+        def compute():
+            results = search_listings(self.get_queryset(), query, prefix=prefix)[:max(limit, 1)]
+            serializer = ListingSerializer(results, many=True, context={'request': request})
+            return Response({'query': query, 'results': serializer.data})
+        return cached_response(request, 'listing-search', compute)
+    
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """
+        Facet counts (crop, price bucket, health badge, delivery) for the
+        current filters, in one aggregate query. Accepts the list filters
+        plus ?q= to facet a search.
+        """
+        def compute():
+            queryset = self.get_queryset()
+            query = request.query_params.get('q', '').strip()
+            if query:
+                queryset = search_listings(queryset, query)
+            return Response(facet_counts(queryset))
+        return cached_response(request, 'listing-facets', compute)
+    
+    def _nearby_origin(self, request):
+        """Resolve ?lat=&lon=, ?near=<place> or ?buyer=<user id> to coordinates."""
+        params = request.query_params
+        if params.get('lat') and params.get('lon'):
+            try:
+                return float(params['lat']), float(params['lon'])
+            except ValueError:
+                return None
+        if params.get('near'):
+            return geo.geocode(params['near'])
+        if params.get('buyer'):
+            buyer = User.objects.filter(pk=params['buyer']).only('latitude', 'longitude').first()
+            return buyer.coordinates if buyer else None
+        return None
+    
+    @action(detail=False, methods=['get'])
+    def nearby(self, request):
+        """
+        Listings near a point, nearest first, with distance_km.
+        
+        Locate with ?lat=&lon=, ?near=<town or county> or ?buyer=<user id>.
+        ?radius_km= bounds the search (default 50), ?k= returns the k
+        nearest instead (unbounded unless radius_km is given), and
+        ?deliverable=true keeps only listings whose delivery radius reaches
+        the point. Other listing filters apply.
+        """
+        params = request.query_params
+        origin = self._nearby_origin(request)
+        if origin is None:
+            return Response({'error': 'Unknown location - pass lat/lon, near or buyer'}, status=400)
+        
+        max_delivery_radius = settings.MARKETPLACE_MAX_DELIVERY_RADIUS_KM
+        deliverable = params.get('deliverable', '').lower() in ('1', 'true', 'yes')
+        try:
+            k = min(int(params['k']), self.search_max_limit) if params.get('k') else None
+            if deliverable:
+                default_radius = max_delivery_radius
+            elif k:
+                default_radius = geo.NEAREST_RADII_KM[-1]
+            else:
+                default_radius = self.nearby_default_radius_km
+            radius_km = min(float(params.get('radius_km', default_radius)), geo.NEAREST_RADII_KM[-1])
+        except ValueError:
+            return Response({'error': 'radius_km and k must be numbers'}, status=400)
+        if deliverable:
+            radius_km = min(radius_km, max_delivery_radius)
+        
+        def compute():
+            queryset = self.get_queryset()
+            lat, lon = origin
+            if deliverable:
+                queryset = queryset.filter(
+                    delivery_available=True, delivery_radius_km__gte=geo.distance_expression(lat, lon)
+                )
+            if k:
+                rows = geo.nearest(queryset, lat, lon, k, max_radius_km=radius_km)
+            else:
+                rows = list(geo.within_radius(queryset, lat, lon, radius_km)[:self.search_max_limit])
+            
+            results = ListingSerializer(rows, many=True, context={'request': request}).data
+            for row, data in zip(rows, results):
+                data['distance_km'] = round(row.distance_km, 2)
+            return Response({'latitude': lat, 'longitude': lon, 'radius_km': radius_km, 'results': results})
+        return cached_response(request, 'listing-nearby', compute)
     
     @action(detail=False, methods=['get'])
     def crop_types(self, request):
-        """Get list of available crop types."""
-        crop_types = Listing.objects.filter(status='active').values_list(
-            'crop_type', flat=True
-        ).distinct()
-        return Response(list(crop_types))
+        """Get list of available crop types (read from the crop catalog)."""
+        def compute():
+            crop_types = Crop.objects.filter(active_listings__gt=0).values_list('name', flat=True)
+            return Response(list(crop_types))
+        return cached_response(request, 'listing-crop-types', compute)
+    
+    @action(detail=False, methods=['get'])
+    def catalog(self, request):
+        """Crop catalog with active listing counts, available kg and price range."""
+        def compute():
+            crops = Crop.objects.filter(active_listings__gt=0)
+            return Response(CropSerializer(crops, many=True).data)
+        return cached_response(request, 'listing-catalog', compute)
 
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     API endpoint for orders.
     Handles the complete order lifecycle with escrow.
     """
     queryset = Order.objects.all()
+    # No updated_at on Order: ETag hashes the row plus the related rows it renders
+    etag_related = ('listing.updated_at', 'buyer.updated_at', 'listing.farmer.updated_at')
+    query_budgets = {'list': 1, 'retrieve': 1, 'my_sales': 1, 'settle': 15}
+    settle_max_orders = 1000
     
     def get_serializer_class(self):
         if self.action == 'create':
@@ -100,7 +256,7 @@ class OrderViewSet(viewsets.ModelViewSet):
         if status_filter:
             queryset = queryset.filter(status=status_filter)
         
-        return queryset
+        return OrderSerializer.eager_load(queryset, self.request)
     
     @transaction.atomic
     def create(self, request, *args, **kwargs):
@@ -109,12 +265,11 @@ class OrderViewSet(viewsets.ModelViewSet):
         serializer.is_valid(raise_exception=True)
         order = serializer.save()
         
-        # Update listing quantity
-        listing = order.listing
-        listing.quantity_available -= order.quantity_kg
-        if listing.quantity_available <= 0:
-            listing.status = 'sold'
-        listing.save()
+        # Hold the stock until the order is paid or the hold expires
+        try:
+            hold_order(order)
+        except ReservationError as exc:
+            raise ValidationError({'error': str(exc)})
         
         return Response({
             'message': 'Order created successfully',
@@ -128,16 +283,20 @@ class OrderViewSet(viewsets.ModelViewSet):
         """
         order = self.get_object()
         
-        if order.status != 'pending_payment':
-            return Response({
-                'error': f'Cannot pay for order in {order.status} status'
-            }, status=400)
-        
-        # Pass user (who is the wallet)
-        success, tx_hash = process_order_payment(order, order.buyer)
-        
-        if not success:
-            return Response({'error': tx_hash}, status=400)
+        with transaction.atomic():
+            # Make the stock hold permanent (or re-take a lapsed one) before
+            # the order row is touched, so locks follow the hold sweeper's order
+            try:
+                commit_order(order)
+            except ReservationError as exc:
+                return Response({'error': str(exc)}, status=400)
+            
+            # Pass user (who is the wallet); fails if another request paid first
+            success, tx_hash = process_order_payment(order, order.buyer)
+            
+            if not success:
+                transaction.set_rollback(True)
+                return Response({'error': tx_hash}, status=400)
         
         return Response({
             'message': 'Payment successful - funds held in escrow',
@@ -145,24 +304,23 @@ class OrderViewSet(viewsets.ModelViewSet):
             'order': OrderSerializer(order).data
         })
     
-    @action(detail=True, methods=['post'])
-    def dispatch(self, request, pk=None):
+    @action(detail=True, methods=['post'], url_path='dispatch')
+    def dispatch_order(self, request, pk=None):
         """
         Farmer marks order as dispatched/shipped.
+        
+        Named dispatch_order so it does not shadow APIView.dispatch();
+        the URL stays /orders/{id}/dispatch/.
         """
         order = self.get_object()
         
-        if order.status != 'escrow_held':
-            return Response({
-                'error': f'Cannot dispatch order in {order.status} status'
-            }, status=400)
-        
         # Verify caller is the farmer (in production, check auth)
         # For demo, trust the request
         
-        order.status = 'dispatched'
-        order.dispatched_at = timezone.now()
-        order.save()
+        if not Order.states.advance(order, 'dispatch'):
+            return Response({
+                'error': f'Cannot dispatch order in {order.status} status'
+            }, status=400)
         
         return Response({
             'message': 'Order marked as dispatched',
@@ -177,20 +335,19 @@ class OrderViewSet(viewsets.ModelViewSet):
         """
         order = self.get_object()
         
-        if order.status != 'dispatched':
-            return Response({
-                'error': f'Cannot confirm receipt for order in {order.status} status'
-            }, status=400)
-        
-        order.status = 'received'
-        order.received_at = timezone.now()
-        order.save()
-        
-        # Release payment from escrow
-        success, tx_hash, farmer_amount, loan_deduction = release_order_payment(order)
-        
-        if not success:
-            return Response({'error': tx_hash}, status=400)
+        with transaction.atomic():
+            # Of two concurrent confirmations only one wins, so the farmer is paid once
+            if not Order.states.advance(order, 'receive'):
+                return Response({
+                    'error': f'Cannot confirm receipt for order in {order.status} status'
+                }, status=400)
+            
+            # Release payment from escrow
+            success, tx_hash, farmer_amount, loan_deduction = release_order_payment(order)
+            
+            if not success:
+                transaction.set_rollback(True)
+                return Response({'error': tx_hash}, status=400)
         
         response_data = {
             'message': 'Receipt confirmed - payment released to farmer',
@@ -210,19 +367,50 @@ class OrderViewSet(viewsets.ModelViewSet):
         """Raise a dispute for the order."""
         order = self.get_object()
         
-        if order.status not in ['escrow_held', 'dispatched']:
+        if not Order.states.advance(order, 'dispute'):
             return Response({
                 'error': f'Cannot dispute order in {order.status} status'
             }, status=400)
         
-        order.status = 'disputed'
-        order.save()
-        
         return Response({
             'message': 'Dispute raised - admin will review',
             'order': OrderSerializer(order).data
         })
     
+    @action(detail=False, methods=['post'])
+    def settle(self, request):
+        """
+        Confirm delivery of many orders at once and release their escrow
+        in one transaction (e.g. a cooperative's daily drop-off).
+        Orders not dispatched or received are skipped.
+        """
+        order_ids = request.data.get('order_ids')
+        if not isinstance(order_ids, list) or not order_ids:
+            return Response({'error': 'order_ids list required'}, status=400)
+        if len(order_ids) > self.settle_max_orders:
+            return Response({'error': f'At most {self.settle_max_orders} orders per request'}, status=400)
+        
+        try:
+            settlements = settle_orders(order_ids)
+        except (ValueError, DjangoValidationError):
+            return Response({'error': 'Invalid order id'}, status=400)
+        except SettlementConflict as exc:
+            return Response({'error': str(exc)}, status=409)
+        
+        return Response({
+            'settled': len(settlements),
+            'skipped': len(set(order_ids)) - len(settlements),
+            'orders': [
+                {
+                    'id': settlement.order_id,
+                    'transaction_hash': settlement.tx_hash,
+                    'farmer_received': str(settlement.farmer_receives),
+                    'loan_deduction': str(settlement.loan_deduction),
+                }
+                for settlement in settlements
+            ],
+        })
+    
     @action(detail=True, methods=['post'])
     def refund(self, request, pk=None):
         """
@@ -241,15 +429,23 @@ class OrderViewSet(viewsets.ModelViewSet):
             'order': OrderSerializer(order).data
         })
     
-    @action(detail=False, methods=['get'])
+    @action(detail=False, methods=['get'], renderer_classes=NDJSON_RENDERER_CLASSES)
     def my_sales(self, request):
-        """Get orders for farmer's listings (farmer view)."""
+        """
+        Get orders for farmer's listings (farmer view).
+        Send Accept: application/x-ndjson to stream.
+        """
         farmer_id = request.query_params.get('farmer_id')
         if not farmer_id:
             return Response({'error': 'farmer_id required'}, status=400)
         
-        orders = Order.objects.filter(listing__farmer_id=farmer_id)
-        serializer = OrderSerializer(orders, many=True)
+        orders = OrderSerializer.eager_load(
+            Order.objects.filter(listing__farmer_id=farmer_id), request
+        )
+        context = {'request': request}
+        if wants_ndjson(request):
+            return stream_ndjson(orders, OrderSerializer, context=context)
+        serializer = OrderSerializer(orders, many=True, context=context)
         return Response(serializer.data)
 
 
@@ -257,13 +453,40 @@ class CartViewSet(viewsets.ModelViewSet):
     """API endpoint for shopping cart."""
     queryset = CartItem.objects.all()
     serializer_class = CartItemSerializer
+    cursor_ordering = ('-added_at', '-id')
+    query_budgets = {'list': 1, 'summary': 1, 'checkout': 14}
     
     def get_queryset(self):
         queryset = CartItem.objects.all()
         buyer_id = self.request.query_params.get('buyer')
         if buyer_id:
             queryset = queryset.filter(buyer_id=buyer_id)
-        return queryset
+        return CartItemSerializer.eager_load(queryset, self.request)
+    
+    @transaction.atomic
+    def perform_create(self, serializer):
+        item = serializer.save()
+        self._hold(item)
+    
+    @transaction.atomic
+    def perform_update(self, serializer):
+        previous_listing_id = serializer.instance.listing_id
+        item = serializer.save()
+        if item.listing_id != previous_listing_id:
+            release_cart(item.buyer_id, [previous_listing_id])
+        self._hold(item)
+    
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        release_cart(instance.buyer_id, [instance.listing_id])
+        instance.delete()
+    
+    def _hold(self, item):
+        """Hold the item's quantity for the buyer; the cart item is rolled back if stock is short."""
+        try:
+            hold_cart(item.buyer_id, item.listing_id, item.quantity_kg)
+        except ReservationError as exc:
+            raise ValidationError({'quantity_kg': str(exc)})
     
     @action(detail=False, methods=['get'])
     def summary(self, request):
@@ -272,12 +495,13 @@ class CartViewSet(viewsets.ModelViewSet):
         if not buyer_id:
             return Response({'error': 'buyer_id required'}, status=400)
         
-        cart_items = CartItem.objects.filter(buyer_id=buyer_id)
+        # Evaluate once with listings joined; subtotals and items reuse it
+        cart_items = list(CartItem.objects.filter(buyer_id=buyer_id).select_related('listing'))
         total = sum(item.subtotal for item in cart_items)
         
         return Response({
             'items': CartItemSerializer(cart_items, many=True).data,
-            'total_items': cart_items.count(),
+            'total_items': len(cart_items),
             'total_amount': str(total)
         })
     
@@ -285,7 +509,8 @@ class CartViewSet(viewsets.ModelViewSet):
     def checkout(self, request):
         """
         Convert cart to orders.
-        Creates one order per listing (different farmers).
+        Creates one order per listing (different farmers), all or nothing.
+        See marketplace.checkout for the set-based pipeline.
         """
         buyer_id = request.data.get('buyer_id')
         delivery_address = request.data.get('delivery_address', '')
@@ -293,36 +518,11 @@ class CartViewSet(viewsets.ModelViewSet):
         if not buyer_id:
             return Response({'error': 'buyer_id required'}, status=400)
         
-        cart_items = CartItem.objects.filter(buyer_id=buyer_id)
-        
-        if not cart_items.exists():
-            return Response({'error': 'Cart is empty'}, status=400)
-        
-        created_orders = []
-        
-        with transaction.atomic():
-            for item in cart_items:
-                order = Order.objects.create(
-                    listing=item.listing,
-                    buyer_id=buyer_id,
-                    quantity_kg=item.quantity_kg,
-                    price_per_kg=item.listing.price_per_kg,
-                    total_price=item.subtotal,
-                    delivery_address=delivery_address
-                )
-                
-                # Update listing quantity
-                item.listing.quantity_available -= item.quantity_kg
-                if item.listing.quantity_available <= 0:
-                    item.listing.status = 'sold'
-                item.listing.save()
-                
-                created_orders.append(order)
-            
-            # Clear cart
-            cart_items.delete()
+        success, result = checkout_cart(buyer_id, delivery_address)
+        if not success:
+            return Response({'error': result}, status=400)
         
         return Response({
-            'message': f'Created {len(created_orders)} orders',
-            'orders': OrderSerializer(created_orders, many=True).data
+            'message': f'Created {len(result)} orders',
+            'orders': OrderSerializer(result, many=True).data
         })